@@ -9,21 +9,46 @@ Stand-alone application; provides
 - creation of model instances, and WRITE of them to DB
 - READ of data from DB, w. demo of selection based on one or multiple keys
 - presentation (plotting) of data
+
+Sample data of a 'ChannelData'-instance is stored as fixed-size, compressed 'DataChunk'-instances (see 'chunk_codec.py'),
+plus a small open 'head'-chunk which new samples are appended to until it is full and gets sealed.
+Optionally (USE_SEGMENT_FILES), samples are instead stored in append-only segment files on disk (see 'segment_store.py'),
+w. only file offsets and time-ranges - as 'SegmentExtent'-instances - kept in DB.
+Per-bucket aggregates (1s/1m/1h 'SampleRollup'-instances) are updated on each ingest - 'get_aggregates()' reads them whenever
+the requested resolution allows it. Rollups of existing samples are (re-)built w. 'backfill_rollups()'.
 """
 
-from pony.orm import Database, PrimaryKey, Required, Optional, Set, db_session, set_sql_debug, FloatArray
+from pony.orm import Database, PrimaryKey, Required, Optional, Set, db_session, set_sql_debug, FloatArray, composite_index, composite_key, desc
 import time
+from bisect import bisect_left, bisect_right
 from datetime import datetime
 import random
+from itertools import chain
 from dataclasses import dataclass, asdict, field
 # If plotting data is required:
 import matplotlib.pyplot as plt
+import numpy as np
+
+from chunk_codec import encode_chunk, decode_chunk
+from downsample import METHODS, downsample
+from sensor_arrays import SensorArrayData
+from segment_store import SegmentStore, SAMPLE_DTYPE
+from stream_export import iter_sample_blocks, write_blocks
+from meta_cache import ChannelDataCache
+from rollup_buckets import aggregate_buckets, combine_buckets, to_records
+from pony_crud.rollup_resolutions import ROLLUP_RESOLUTIONS, pick_resolution     # Same resolutions as rollups of the Pony API
 
 
 SQL_DEBUG = False
+CHUNK_SIZE = 1024           # No. of samples per sealed 'DataChunk'
+USE_SEGMENT_FILES = False   # If true, NEW 'ChannelData'-instances store samples in segment files instead of in DB
+SEGMENT_DIR = "segments"
+
+segment_store = None        # Created on first use - see 'get_segment_store()'
+channel_cache = ChannelDataCache()      # (hub serial no., channel name) --> 'ChannelData' ID
 
 db = Database()
-db.bind('sqlite', ':memory:')   # In-memory SQLite DB only --> for testing ...
+db.bind('sqlite', ':sharedmemory:')   # In-memory SQLite DB only --> for testing ... ONE DB for all threads (e.g. 'ingest_queue.py' flushes in executor)
 
 # Enable SQL debug:
 if SQL_DEBUG:
@@ -44,10 +69,144 @@ class Channel(db.Entity):
 class ChannelData(db.Entity):
     ch_id = PrimaryKey(int, auto=True)
     start_time = Optional(float, default=0.0)
-    time_points = Optional(FloatArray)
-    data_points = Optional(FloatArray)
+    num_samples = Optional(int, default=0)      # Total no. of samples - in sealed chunks AND head-chunk
+    head_time_points = Optional(FloatArray)     # Open 'head'-chunk - sealed into a 'DataChunk' when CHUNK_SIZE samples reached
+    head_data_points = Optional(FloatArray)
+    chunks = Set("DataChunk")
+    use_segments = Optional(bool, default=lambda: USE_SEGMENT_FILES)   # Flag read when instance is CREATED (not when class is defined)
+    extents = Set("SegmentExtent")
+    rollups = Set("SampleRollup")
     from_channel = Required(Channel)
     to_hub = Optional("SensorHub")
+    composite_key(to_hub, from_channel)         # A channel appears (at most) once per hub - also gives index for lookup on (hub, channel)
+
+    def get_samples(self, start: float = None, end: float = None, limit: int = None) -> tuple:
+        """
+        Get samples of channel w. time-offset in range [start, end] - returns time-offsets and sample-values,
+        as lists (chunk storage) or as NumPy-arrays (segment files).
+        If 'limit' is given, only the LAST 'limit' samples in range are returned.
+        """
+        if self.use_segments:
+            return self.get_segment_samples(start=start, end=end, limit=limit)
+        return self.get_chunk_samples(start=start, end=end, limit=limit)
+
+    def get_chunk_samples(self, start: float = None, end: float = None, limit: int = None) -> tuple:
+        """
+        Decode samples of channel w. time-offset in range [start, end] - returns list of time-offsets and list of sample-values.
+        If 'limit' is given, only the LAST 'limit' samples in range are returned.
+        Samples are stored in time-order (enforced on ingest), so only chunks overlapping the range (per their 't_min'/'t_max') are decoded,
+        newest first, and each decoded chunk is sliced by bisection.
+        """
+        chunk_query = self.chunks.select()
+        if start is not None:
+            chunk_query = chunk_query.filter(lambda chunk: chunk.t_max >= start)
+        if end is not None:
+            chunk_query = chunk_query.filter(lambda chunk: chunk.t_min <= end)
+        #
+        pieces = list()     # Slices of (time-offsets, values) - newest first
+        num_found = 0
+        head = (list(self.head_time_points), list(self.head_data_points))
+        for tv, dv in chain([head], (decode_chunk(chunk.payload) for chunk in chunk_query.order_by(desc(DataChunk.seq_no)))):
+            lo = 0 if start is None else bisect_left(tv, start)
+            hi = len(tv) if end is None else bisect_right(tv, end)
+            if hi > lo:
+                pieces.append((tv[lo:hi], dv[lo:hi]))
+                num_found += hi - lo
+            if limit is not None and num_found >= limit:
+                break
+        #
+        time_points = list()
+        data_points = list()
+        for tv, dv in reversed(pieces):
+            time_points.extend(tv)
+            data_points.extend(dv)
+        if limit is not None:
+            time_points = time_points[max(len(time_points) - limit, 0):]
+            data_points = data_points[max(len(data_points) - limit, 0):]
+        return time_points, data_points
+
+    def get_segment_samples(self, start: float = None, end: float = None, limit: int = None) -> tuple:
+        """
+        Read samples from segment files - only extents overlapping the range are mapped, newest first,
+        and each is sliced by binary search directly on the mapped file.
+        """
+        store = get_segment_store()
+        extent_query = self.extents.select()
+        if start is not None:
+            extent_query = extent_query.filter(lambda extent: extent.t_max >= start)
+        if end is not None:
+            extent_query = extent_query.filter(lambda extent: extent.t_min <= end)
+        #
+        pieces = list()     # Views on mapped segment files - newest first
+        num_found = 0
+        for extent in extent_query.order_by(desc(SegmentExtent.extent_id)):
+            block = store.read(self.ch_id, extent.seg_no, extent.byte_offset, extent.num_samples)
+            lo = 0 if start is None else int(np.searchsorted(block['time'], start, side='left'))
+            hi = block.size if end is None else int(np.searchsorted(block['time'], end, side='right'))
+            if hi > lo:
+                pieces.append(block[lo:hi])
+                num_found += hi - lo
+            if limit is not None and num_found >= limit:
+                break
+        #
+        if len(pieces) == 1:
+            samples = pieces[0]         # Still a view on mapped file
+        elif pieces:
+            samples = np.concatenate(pieces[::-1])
+        else:
+            samples = np.empty(0, dtype=SAMPLE_DTYPE)
+        if limit is not None:
+            samples = samples[max(samples.size - limit, 0):]
+        return samples['time'], samples['value']
+
+    def last_time_offset(self) -> float:
+        """ Time-offset of LAST stored sample - or None if channel has no samples (yet) """
+        if self.num_samples == 0:
+            return None
+        if self.use_segments:
+            return self.extents.select().order_by(desc(SegmentExtent.extent_id)).first().t_max
+        if len(self.head_time_points):
+            return self.head_time_points[-1]
+        return self.chunks.select().order_by(desc(DataChunk.seq_no)).first().t_max
+
+    @property
+    def time_points(self) -> list:
+        return self.get_samples()[0]
+
+    @property
+    def data_points(self) -> list:
+        return self.get_samples()[1]
+
+class DataChunk(db.Entity):
+    chunk_id = PrimaryKey(int, auto=True)
+    seq_no = Required(int)                      # Position of chunk in channel's series (0, 1, 2, ...)
+    num_samples = Required(int)
+    t_min = Required(float)                     # Time-offset of first sample in chunk
+    t_max = Required(float)                     # Time-offset of last sample in chunk
+    payload = Required(bytes, lazy=True)        # Encoded by 'chunk_codec.encode_chunk()' - lazy, i.e. NOT loaded by range-queries on chunks
+    channel = Required(ChannelData)
+    composite_index(channel, seq_no)
+
+class SegmentExtent(db.Entity):
+    extent_id = PrimaryKey(int, auto=True)      # Increasing w. append-order
+    seg_no = Required(int)                      # No. of segment file (per channel)
+    byte_offset = Required(int)                 # Offset of first sample of block in segment file
+    num_samples = Required(int)
+    t_min = Required(float)                     # Time-offset of first sample in block
+    t_max = Required(float)                     # Time-offset of last sample in block
+    channel = Required(ChannelData)
+
+class SampleRollup(db.Entity):
+    rollup_id = PrimaryKey(int, auto=True)
+    resolution = Required(int)                  # Bucket width (seconds) - one of ROLLUP_RESOLUTIONS
+    bucket = Required(int, size=64)             # Bucket START (Epoch-time)
+    num_samples = Required(int, size=64)
+    sum_values = Required(float)
+    min_value = Required(float)
+    max_value = Required(float)
+    sum_squares = Required(float)
+    channel = Required(ChannelData)
+    composite_key(channel, resolution, bucket)
 
 class SensorHub(db.Entity):
     ser_no = PrimaryKey(int)
@@ -79,29 +238,27 @@ class SensorData():
             sensor_values.append(v)
         return time_values, sensor_values
     
-    def info(self):
-        print("================================================================")
-        print("Sensor-data INFO")
-        print("================================================================")
-        print(f"Hub name: {self.hub_name}")
-        print(f"Hub ID: {self.hub_id}")
-        print(f"Channel name: {self.ch_name}")
-        print(f"Description: {self.ch_desc}")
-        print(f"Channel ID: {self.ch_id}")
-        print(f"START-time (first sample): {datetime.fromtimestamp(self.start_datetime)}")
-
-    def show(self):
-        self.info()
+    def info(self, sink=None):
+        print("================================================================", file=sink)
+        print("Sensor-data INFO", file=sink)
+        print("================================================================", file=sink)
+        print(f"Hub name: {self.hub_name}", file=sink)
+        print(f"Hub ID: {self.hub_id}", file=sink)
+        print(f"Channel name: {self.ch_name}", file=sink)
+        print(f"Description: {self.ch_desc}", file=sink)
+        print(f"Channel ID: {self.ch_id}", file=sink)
+        print(f"START-time (first sample): {datetime.fromtimestamp(self.start_datetime)}", file=sink)
+
+    def show(self, sink=None):
+        """ Show info and ALL samples - written in large, formatted blocks to 'sink' (default: stdout) """
+        self.info(sink=sink)
         #
-        print("----------------------------------------------------------------")
-        print("Data:")
-        for time_val, sample_val in self.data:
-            #time_val, sample_val = tv_pair
-            # Get Epoch-time (i.e. 'absolute' time) from START-time + delta-time:
-            absolute_date_time = self.start_datetime + time_val
-            #
-            print(f"DateTime: {datetime.fromtimestamp(absolute_date_time)}\t\tValue = {sample_val:.3f} {self.unit}")
-        print("----------------------------------------------------------------\n")
+        print("----------------------------------------------------------------", file=sink)
+        print("Data:", file=sink)
+        # Get Epoch-time (i.e. 'absolute' time) from START-time + delta-time:
+        time_values, sensor_values = self.sensor_data
+        write_blocks(iter_sample_blocks(time_values, sensor_values, start_datetime=self.start_datetime, unit=self.unit), sink=sink)
+        print("----------------------------------------------------------------\n", file=sink)
 
     def get(self):
         return asdict(self)
@@ -110,7 +267,11 @@ class SensorData():
 # Helper functions:
 
 def plot_time_series(t_values, y_values, title: str = "Time-series Plot", xlabel: str = 'DeltaTime', ylabel: str = 'Value', 
-                    color: str = 'tab:red', x_relative_size: int = 16, y_relative_size: int = 5, resolution_dpi: int = 100):
+                    color: str = 'tab:red', x_relative_size: int = 16, y_relative_size: int = 5, resolution_dpi: int = 100,
+                    max_points: int = None, method: str = "lttb"):
+    # No point in plotting (many) more points than there are pixels ...
+    if max_points is not None and len(t_values) > max_points:
+        t_values, y_values = downsample(t_values, y_values, method=method, num_points=max_points)
     plt.figure(figsize=(x_relative_size, y_relative_size), dpi=resolution_dpi)
     plt.plot(t_values, y_values, color=color)
     plt.ylim(0, 100)
@@ -118,6 +279,94 @@ def plot_time_series(t_values, y_values, title: str = "Time-series Plot", xlabel
     plt.show()
 
 
+# Chunk/segment storage:
+
+def get_segment_store() -> SegmentStore:
+    global segment_store
+    if segment_store is None:
+        segment_store = SegmentStore(base_dir=SEGMENT_DIR)
+    return segment_store
+
+
+def append_samples(channel: ChannelData, time_offsets: np.ndarray, values: np.ndarray) -> None:
+    """ Append samples to head-chunk of channel, sealing every full CHUNK_SIZE samples into a new 'DataChunk' """
+    if channel.use_segments:
+        append_segment_samples(channel, time_offsets, values)
+        return
+    head_t = np.concatenate((np.asarray(channel.head_time_points, dtype=np.float64), time_offsets))
+    head_v = np.concatenate((np.asarray(channel.head_data_points, dtype=np.float64), values))
+    num_sealed = channel.num_samples // CHUNK_SIZE      # No. of chunks already sealed
+    pos = 0
+    while head_t.size - pos >= CHUNK_SIZE:
+        chunk_t = head_t[pos:pos + CHUNK_SIZE]
+        chunk_v = head_v[pos:pos + CHUNK_SIZE]
+        DataChunk(channel=channel, seq_no=num_sealed, num_samples=CHUNK_SIZE, t_min=float(chunk_t.min()), t_max=float(chunk_t.max()),
+                  payload=encode_chunk(chunk_t, chunk_v))
+        num_sealed += 1
+        pos += CHUNK_SIZE
+    # Head-chunk is small - so re-writing it is cheap:
+    channel.head_time_points = head_t[pos:].tolist()
+    channel.head_data_points = head_v[pos:].tolist()
+    channel.num_samples += len(time_offsets)
+
+
+def append_segment_samples(channel: ChannelData, time_offsets: np.ndarray, values: np.ndarray) -> None:
+    """ Append samples as ONE block to channel's segment file, and record its extent in DB """
+    if len(time_offsets) == 0:
+        return
+    seg_no, byte_offset = get_segment_store().append(channel.ch_id, time_offsets, values)
+    SegmentExtent(channel=channel, seg_no=seg_no, byte_offset=byte_offset, num_samples=len(time_offsets),
+                  t_min=float(np.min(time_offsets)), t_max=float(np.max(time_offsets)))
+    channel.num_samples += len(time_offsets)
+
+
+def update_rollups(channel: ChannelData, time_points: np.ndarray, values: np.ndarray) -> None:
+    """ Merge aggregates of new samples (time-points as Epoch-time) into channel's rollups - at ALL resolutions """
+    if len(time_points) == 0:
+        return
+    aggregates = aggregate_buckets(time_points, values, ROLLUP_RESOLUTIONS[0])
+    for resolution in ROLLUP_RESOLUTIONS:
+        aggregates = combine_buckets(resolution, *aggregates)      # Coarser resolutions from finer ones
+        first, last = int(aggregates[0][0]), int(aggregates[0][-1])
+        existing = {rollup.bucket: rollup for rollup in SampleRollup.select(lambda r: r.channel == channel and r.resolution == resolution
+                                                                                    and r.bucket >= first and r.bucket <= last)}
+        for bucket, count, total, min_val, max_val, sum_sq in zip(*(column.tolist() for column in aggregates)):
+            rollup = existing.get(int(bucket))
+            if rollup is None:
+                SampleRollup(channel=channel, resolution=resolution, bucket=int(bucket), num_samples=count, sum_values=total,
+                             min_value=min_val, max_value=max_val, sum_squares=sum_sq)
+            else:
+                rollup.num_samples += count
+                rollup.sum_values += total
+                rollup.min_value = min(rollup.min_value, min_val)
+                rollup.max_value = max(rollup.max_value, max_val)
+                rollup.sum_squares += sum_sq
+
+
+# Hub/channel lookup:
+
+def get_channel_data(hub_id: int, ch_name: str) -> ChannelData:
+    """ Direct lookup on composite key (to_hub, from_channel) - both are primary keys of linked entities, so no join is needed """
+    return ChannelData.get(lambda cd: cd.to_hub.ser_no == hub_id and cd.from_channel.name == ch_name)
+
+
+def resolve_channel_data(hub_id: int, ch_name: str) -> ChannelData:
+    """ 
+    Get 'ChannelData'-instance of channel named 'ch_name' on hub w. serial no. 'hub_id' - or None if not found.
+    Cached ID gives a primary-key lookup; query only on cache miss. Must be called inside a 'db_session'.
+    """
+    ch_id = channel_cache.get(hub_id, ch_name)
+    if ch_id is not None:
+        channel = ChannelData.get(ch_id=ch_id)
+        if channel is not None:
+            return channel
+        channel_cache.invalidate(ser_no=hub_id, ch_name=ch_name)      # Stale entry ...
+    channel = get_channel_data(hub_id, ch_name)
+    if channel is not None:
+        channel_cache.put(hub_id, ch_name, channel.ch_id)
+    return channel
+
+
 # *************************************************** DB 'STORE' functions ************************************************************* 
 
 # Create sensor entities:
@@ -132,6 +381,8 @@ def create_channels_and_hubs():
     SensorHub(ser_no=223, name="TestHub2", channels=(ChannelData(from_channel=bma380_temp), ChannelData(from_channel=adxl255_accel)))
     SensorHub(ser_no=323, name="TestHub3", channels=(ChannelData(from_channel=bma380_temp), ChannelData(from_channel=fxs3008_pressure)))
     SensorHub(ser_no=533, name="TestHub4", channels=(ChannelData(from_channel=bma380_humidity)))
+    # Hub topology changed:
+    channel_cache.invalidate()
 
 
 # Create a single SensorHub entity
@@ -153,39 +404,105 @@ def create_sensor_hub(hub_name: str, ser_no: int, ch_names: list) -> None:
     #
     # Create instance:
     SensorHub(ser_no=ser_no, name=hub_name, channels=ch_data_set)   
+    # Hub topology changed:
+    channel_cache.invalidate(ser_no=ser_no)
 
 
 @db_session
 def add_data_to_hub(id: int = -1, ch_name: str = None, tsd: list = None) -> None:
-    hub = None
-    if id < 0:
-        print("Invalid ID given! Cannot proceed ...")
-        return
     if tsd is None:
         print("No data given! Cannot proceed ...")
         return
-    # Get hub:
+    # Split (time, value)-tuples into two columns - in one go:
+    samples = np.asarray(tsd, dtype=np.float64).reshape(-1, 2)
+    add_array_data_to_hub(id=id, ch_name=ch_name, time_points=samples[:, 0], data_points=samples[:, 1])
+
+
+@db_session
+def add_array_data_to_hub(id: int = -1, ch_name: str = None, time_points=None, data_points=None) -> int:
+    """
+    Bulk ingest - time-points (Epoch-time) and data-points given as NumPy-arrays, or any buffer-protocol object of floats.
+    Time-points must be in time-order, and not older than LAST sample already stored - else batch is rejected.
+    Returns no. of samples added.
+    """
+    if id < 0:
+        print("Invalid ID given! Cannot proceed ...")
+        return 0
+    if time_points is None or data_points is None:
+        print("No data given! Cannot proceed ...")
+        return 0
+    time_points = np.asarray(time_points, dtype=np.float64)
+    data_points = np.asarray(data_points, dtype=np.float64)
+    if time_points.shape != data_points.shape:
+        print(f"ERROR: {time_points.size} time values != {data_points.size} data values!! Cannot add data ...\n")
+        return 0
+    # Get channel of hub:
     try:
-        hub = SensorHub[id]   
-        if hub is None:
-           print(f"No 'SensorHub' entity w. ID {id} found!! Giving up ...")
-           return                            
+        channel = resolve_channel_data(id, ch_name)
     except Exception as ex:
-        print(f"Query for 'SensorHub' entity w. ID {id} exploded!! Reason: {ex}")
-        return
+        print(f"Query for channel '{ch_name}' of 'SensorHub' entity w. ID {id} exploded!! Reason: {ex}")
+        return 0
     #
-    channel_query = hub.channels.select(lambda cd: cd.from_channel.name == ch_name)
-    channel = channel_query.first()
     if channel:
-        if channel.start_time == 0:
-            channel.start_time = time.time()
-        for ts_point in tsd:
-            time_point, data_point = ts_point
-            channel.time_points.append(channel.start_time - time_point)     # Store delta-time = offset from START-time!
-            channel.data_points.append(data_point)
-        print(f"Added {len(tsd)} data-points to channel '{ch_name}' of hub entity {id} named '{hub.name}' ...\n")
-    else:
-        print(f"ERROR: channel named '{ch_name}' NOT found! Could not add data ...\n")
+        return store_array_data(channel, time_points, data_points)
+    print(f"ERROR: channel named '{ch_name}' NOT found on hub entity {id}! Could not add data ...\n")
+    return 0
+
+
+def store_array_data(channel: ChannelData, time_points: np.ndarray, data_points: np.ndarray) -> int:
+    """ Add samples (float64-arrays, time-points as Epoch-time) to channel - see 'add_array_data_to_hub()'. Must be called inside a 'db_session' """
+    ch_name, id = channel.from_channel.name, channel.to_hub.ser_no
+    # Range-reads bisect the stored samples, so they MUST be in time-order - within batch AND after samples already stored:
+    if np.any(time_points[1:] < time_points[:-1]):
+        print(f"ERROR: time-points NOT in time-order! Could not add data to channel '{ch_name}' of hub entity {id} ...\n")
+        return 0
+    if channel.start_time == 0 and time_points.size:
+        channel.start_time = float(time_points[0])          # START-time = time of first sample
+    # Store delta-time = offset from START-time!
+    time_offsets = time_points - channel.start_time
+    last_offset = channel.last_time_offset()
+    if time_offsets.size and last_offset is not None and time_offsets[0] < last_offset:
+        print(f"ERROR: time-points older than LAST stored sample! Could not add data to channel '{ch_name}' of hub entity {id} ...\n")
+        return 0
+    append_samples(channel, time_offsets, data_points)
+    update_rollups(channel, time_points, data_points)
+    print(f"Added {time_points.size} data-points to channel '{ch_name}' of hub entity {id} ...\n")
+    return time_points.size
+
+
+@db_session
+def add_batches_to_hubs(batches: dict = None) -> int:
+    """
+    Add batches of samples to MANY hubs/channels - in ONE transaction. Batches given as (hub ID, channel name) --> (time-points, data-points).
+    Returns no. of samples added. DB errors are raised - i.e. NO batch is stored - while a batch of an unknown channel,
+    or NOT in time-order, is skipped (w. a message, as in 'add_array_data_to_hub()')
+    """
+    num_added = 0
+    for (hub_id, ch_name), (time_points, data_points) in batches.items():
+        channel = resolve_channel_data(hub_id, ch_name)
+        if not channel:
+            print(f"ERROR: channel named '{ch_name}' NOT found on hub entity {hub_id}! Could not add data ...\n")
+            continue
+        num_added += store_array_data(channel, np.asarray(time_points, dtype=np.float64), np.asarray(data_points, dtype=np.float64))
+    return num_added
+
+
+@db_session
+def backfill_rollups(hub_id: int = None, ch_name: str = None) -> int:
+    """ (Re-)build rollups from stored samples - of ALL channels, or only those of hub 'hub_id' and/or named 'ch_name'. Returns no. of rollups """
+    channels = ChannelData.select()
+    if hub_id is not None:
+        channels = channels.filter(lambda cd: cd.to_hub.ser_no == hub_id)
+    if ch_name is not None:
+        channels = channels.filter(lambda cd: cd.from_channel.name == ch_name)
+    num_rollups = 0
+    for channel in channels:
+        channel.rollups.clear()
+        x_vals, y_vals = channel.get_samples()
+        # Samples are stored as offsets from START-time, rollups are aligned to Epoch:
+        update_rollups(channel, np.asarray(x_vals, dtype=np.float64) + channel.start_time, y_vals)
+        num_rollups += channel.rollups.count()
+    return num_rollups
 
 
 # *************************************************** DB 'LOAD' functions ************************************************************* 
@@ -212,7 +529,8 @@ def get_hubs_and_show_info():
 
 
 @db_session
-def show_data_from_hub(id: int = -1, ch_name: str = None) -> None:
+def show_data_from_hub(id: int = -1, ch_name: str = None, sink=None) -> None:
+    """ Show data from one channel (or all channels, if no name given) of hub - samples written in large blocks to 'sink' (default: stdout) """
     hub = None
     if id < 0:
         print("Invalid ID given! Cannot proceed ...")       # Redundant - will be caught by exception-check below anyway, but OK here ...
@@ -227,22 +545,20 @@ def show_data_from_hub(id: int = -1, ch_name: str = None) -> None:
         print(f"Query for 'SensorHub' entity w. ID {id} exploded!! Resaon: {ex}")
         return
     #
+    # If a specific name is given, show data ONLY from this channel - else show all channels:
+    if ch_name:
+        channel = resolve_channel_data(id, ch_name)
+        channels = [channel] if channel else list()
+    else:
+        channels = hub.channels
     found_channel = False
-    for channel in hub.channels:
+    for channel in channels:
+        found_channel = True
         # Get associated channel-data's channel name:
         current_channel_name = channel.from_channel.name
-        if ch_name:
-            # If a specific name is given, show data ONLY from this channel - else show all channels:
-            if current_channel_name != ch_name:
-                continue
-            else:
-                found_channel = True
-        else:
-            found_channel = True
         # Get channel SI-unit
         unit = channel.from_channel.si_unit
-        x_vals = channel.time_points
-        y_vals = channel.data_points
+        x_vals, y_vals = channel.get_samples()
         num_time_values = len(x_vals)
         num_data_values = len(y_vals)
         if num_time_values == 0:
@@ -252,53 +568,109 @@ def show_data_from_hub(id: int = -1, ch_name: str = None) -> None:
             print(f"ERROR: data inconsistency - {num_time_values} time values != {num_data_values} data values!! Cannot show data for channel '{current_channel_name}'...")
             continue
         # Show data:
-        print(f"\nChannel {current_channel_name} (description: '{channel.from_channel.description}') data:")
-        print("-------------------------------------------------------------------------------------------------")
-        for idx in range(num_time_values):
-            print(f"Sample {idx}: time = {x_vals[idx]:.3f}, value = {y_vals[idx]:.3f} {unit}")
-        print("-----------------------------------------------------------------------------------------------\n")
+        print(f"\nChannel {current_channel_name} (description: '{channel.from_channel.description}') data:", file=sink)
+        print("-------------------------------------------------------------------------------------------------", file=sink)
+        write_blocks(iter_sample_blocks(x_vals, y_vals, unit=unit, absolute_time=False), sink=sink)
+        print("-----------------------------------------------------------------------------------------------\n", file=sink)
     #
     if not found_channel:
         print(f"INFO: did not find channel named '{ch_name}'!")
 
 
 @db_session
-def get_sensor_data(hub_id: int = -1, ch_name: str = None) -> None:
-    hub = None
+def get_sensor_data(hub_id: int = -1, ch_name: str = None, start: float = None, end: float = None, limit: int = None,
+                    max_points: int = None, bucket_width: float = None, method: str = None, as_arrays: bool = False) -> None:
+    """
+    Get data from channel of hub - optionally only samples in Epoch-time range [start, end], and/or only the LAST 'limit' samples.
+    If 'max_points' or 'bucket_width' (in seconds) is given, data is downsampled w. 'method' - one of 'mean', 'minmax' or 'lttb'
+    (default: 'mean' if 'bucket_width' is given, else 'lttb'). NOTE: 'lttb' selects 'max_points' samples, i.e. ignores 'bucket_width'.
+    If 'as_arrays' is set, data is returned as (array-backed) 'SensorArrayData' instead of 'SensorData'.
+    """
     if hub_id < 0:
-        print("Invalid ID given! Cannot proceed ...")       # Redundant - will be caught by exception-check below anyway, but OK here ...
+        print("Invalid ID given! Cannot proceed ...")
         return None
-    # Get hub:
+    if method is None:
+        method = "mean" if bucket_width is not None else "lttb"
+    if method not in METHODS:
+        print(f"Unknown downsampling method '{method}' - must be one of {METHODS}! Cannot proceed ...")
+        return None
+    if method == "lttb" and bucket_width is not None and max_points is None:
+        print("Downsampling w. 'lttb' requires 'max_points' (not 'bucket_width')! Cannot proceed ...")
+        return None
+    # Get channel of hub:
     try:
-        hub = SensorHub[hub_id]    
-        if hub is None:
-            print(f"No 'SensorHub' entity w. ID {id} found!! ID={id} non-existent!")            
-            return          
+        channel = resolve_channel_data(hub_id, ch_name)
     except Exception as ex:
-        print(f"Query for 'SensorHub' entity w. ID {id} exploded!! Resaon: {ex}")
-        return
-    #
-    # Get channel:
-    channel_query = hub.channels.select(lambda cd: cd.from_channel.name == ch_name)
-    channel = channel_query.first()
-    if channel:
-        print(f"Got {len(channel.data_points)} data-points from channel '{ch_name}' of hub entity {id} named '{hub.name}' ...\n")
-    else:
-        print(f"ERROR: channel named '{ch_name}' NOT found! Could not GET sensor-data ...\n")
+        print(f"Query for channel '{ch_name}' of 'SensorHub' entity w. ID {hub_id} exploded!! Reason: {ex}")
+        return None
+    if not channel:
+        print(f"ERROR: channel named '{ch_name}' NOT found on hub entity {hub_id}! Could not GET sensor-data ...\n")
         return None
+    hub = channel.to_hub
     # Get channel attributes:
     unit = channel.from_channel.si_unit
     description = channel.from_channel.description 
     start_time = channel.start_time
     ch_id = channel.ch_id
-    x_vals = channel.time_points
-    y_vals = channel.data_points
+    # Time-range given as Epoch-time, while samples are stored as offsets from START-time:
+    start_offset = None if start is None else start - start_time
+    end_offset = None if end is None else end - start_time
+    x_vals, y_vals = channel.get_samples(start=start_offset, end=end_offset, limit=limit)
+    print(f"Got {len(y_vals)} data-points from channel '{ch_name}' of hub entity {hub_id} named '{hub.name}' ...\n")
+    if len(y_vals) and (bucket_width is not None or (max_points is not None and len(y_vals) > max_points)):
+        x_vals, y_vals = downsample(x_vals, y_vals, method=method, num_points=max_points, bucket_width=bucket_width)
+    if as_arrays:
+        return SensorArrayData(hub_name=hub.name, hub_id=hub_id, ch_name=ch_name, ch_desc=description, ch_id=ch_id, unit=unit, 
+                               start_datetime=start_time, time_values=x_vals, sensor_values=y_vals)
+    if isinstance(y_vals, np.ndarray):
+        x_vals, y_vals = x_vals.tolist(), y_vals.tolist()
     # Make data-tuple:
     time_series_data = list(zip(x_vals, y_vals))    # TODO: make an additional 'TimeSeriesDataPoint' dataclass?
     #
     return SensorData(hub_name=hub.name, hub_id=hub_id, ch_name=ch_name, ch_desc=description, ch_id=ch_id, unit=unit, start_datetime=start_time, data=time_series_data)
 
 
+@db_session
+def get_aggregates(hub_id: int = -1, ch_name: str = None, bucket_width: float = 60, start: float = None, end: float = None) -> list:
+    """
+    Aggregates of channel of hub per 'bucket_width' seconds (buckets aligned to Epoch), in Epoch-time range [start, end) - as list of dicts
+    (see 'rollup_buckets.to_records()'). Read from rollups if bucket width and time-range are multiples of a rollup resolution - else from samples
+    """
+    channel = resolve_channel_data(hub_id, ch_name)
+    if not channel:
+        print(f"ERROR: channel named '{ch_name}' NOT found on hub entity {hub_id}! Could not GET aggregates ...\n")
+        return None
+    resolution = pick_resolution(bucket_width, start=start, end=end)
+    if resolution is not None:
+        rollups = channel.rollups.select(lambda r: r.resolution == resolution)
+        if start is not None:
+            rollups = rollups.filter(lambda r: r.bucket >= start)
+        if end is not None:
+            rollups = rollups.filter(lambda r: r.bucket < end)
+        rows = rollups.order_by(SampleRollup.bucket)[:]
+        columns = [[getattr(r, attr) for r in rows] for attr in ('bucket', 'num_samples', 'sum_values', 'min_value', 'max_value', 'sum_squares')]
+        return to_records(combine_buckets(bucket_width, *columns))
+    # From samples - stored as offsets from START-time:
+    start_offset = None if start is None else start - channel.start_time
+    end_offset = None if end is None else end - channel.start_time
+    x_vals, y_vals = channel.get_samples(start=start_offset, end=end_offset)
+    time_points = np.asarray(x_vals, dtype=np.float64) + channel.start_time
+    y_vals = np.asarray(y_vals, dtype=np.float64)
+    if end is not None:
+        in_range = time_points < end        # 'get_samples()' range is closed - aggregates use half-open range
+        time_points, y_vals = time_points[in_range], y_vals[in_range]
+    return to_records(aggregate_buckets(time_points, y_vals, bucket_width))
+
+
+def iter_sensor_data_blocks(hub_id: int = -1, ch_name: str = None, start: float = None, end: float = None, limit: int = None):
+    """ Generator of formatted text blocks w. samples from channel of hub - e.g. for a streamed HTTP-response """
+    sensor_data = get_sensor_data(hub_id=hub_id, ch_name=ch_name, start=start, end=end, limit=limit, as_arrays=True)
+    if sensor_data is None:
+        return
+    yield from iter_sample_blocks(sensor_data.time_values, sensor_data.sensor_values, start_datetime=sensor_data.start_datetime, 
+                                  unit=sensor_data.unit)
+
+
 # ******************************************************* Test-helpers: ********************************************************************
 
 def generate_dummy_data(num_samples: int = 10, min_val: int = -100, max_val: int = 100, factor: float = 0.025) -> list:
@@ -367,7 +739,7 @@ if __name__ == "__main__":
     show_data_from_hub(id=533, ch_name='BMA280_temp')       # Should FAIL! (non-existent channel-name ...)
     #
     # Test 'get_sensor_data()':
-    UUT = get_sensor_data(hub_id=533, ch_name='BMA380_humidity')
+    UUT = get_sensor_data(hub_id=533, ch_name='BMA380_humidity', as_arrays=True)
     UUT.show()
     sensor_ch_info = UUT.get()
     print()
@@ -381,10 +753,9 @@ if __name__ == "__main__":
     # And - for fun - plot data ...
     plot_title = f"Sensor-data from hub {sensor_ch_info.get('hub_id')}, named '{sensor_ch_info.get('hub_name')}': channel = '{sensor_ch_info.get('ch_name')}'"
     plot_legend = f"{sensor_ch_info.get('ch_desc')} - in [{sensor_ch_info.get('unit')}]"
-    sensor_data = sensor_ch_info.get('data')
     #
     tv, dv = UUT.sensor_data
     #
-    plot_time_series(t_values=tv, y_values=dv, title=plot_title, ylabel=plot_legend)
+    plot_time_series(t_values=tv, y_values=dv, title=plot_title, ylabel=plot_legend, max_points=2000)
 
 
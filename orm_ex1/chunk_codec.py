@@ -0,0 +1,171 @@
+"""
+@file chunk_codec.py
+
+@brief Compressed encoding of time-series chunks, Gorilla-style.
+
+Layout of an encoded chunk:
+- no. of samples, as little-endian uint32
+- one bit-stream w. (timestamp, value) pairs interleaved, where
+  - timestamps are quantized to TIME_RESOLUTION and stored as delta-of-delta values w. variable-length prefix codes
+  - values are stored as XOR of the IEEE-754 bit pattern against previous value (leading/trailing zero-bits elided)
+First pair of a chunk is stored raw (64 + 64 bits), so every chunk can be decoded on its own.
+"""
+
+import struct
+
+import numpy as np
+
+
+TIME_RESOLUTION = 1e-6          # Timestamps quantized to 1us --> plenty for sample rates up to ~100kHz
+
+# Delta-of-delta prefix codes: (prefix, no. of prefix bits, no. of value bits). A DoD of zero is a single '0'-bit.
+DOD_BUCKETS = ((0b10, 2, 7), (0b110, 3, 9), (0b1110, 4, 12), (0b11110, 5, 32))
+DOD_FALLBACK = (0b11111, 5, 64)
+DOD_VALUE_BITS = (None,) + tuple(value_bits for _, _, value_bits in DOD_BUCKETS + (DOD_FALLBACK,))     # By no. of '1'-bits in prefix
+
+HEADER = struct.Struct('<I')
+
+
+# ****************************************** Bit-level I/O *********************************************
+
+class BitWriter():
+    """ Append-only bit-stream, MSB first """
+    def __init__(self) -> None:
+        self.buffer = bytearray()
+        self.acc = 0            # Bits not yet flushed to buffer
+        self.num_bits = 0       # No. of bits in 'acc'
+
+    def write(self, value: int, num_bits: int) -> None:
+        self.acc = (self.acc << num_bits) | (value & ((1 << num_bits) - 1))
+        self.num_bits += num_bits
+        while self.num_bits >= 8:
+            self.num_bits -= 8
+            self.buffer.append((self.acc >> self.num_bits) & 0xFF)
+        self.acc &= (1 << self.num_bits) - 1
+
+    def getvalue(self) -> bytes:
+        if self.num_bits:
+            # Pad last byte w. zero-bits:
+            return bytes(self.buffer) + bytes([(self.acc << (8 - self.num_bits)) & 0xFF])
+        return bytes(self.buffer)
+
+
+# ****************************************** Helpers *********************************************
+
+def sign_extend(value: int, num_bits: int) -> int:
+    if value & (1 << (num_bits - 1)):
+        return value - (1 << num_bits)
+    return value
+
+
+def write_dod(writer: BitWriter, dod: int) -> None:
+    if dod == 0:
+        writer.write(0, 1)
+        return
+    for prefix, prefix_bits, value_bits in DOD_BUCKETS:
+        if -(1 << (value_bits - 1)) <= dod < (1 << (value_bits - 1)):
+            writer.write(prefix, prefix_bits)
+            writer.write(dod, value_bits)
+            return
+    prefix, prefix_bits, value_bits = DOD_FALLBACK
+    writer.write(prefix, prefix_bits)
+    writer.write(dod, value_bits)
+
+
+# ****************************************** Encode/decode *********************************************
+
+def encode_chunk(time_offsets, values) -> bytes:
+    """ Encode sequence (or array) of time-offsets and sequence of sample-values (same length) into chunk payload """
+    num_samples = len(time_offsets)
+    if num_samples != len(values):
+        raise ValueError(f"Got {num_samples} time values but {len(values)} data values!")
+    if num_samples == 0:
+        return HEADER.pack(0)
+    # Quantize, and compute deltas-of-deltas and XORs for whole chunk up front - only bit-packing is done per sample:
+    ts_values = np.rint(np.asarray(time_offsets, dtype=np.float64) / TIME_RESOLUTION).astype(np.int64)
+    dods = np.diff(np.diff(ts_values), prepend=0).tolist()
+    bit_values = np.ascontiguousarray(values, dtype=np.float64).view(np.uint64)
+    xors = (bit_values[1:] ^ bit_values[:-1]).tolist()
+    #
+    writer = BitWriter()
+    writer.write(int(ts_values[0]), 64)
+    writer.write(int(bit_values[0]), 64)
+    prev_leading = prev_trailing = -1           # No XOR-window (yet)
+    for dod, xor in zip(dods, xors):
+        # Timestamp:
+        write_dod(writer, dod)
+        # Value:
+        if xor == 0:
+            writer.write(0, 1)
+        else:
+            leading = min(64 - xor.bit_length(), 31)        # Must fit in 5 bits
+            trailing = (xor & -xor).bit_length() - 1
+            if prev_leading >= 0 and leading >= prev_leading and trailing >= prev_trailing:
+                # Meaningful bits fit inside previous window:
+                writer.write(0b10, 2)
+                writer.write(xor >> prev_trailing, 64 - prev_leading - prev_trailing)
+            else:
+                meaningful = 64 - leading - trailing
+                writer.write(0b11, 2)
+                writer.write(leading, 5)
+                writer.write(meaningful, 6)                 # 64 wraps to 0 - decoded back to 64
+                writer.write(xor >> trailing, meaningful)
+                prev_leading, prev_trailing = leading, trailing
+    #
+    return HEADER.pack(num_samples) + writer.getvalue()
+
+
+def decode_chunk(payload: bytes) -> tuple:
+    """
+    Decode chunk payload into list of time-offsets and list of sample-values.
+    Bit-stream is unpacked ONCE into a str of '0'/'1'-chars, and read w. a moving offset - so a read only slices the bits it needs,
+    i.e. costs O(1) in chunk size. Timestamps and XOR'ed bit patterns are converted to floats for whole chunk at the end.
+    """
+    num_samples, = HEADER.unpack_from(payload)
+    if num_samples == 0:
+        return [], []
+    data = payload[HEADER.size:]
+    stream = format(int.from_bytes(data, 'big'), f"0{len(data) * 8}b")
+    ts = sign_extend(int(stream[:64], 2), 64)
+    bits = int(stream[64:128], 2)
+    pos = 128
+    ts_values = [ts]
+    bit_values = [bits]
+    delta = leading = trailing = 0
+    dod_value_bits = DOD_VALUE_BITS
+    for _ in range(num_samples - 1):
+        # Timestamp - '0' is a DoD of zero, else no. of '1'-bits in prefix (max. 5) gives bucket:
+        if stream[pos] == '1':
+            ones = stream.find('0', pos, pos + 5) - pos
+            if ones < 0:
+                ones = 5
+            value_bits = dod_value_bits[ones]
+            pos += ones + (ones < 5)                        # Prefix incl. its terminating '0'-bit (none after 5 '1'-bits)
+            dod = int(stream[pos:pos + value_bits], 2)
+            if dod >> (value_bits - 1):
+                dod -= 1 << value_bits                      # Sign-extend (inline - this is the hot loop)
+            delta += dod
+            pos += value_bits
+        else:
+            pos += 1
+        ts += delta
+        # Value:
+        if stream[pos] == '1':
+            if stream[pos + 1] == '1':
+                leading = int(stream[pos + 2:pos + 7], 2)
+                meaningful = int(stream[pos + 7:pos + 13], 2) or 64
+                trailing = 64 - leading - meaningful
+                pos += 13
+            else:
+                meaningful = 64 - leading - trailing
+                pos += 2
+            bits ^= int(stream[pos:pos + meaningful], 2) << trailing
+            pos += meaningful
+        else:
+            pos += 1
+        ts_values.append(ts)
+        bit_values.append(bits)
+    #
+    time_offsets = np.array(ts_values, dtype=np.int64) * TIME_RESOLUTION
+    values = np.array(bit_values, dtype=np.uint64).view(np.float64)
+    return time_offsets.tolist(), values.tolist()
@@ -0,0 +1,17 @@
+"""
+@file conftest.py
+
+@brief Shared pytest fixtures - 'channels.py' binds ONE DB per process, so its tables are created once per test session.
+"""
+
+import pytest
+
+
+@pytest.fixture(scope="session")
+def channel_db():
+    """ DB of 'channels.py' w. tables, and the demo channels/hubs of 'create_channels_and_hubs()' """
+    import channels         # Here - tests w/o channel store need neither it nor matplotlib
+    channels.db.generate_mapping(create_tables=True)
+    channels.create_channels_and_hubs()
+    yield channels.db
+    channels.db.disconnect()
@@ -0,0 +1,99 @@
+"""
+@file downsample.py
+
+@brief Server-side downsampling of time-series, for plotting/transfer of large series.
+
+Supported methods:
+- 'mean'   : mean of time- and sample-values per time-bucket
+- 'minmax' : min/max envelope per time-bucket (returned interleaved as two points per bucket when used via 'downsample()')
+- 'lttb'   : Largest-Triangle-Three-Buckets - keeps visual shape w. a fixed no. of points
+
+Time-values are assumed sorted (ascending). Buckets are either given by a target no. of buckets/points, or by a bucket width
+in same unit as time-values (seconds).
+"""
+
+import numpy as np
+
+
+METHODS = ("mean", "minmax", "lttb")
+
+
+# ****************************************** Helpers *********************************************
+
+def bucket_starts(t_values: np.ndarray, num_buckets: int = None, bucket_width: float = None) -> np.ndarray:
+    """ Get index of first sample in each NON-empty time-bucket """
+    if bucket_width is None:
+        if not num_buckets or num_buckets < 1:
+            raise ValueError("Either 'num_buckets' or 'bucket_width' must be given!")
+        bucket_width = (t_values[-1] - t_values[0]) / num_buckets
+    if bucket_width <= 0:
+        return np.zeros(1, dtype=np.intp)          # All samples at same time --> one bucket
+    edges = t_values[0] + bucket_width * np.arange(int(np.ceil((t_values[-1] - t_values[0]) / bucket_width)) + 1)
+    return np.unique(np.searchsorted(t_values, edges[:-1], side='left'))
+
+
+# ****************************************** Downsampling methods *********************************************
+
+def downsample_mean(t_values, y_values, num_buckets: int = None, bucket_width: float = None) -> tuple:
+    """ Mean time and mean value per time-bucket """
+    t_values = np.asarray(t_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    if t_values.size == 0:
+        return t_values, y_values
+    starts = bucket_starts(t_values, num_buckets=num_buckets, bucket_width=bucket_width)
+    counts = np.diff(np.append(starts, t_values.size))
+    return np.add.reduceat(t_values, starts) / counts, np.add.reduceat(y_values, starts) / counts
+
+
+def downsample_minmax(t_values, y_values, num_buckets: int = None, bucket_width: float = None) -> tuple:
+    """ Min/max envelope per time-bucket - returns bucket START-times, min-values and max-values """
+    t_values = np.asarray(t_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    if t_values.size == 0:
+        return t_values, y_values, y_values
+    starts = bucket_starts(t_values, num_buckets=num_buckets, bucket_width=bucket_width)
+    return t_values[starts], np.minimum.reduceat(y_values, starts), np.maximum.reduceat(y_values, starts)
+
+
+def downsample_lttb(t_values, y_values, num_points: int) -> tuple:
+    """ Largest-Triangle-Three-Buckets - selects 'num_points' samples (first and last always included) """
+    t_values = np.asarray(t_values, dtype=np.float64)
+    y_values = np.asarray(y_values, dtype=np.float64)
+    num_samples = t_values.size
+    if num_points >= num_samples or num_points < 3:
+        return t_values, y_values
+    # Equal-count buckets for all samples except first and last:
+    edges = np.linspace(1, num_samples - 1, num_points - 1).astype(np.intp)
+    selected = np.empty(num_points, dtype=np.intp)
+    selected[0] = 0
+    selected[-1] = num_samples - 1
+    prev = 0
+    for idx in range(num_points - 2):
+        lo, hi = edges[idx], edges[idx + 1]
+        # Average point of NEXT bucket (or last sample, for last bucket):
+        next_lo, next_hi = hi, (edges[idx + 2] if idx + 2 < len(edges) else num_samples)
+        avg_t = t_values[next_lo:next_hi].mean()
+        avg_y = y_values[next_lo:next_hi].mean()
+        # Pick point in current bucket spanning largest triangle w. previously selected point and next bucket's average:
+        areas = np.abs((t_values[prev] - avg_t) * (y_values[lo:hi] - y_values[prev]) - (t_values[prev] - t_values[lo:hi]) * (avg_y - y_values[prev]))
+        prev = lo + int(np.argmax(areas))
+        selected[idx + 1] = prev
+    return t_values[selected], y_values[selected]
+
+
+def downsample(t_values, y_values, method: str = "lttb", num_points: int = None, bucket_width: float = None) -> tuple:
+    """
+    Downsample time-series to approx. 'num_points' points (or to buckets of 'bucket_width') - returns time-values and sample-values.
+    For 'minmax', each bucket gives two points: (START-time, min) and (START-time, max) - so 'num_points' counts both.
+    """
+    if method == "mean":
+        return downsample_mean(t_values, y_values, num_buckets=num_points, bucket_width=bucket_width)
+    if method == "minmax":
+        t_out, y_min, y_max = downsample_minmax(t_values, y_values, num_buckets=None if num_points is None else max(num_points // 2, 1),
+                                                 bucket_width=bucket_width)
+        return np.repeat(t_out, 2), np.column_stack((y_min, y_max)).ravel()
+    if method == "lttb":
+        if num_points is None:
+            raise ValueError("LTTB requires 'num_points'!")
+        return downsample_lttb(t_values, y_values, num_points=num_points)
+    raise ValueError(f"Unknown downsampling method '{method}' - must be one of {METHODS}")
@@ -0,0 +1,131 @@
+"""
+@file ingest_queue.py
+
+@brief Coalescing ingest pipeline - sample batches pushed by (many) hubs are queued, merged per (hub, channel),
+and flushed to DB in ONE transaction when either a size threshold or a time threshold is reached.
+
+Usage (inside a running asyncio event loop):
+    queue = IngestQueue(flush_fn=add_batches_to_hubs)
+    await queue.start()
+    await queue.put(hub_id, ch_name, time_points, data_points)
+    ...
+    await queue.stop()          # Flushes whatever is pending
+'flush_fn' is a blocking function taking a dict of (hub ID, channel name) --> (time-points array, data-points array), and returning
+no. of samples written - it is run in the event loop's default executor, so DB-work does not block the loop. It must RAISE if the write
+fails: the batches then stay pending, and are retried by the next flush.
+NOTE: the DB must therefore be reachable from other threads - with PonyORM, a plain ':memory:' SQLite DB is NOT (use ':sharedmemory:' or a file).
+"""
+
+import asyncio
+import time
+
+import numpy as np
+
+
+MAX_QUEUE_SIZE = 1000           # Max. no. of queued (un-merged) batches - 'put()' waits when full (i.e. back-pressure)
+MAX_BATCH_SAMPLES = 50_000      # Flush when this many samples are pending ...
+MAX_LATENCY = 1.0               # ... or when oldest pending sample has waited this long (seconds)
+
+
+class IngestQueue():
+    def __init__(self, flush_fn, max_queue_size: int = MAX_QUEUE_SIZE, max_batch_samples: int = MAX_BATCH_SAMPLES,
+                 max_latency: float = MAX_LATENCY) -> None:
+        self.flush_fn = flush_fn
+        self.max_batch_samples = max_batch_samples
+        self.max_latency = max_latency
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.pending = dict()           # (hub ID, channel name) --> (list of time-arrays, list of data-arrays)
+        self.num_pending = 0            # No. of samples in 'pending'
+        self.first_pending_time = None  # Monotonic time when first of pending samples arrived (or of last failed flush)
+        self.flush_failed = False       # Last flush failed --> retry only when 'max_latency' has passed, not on each new batch
+        self.task = None
+        # Stats:
+        self.num_flushes = 0
+        self.num_failed_flushes = 0
+        self.num_samples_flushed = 0    # No. of samples actually written (as returned by 'flush_fn')
+
+    async def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """ Stop consumer task - all queued and pending samples are flushed first. Raises if that flush fails (samples stay pending) """
+        if self.task is None:
+            return
+        # Sentinel, queued after ALL batches put so far - consumer merges them, flushes and exits (i.e. is never cancelled mid-flush):
+        await self.queue.put(None)
+        task, self.task = self.task, None
+        await task
+
+    async def put(self, hub_id: int, ch_name: str, time_points, data_points) -> None:
+        time_points = np.asarray(time_points, dtype=np.float64)
+        data_points = np.asarray(data_points, dtype=np.float64)
+        if time_points.shape != data_points.shape:
+            raise ValueError(f"Got {time_points.size} time values but {data_points.size} data values!")
+        await self.queue.put((hub_id, ch_name, time_points, data_points))
+
+    def merge(self, hub_id: int, ch_name: str, time_points: np.ndarray, data_points: np.ndarray) -> None:
+        time_arrays, data_arrays = self.pending.setdefault((hub_id, ch_name), (list(), list()))
+        time_arrays.append(time_points)
+        data_arrays.append(data_points)
+        if self.first_pending_time is None:
+            self.first_pending_time = time.monotonic()
+        self.num_pending += time_points.size
+
+    async def run(self) -> None:
+        while True:
+            if self.first_pending_time is None:
+                timeout = None
+            else:
+                timeout = max(self.first_pending_time + self.max_latency - time.monotonic(), 0.0)
+            try:
+                batch = await asyncio.wait_for(self.queue.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self.try_flush()
+                continue
+            try:
+                if batch is None:
+                    await self.flush()          # Sentinel from 'stop()' - final flush, failure is raised
+                    return
+                self.merge(*batch)
+                if self.num_pending >= self.max_batch_samples and not self.flush_failed:
+                    await self.try_flush()
+            finally:
+                self.queue.task_done()
+
+    async def try_flush(self) -> None:
+        """ Flush from consumer task - a failed flush is reported, and retried when 'max_latency' has passed """
+        try:
+            await self.flush()
+        except Exception as ex:
+            print(f"Flush of {self.num_pending} samples to DB exploded! Retry in {self.max_latency}s. Reason: {ex}")
+            self.num_failed_flushes += 1
+            self.flush_failed = True
+            self.first_pending_time = time.monotonic()
+
+    async def flush(self) -> None:
+        """
+        Write ALL pending samples - in one call to 'flush_fn' (i.e. one transaction). If it raises, the samples are put back
+        in front of any merged meanwhile (to be retried), and exception is raised
+        """
+        if not self.pending:
+            return
+        pending, num_pending = self.pending, self.num_pending
+        self.pending, self.num_pending = dict(), 0
+        batches = {key: (np.concatenate(time_arrays), np.concatenate(data_arrays)) for key, (time_arrays, data_arrays) in pending.items()}
+        try:
+            num_written = await asyncio.get_running_loop().run_in_executor(None, self.flush_fn, batches)
+        except Exception:
+            # Put samples back - in front of any merged meanwhile, so they stay in time-order:
+            for key, (time_arrays, data_arrays) in self.pending.items():
+                old_time_arrays, old_data_arrays = pending.setdefault(key, (list(), list()))
+                old_time_arrays.extend(time_arrays)
+                old_data_arrays.extend(data_arrays)
+            self.pending = pending
+            self.num_pending += num_pending
+            raise
+        if not self.pending:
+            self.first_pending_time = None
+        self.flush_failed = False
+        self.num_flushes += 1
+        self.num_samples_flushed += num_written
@@ -0,0 +1,57 @@
+"""
+@file meta_cache.py
+
+@brief In-process cache of hub/channel topology - maps (hub serial no., channel name) to ID of the 'ChannelData'-instance,
+so hot paths (ingest, reads) can do a primary-key lookup instead of a join-query.
+
+Cache is bounded (LRU-eviction) and keeps hit/miss counters. It must be invalidated explicitly when hubs or channels
+are created, modified or deleted.
+"""
+
+from collections import OrderedDict
+import threading
+
+
+MAX_CACHE_SIZE = 10_000
+
+
+class ChannelDataCache():
+    def __init__(self, max_size: int = MAX_CACHE_SIZE) -> None:
+        self.max_size = max_size
+        self.entries = OrderedDict()        # (ser_no, channel name) --> 'ChannelData' ID, in LRU-order
+        self.lock = threading.Lock()        # Cache is shared by e.g. DB executor threads
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, ser_no: int, ch_name: str) -> int:
+        """ Get 'ChannelData' ID - or None if not cached """
+        key = (ser_no, ch_name)
+        with self.lock:
+            ch_id = self.entries.get(key)
+            if ch_id is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.entries.move_to_end(key)
+            return ch_id
+
+    def put(self, ser_no: int, ch_name: str, ch_id: int) -> None:
+        key = (ser_no, ch_name)
+        with self.lock:
+            self.entries[key] = ch_id
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, ser_no: int = None, ch_name: str = None) -> None:
+        """ Drop entries of one hub, one channel (on all hubs), one hub's channel - or ALL entries if nothing is specified """
+        with self.lock:
+            if ser_no is None and ch_name is None:
+                self.entries.clear()
+                return
+            for key in [key for key in self.entries if ser_no in (None, key[0]) and ch_name in (None, key[1])]:
+                del self.entries[key]
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {'size': len(self.entries), 'max_size': self.max_size, 'hits': self.hits, 'misses': self.misses}
@@ -12,13 +12,15 @@ Included in 'Channel' model is
 - unit of measure (preferrably SI-unit) --> as UTF-8 string
 - other (extensible), mostly optional attributes --> e.g. no of bits (may be useful), sampling frequency (internal in sensor or actuator) etc.
 
+Entities are defined by 'define_entities()', so the SAME model can be mapped on the primary ('db') AND on a read replica ('read_db',
+if env. variable 'DATABASE_READ_URL' is set - else 'read_db' IS 'db').
 """
 
-from pony.orm import Database, PrimaryKey, Required, Optional, Set, db_session, set_sql_debug, FloatArray
+from pony.orm import Database, PrimaryKey, Required, Optional, Set, db_session, set_sql_debug, FloatArray, composite_key
 from pydantic.dataclasses import dataclass
 
+from pony_crud.db_config import DATABASE_READ_URL
 
-db = Database()
 
 # Config
 
@@ -28,29 +30,42 @@ class Config:
 
 # Models:
 
-class Channel(db.Entity):
-    name = PrimaryKey(str)
-    is_output = Optional(bool, default=False)
-    description = Optional(str, default="<sensor IN-type>" if is_output else "<actuator OUT-type>")
-    si_unit = Optional(str, default="<unitless>")
-    scale_factor = Optional(float, default=1.0)
-    sample_freq = Optional(float, default=1.0)    # --> Hz
-    num_bits = Optional(int, default=16)          # --> TODO: relevant???
-    ch_data_sources = Set("ChannelData")
-
-@dataclass(config=Config)
-class ChannelData(db.Entity):
-    ch_id = PrimaryKey(int, auto=True)
-    start_time = Optional(float, default=0.0)
-    time_points = Optional(FloatArray)
-    data_points = Optional(FloatArray)
-    from_channel = Required(Channel)
-    to_hub = Optional("SensorHub")
-
-class SensorHub(db.Entity):
-    ser_no = PrimaryKey(int)
-    name = Required(str)
-    channels = Set(ChannelData)
-    
+def define_entities(db) -> None:
+    """ Define ALL entities on 'db' - afterwards reachable as attributes, e.g. 'db.Channel' """
+
+    class Channel(db.Entity):
+        name = PrimaryKey(str)
+        is_output = Optional(bool, default=False)
+        description = Optional(str, default="<sensor IN-type>" if is_output else "<actuator OUT-type>")
+        si_unit = Optional(str, default="<unitless>")
+        scale_factor = Optional(float, default=1.0)
+        sample_freq = Optional(float, default=1.0)    # --> Hz
+        num_bits = Optional(int, default=16)          # --> TODO: relevant???
+        ch_data_sources = Set("ChannelData")
+
+    @dataclass(config=Config)
+    class ChannelData(db.Entity):
+        ch_id = PrimaryKey(int, auto=True)
+        start_time = Optional(float, default=0.0)
+        time_points = Optional(FloatArray)
+        data_points = Optional(FloatArray)
+        from_channel = Required(Channel)
+        to_hub = Optional("SensorHub")
+        composite_key(to_hub, from_channel)         # A channel appears (at most) once per hub - also gives index for lookup on (hub, channel)
+
+    class SensorHub(db.Entity):
+        ser_no = PrimaryKey(int)
+        name = Required(str)
+        channels = Set(ChannelData)
+
+
+db = Database()
+define_entities(db)
+Channel, ChannelData, SensorHub = db.Channel, db.ChannelData, db.SensorHub
 
+if DATABASE_READ_URL:
+    read_db = Database()
+    define_entities(read_db)
+else:
+    read_db = db
 
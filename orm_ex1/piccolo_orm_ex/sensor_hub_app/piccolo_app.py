@@ -4,6 +4,7 @@ the APP_CONFIG.
 """
 
 import os
+import sys
 from fastapi import FastAPI
 from piccolo_admin.endpoints import create_admin
 from piccolo_api.fastapi.endpoints import FastAPIWrapper
@@ -15,6 +16,9 @@ from piccolo.conf.apps import AppConfig
 
 # Import DB-entity models:
 from tables import Channel, ChannelData, SensorHub
+# 'FastJSONResponse' is shared w. the Pony API - from 'orm_ex1/pony_crud/' (appended, so modules of this app take precedence):
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from pony_crud.fast_json import FastJSONResponse
 
 
 USE_FASTAPI = True
@@ -36,7 +40,8 @@ APP_CONFIG = AppConfig(
 if USE_FASTAPI:
     # *********************************** FastAPI """ part *****************************************
 
-    app = FastAPI( routes=[
+    # Responses of FastAPI-routes serialized w. 'orjson' (see 'pony_crud/fast_json.py'):
+    app = FastAPI(default_response_class=FastJSONResponse, routes=[
                 Mount("/admin/", create_admin(tables=APP_CONFIG.table_classes)),
             ],
         )
@@ -0,0 +1,201 @@
+"""
+@file compression.py
+
+@brief Response compression (ASGI middleware) - encoding negotiated from 'Accept-Encoding': zstd or brotli (if 'zstandard'/'brotli'
+is installed - optional dependencies) or gzip (always available), in server order of preference.
+
+- Responses smaller than 'minimum_size' are sent as-is (compression would not pay off), as are already encoded responses,
+  partial/empty responses and already compressed content types (see EXCLUDED_CONTENT_TYPES).
+- Streamed responses (e.g. exports) are compressed chunk by chunk - each chunk is flushed, so client gets data as it is produced,
+  and memory use stays constant.
+- Compression level is configurable per route - 'route_levels' is a list of (path pattern, levels), first match wins. Pattern is an
+  'fnmatch'-pattern (e.g. "/hubs/*/export"), and levels a dict of encoding --> level (missing encodings use DEFAULT_LEVELS),
+  or None to NOT compress matching routes at all.
+- Large chunks are compressed in a worker thread, so event loop is not blocked.
+
+Usage:
+    app.add_middleware(CompressionMiddleware, minimum_size=1024, route_levels=[("/hubs/*/export", {'gzip': 6, 'br': 5, 'zstd': 3})])
+"""
+
+import asyncio
+from fnmatch import fnmatchcase
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))     # Bytes
+THREAD_MIN_SIZE = 64 * 1024         # Chunks at least this large are compressed in a worker thread
+
+# Encoding --> level. Defaults favour ratio (bytes on metered links cost more than CPU), but stay fast enough for streaming:
+DEFAULT_LEVELS = {'zstd': 10, 'br': 6, 'gzip': 6}
+
+EXCLUDED_CONTENT_TYPES = ("application/gzip", "application/zip", "application/zstd", "application/vnd.apache.parquet",
+                          "image/", "audio/", "video/", "font/woff", "text/event-stream")
+
+
+# ****************************************** Encoders *********************************************
+
+class GzipEncoder():
+    def __init__(self, level: int) -> None:
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, 31)     # wbits = 16 + 15 --> gzip container
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        return self.compressor.compress(data) + self.compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+class ZstdEncoder():
+    def __init__(self, level: int) -> None:
+        self.compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        flush_mode = zstandard.COMPRESSOBJ_FLUSH_FINISH if final else zstandard.COMPRESSOBJ_FLUSH_BLOCK
+        return self.compressor.compress(data) + self.compressor.flush(flush_mode)
+
+
+class BrotliEncoder():
+    def __init__(self, level: int) -> None:
+        self.compressor = brotli.Compressor(quality=level)
+
+    def compress(self, data: bytes, final: bool = False) -> bytes:
+        compressed = self.compressor.process(data)
+        return compressed + (self.compressor.finish() if final else self.compressor.flush())
+
+
+def available_encoders() -> dict:
+    """ Encoding --> encoder class - in server order of preference """
+    encoders = dict()
+    if zstandard is not None:
+        encoders['zstd'] = ZstdEncoder
+    if brotli is not None:
+        encoders['br'] = BrotliEncoder
+    encoders['gzip'] = GzipEncoder
+    return encoders
+
+
+def negotiate_encoding(accept_encoding: str, encodings) -> str:
+    """ 
+    Encoding of 'encodings' w. highest quality ('q') in 'Accept-Encoding'-header (also via '*') - ties go to first in 'encodings',
+    i.e. server preference. None if client accepts none of them (q = 0 or not listed)
+    """
+    qualities = dict()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        if name:
+            qualities[name.strip()] = quality
+    best_encoding, best_quality = None, 0.0
+    for encoding in encodings:
+        quality = qualities.get(encoding, qualities.get("*", 0.0))
+        if quality > best_quality:
+            best_encoding, best_quality = encoding, quality
+    return best_encoding
+
+
+# ****************************************** Middleware *********************************************
+
+class CompressionMiddleware():
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE, route_levels: list = None, levels: dict = None) -> None:
+        self.app = app
+        self.minimum_size = minimum_size
+        self.route_levels = route_levels or list()
+        self.levels = {**DEFAULT_LEVELS, **(levels or dict())}
+        self.encoders = available_encoders()
+
+    def levels_for_path(self, path: str) -> dict:
+        """ Encoding --> level for route of 'path' - None if route must not be compressed """
+        for pattern, levels in self.route_levels:
+            if fnmatchcase(path, pattern):
+                return None if levels is None else {**self.levels, **levels}
+        return self.levels
+
+    async def __call__(self, scope, receive, send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        headers = dict((name.decode('latin-1'), value.decode('latin-1')) for name, value in scope['headers'])
+        levels = self.levels_for_path(scope['path'])
+        encoding = None
+        if levels is not None and 'range' not in headers:
+            encoding = negotiate_encoding(headers.get('accept-encoding', ""), self.encoders)
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        responder = CompressionResponder(send, encoding, self.encoders[encoding], levels[encoding], self.minimum_size)
+        await self.app(scope, receive, responder.send)
+
+
+class CompressionResponder():
+    """ Wraps 'send' of ONE response - start-message is held back until first body-message shows whether to compress """
+    def __init__(self, send, encoding: str, encoder_class, level: int, minimum_size: int) -> None:
+        self.downstream_send = send
+        self.encoding = encoding
+        self.encoder_class = encoder_class
+        self.level = level
+        self.minimum_size = minimum_size
+        self.start_message = None
+        self.encoder = None         # Set when compressing
+        self.passthru = False       # Set when NOT compressing
+
+    async def send(self, message) -> None:
+        if message['type'] == 'http.response.start':
+            self.start_message = message
+            self.passthru = not self.is_compressible(message)
+            if self.passthru:
+                await self.downstream_send(message)
+            return
+        if message['type'] != 'http.response.body' or self.passthru:
+            await self.downstream_send(message)
+            return
+        body = message.get('body', b"")
+        more_body = message.get('more_body', False)
+        if self.encoder is None:
+            if not more_body and len(body) < self.minimum_size:
+                # Small, complete response - as-is:
+                self.passthru = True
+                await self.downstream_send(self.start_message)
+                await self.downstream_send(message)
+                return
+            self.encoder = self.encoder_class(self.level)
+            await self.downstream_send(self.compressed_start_message())
+        body = await self.compress(body, final=not more_body)
+        await self.downstream_send({'type': 'http.response.body', 'body': body, 'more_body': more_body})
+
+    def is_compressible(self, message) -> bool:
+        if message['status'] in (204, 206, 304) or message['status'] < 200:
+            return False
+        headers = dict((name.lower(), value) for name, value in message.get('headers', []))
+        if b'content-encoding' in headers:
+            return False
+        content_type = headers.get(b'content-type', b"").decode('latin-1').lower()
+        return not content_type.startswith(EXCLUDED_CONTENT_TYPES)
+
+    def compressed_start_message(self) -> dict:
+        # Length is unknown until last chunk is compressed --> no 'Content-Length' (i.e. chunked transfer):
+        headers = [(name, value) for name, value in self.start_message.get('headers', []) if name.lower() not in (b'content-length', b'vary')]
+        vary = b", ".join(value for name, value in self.start_message.get('headers', []) if name.lower() == b'vary')
+        if b"accept-encoding" not in vary.lower():
+            vary = vary + b", Accept-Encoding" if vary else b"Accept-Encoding"
+        headers.append((b'vary', vary))
+        headers.append((b'content-encoding', self.encoding.encode('latin-1')))
+        return {**self.start_message, 'headers': headers}
+
+    async def compress(self, body: bytes, final: bool) -> bytes:
+        if len(body) >= THREAD_MIN_SIZE:
+            return await asyncio.get_running_loop().run_in_executor(None, self.encoder.compress, body, final)
+        return self.encoder.compress(body, final)
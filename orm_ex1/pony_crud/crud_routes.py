@@ -0,0 +1,51 @@
+"""
+@file crud_routes.py
+
+@brief CRUD routes ('FastPonyCRUD') w. read/write split - GET-routes query the read replica ('read_db'), while POST/PUT/DELETE
+go to the primary ('db'). Both must have the SAME entities (see 'models.define_entities()').
+Entities named in 'exclude_tables' get NO routes - e.g. derived data.
+'on_write' (optional) is called after each successful write request - e.g. to bump version counters, so ETags of cached
+responses no longer match (see 'versions.py').
+'write_hooks' (optional) maps entity names to generator dependencies of their write routes - code before 'yield' runs before the
+write, code after it once the write succeeded (before 'on_write') - e.g. to keep data derived from that table up to date.
+"""
+
+from fastapi import Depends
+from fast_pony_crud.table_crud import create_table_crud
+
+
+READ_METHODS = {'GET', 'HEAD'}
+WRITE_METHODS = {'POST', 'PUT', 'DELETE'}
+
+
+class RouteFilter():
+    """ Stand-in for app, passed to 'create_table_crud()' - includes only those of its routes that serve one of 'methods' """
+    def __init__(self, app, methods: set, dependencies: list = None) -> None:
+        self.app = app
+        self.methods = methods
+        self.dependencies = dependencies or list()
+
+    def include_router(self, router, **kwargs) -> None:
+        router.routes = [route for route in router.routes if route.methods & self.methods]
+        self.app.include_router(router, dependencies=self.dependencies, **kwargs)
+
+
+def after_write_dependency(on_write):
+    """ Dependency calling 'on_write()' once the route has returned w/o error (runs before the response is sent) """
+    def after_write():
+        yield
+        on_write()
+    return Depends(after_write)
+
+
+def create_split_crud_routes(db, read_db, app, prefix: str = "/db", api_key: str = None, on_write=None,
+                             exclude_tables=(), write_hooks=None) -> None:
+    write_dependencies = [after_write_dependency(on_write)] if on_write is not None else list()
+    write_hooks = write_hooks or dict()
+    for name, table in db.entities.items():
+        if name in exclude_tables:
+            continue
+        create_table_crud(read_db.entities[name], RouteFilter(app, READ_METHODS), prefix, api_key)
+        # Hook resolved last --> its exit code runs first:
+        dependencies = write_dependencies + ([Depends(write_hooks[name])] if name in write_hooks else list())
+        create_table_crud(table, RouteFilter(app, WRITE_METHODS, dependencies=dependencies), prefix, api_key)
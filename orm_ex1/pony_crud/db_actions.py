@@ -4,9 +4,175 @@
 @brief DB-access functions.
 """
 
-from pony.orm import db_session, set_sql_debug
+from array import array
+import base64
+from io import BytesIO
+from itertools import islice
+import os
+import re
+import struct
+
+from pony.orm import db_session, select, set_sql_debug
 #
-from models import db, Channel, ChannelData, SensorHub
+from models import db, read_db, Channel, ChannelData, SensorHub
+from db_config import sql_placeholder
+from db_executor import read_executor, write_executor
+from rollups import RollupAccumulator, get_aggregates, upsert_rollups
+from partitions import USE_PARTITIONS, channel_data_source, ensure_partition, group_by_partition, partitions_in_range
+from versions import bump_versions
+
+
+BULK_INSERT_BATCH_SIZE = 5000       # No. of rows per 'executemany()'-call
+FETCH_BATCH_SIZE = 10000            # No. of rows per 'fetchmany()'-call
+COPY_BATCH_SIZE = 100_000           # No. of rows per 'COPY ... FROM STDIN'-statement (PostgreSQL only, ~4MB of binary data)
+DEFAULT_PAGE_SIZE = 1000                                    # No. of samples per page, w. keyset pagination
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 10_000))
+
+CURSOR_FORMAT = struct.Struct("<dq")                        # Continuation token: (time_point, data_id) of last sample on page
+
+# PostgreSQL binary COPY-format: signature + flags + header-extension length, then per row: no. of fields + (length, value) per field, then trailer
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+PGCOPY_ROW = struct.Struct(">hididiiii")                # (time_point DOUBLE, data_point DOUBLE, from_channel INTEGER, to_hub INTEGER)
+PGCOPY_ROW_NO_HUB = struct.Struct(">hididiii")          # Same, but w. to_hub = NULL (length -1, no value)
+
+
+# ****************************** Bulk-write helper(s) (must be called inside a 'db_session') ******************************************
+
+def pgcopy_binary(rows) -> bytes:
+    """ Encode (time_point, data_point, 'Channel' ID, 'SensorHub' serial no.)-rows as ONE PostgreSQL binary COPY-stream (header, rows, trailer) """
+    buffer = BytesIO()
+    buffer.write(PGCOPY_HEADER)
+    for time_point, data_point, ch_id, ser_no in rows:
+        if ser_no is None:
+            buffer.write(PGCOPY_ROW_NO_HUB.pack(4, 8, time_point, 8, data_point, 4, ch_id, -1))
+        else:
+            buffer.write(PGCOPY_ROW.pack(4, 8, time_point, 8, data_point, 4, ch_id, 4, ser_no))
+    buffer.write(PGCOPY_TRAILER)
+    return buffer.getvalue()
+
+
+def copy_channel_data_rows(rows, batch_size: int = COPY_BATCH_SIZE, table_name: str = None) -> int:
+    """ 
+    PostgreSQL-only variant of 'insert_channel_data_rows()' - rows are streamed w. 'COPY ... FROM STDIN' in binary format,
+    on the connection (i.e. in the transaction) Pony manages. Returns no. of rows inserted.
+    """
+    quote = db.provider.quote_name
+    columns = ", ".join(quote(col) for col in ("time_point", "data_point", "from_channel", "to_hub"))
+    sql = f"COPY {quote(table_name or ChannelData._table_)} ({columns}) FROM STDIN WITH (FORMAT binary)"
+    #
+    cursor = db.get_connection().cursor()
+    num_rows = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        cursor.copy_expert(sql, BytesIO(pgcopy_binary(batch)))
+        num_rows += len(batch)
+    return num_rows
+
+
+def insert_channel_data_rows(rows, batch_size: int = BULK_INSERT_BATCH_SIZE, table_name: str = None) -> int:
+    """ 
+    Bulk INSERT of (time_point, data_point, 'Channel' ID, 'SensorHub' serial no.)-rows into 'ChannelData'-table (or one of its partitions,
+    if 'table_name' is given) - w/o creating entities.
+    Rows may be any iterable (e.g. a generator); it is consumed 'batch_size' rows at a time, so memory use stays flat.
+    On PostgreSQL, binary COPY is used instead of 'executemany()' (see 'copy_channel_data_rows()').
+    Returns no. of rows inserted.
+    """
+    db.flush()      # Pending entity changes must hit DB first ...
+    if db.provider_name == 'postgres':
+        return copy_channel_data_rows(rows, table_name=table_name)
+    quote = db.provider.quote_name
+    columns = ", ".join(quote(col) for col in ("time_point", "data_point", "from_channel", "to_hub"))
+    placeholders = ", ".join([sql_placeholder(db)] * 4)
+    sql = f"INSERT INTO {quote(table_name or ChannelData._table_)} ({columns}) VALUES ({placeholders})"
+    #
+    cursor = db.get_connection().cursor()
+    num_rows = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        cursor.executemany(sql, batch)
+        num_rows += len(batch)
+    return num_rows
+
+
+def insert_partitioned_rows(rows, batch_size: int = BULK_INSERT_BATCH_SIZE) -> int:
+    """ 
+    Like 'insert_channel_data_rows()', but each row is routed to the time-partition of its 'time_point' (see 'partitions.py') -
+    partitions are created on demand. Returns no. of rows inserted.
+    """
+    num_rows = 0
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        for start, partition_rows in group_by_partition(batch).items():
+            num_rows += insert_channel_data_rows(partition_rows, batch_size=batch_size, table_name=ensure_partition(start))
+    return num_rows
+
+
+def encode_cursor(time_point: float, data_id: int) -> str:
+    """ Opaque, URL-safe continuation token - points right AFTER sample (time_point, data_id) """
+    return base64.urlsafe_b64encode(CURSOR_FORMAT.pack(time_point, data_id)).decode('ascii').rstrip("=")
+
+
+def decode_cursor(cursor: str) -> tuple:
+    """ Inverse of 'encode_cursor()' - raises ValueError on invalid token """
+    try:
+        return CURSOR_FORMAT.unpack(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (TypeError, ValueError, struct.error):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+
+
+def select_sample_rows(table_name: str, hub_id: int, ch_id: int, start: float = None, end: float = None, after: tuple = None, 
+                       limit: int = DEFAULT_PAGE_SIZE) -> list:
+    """ 
+    Up to 'limit' (time_point, data_id, data_point)-rows of one hub channel from ONE table, in (time_point, data_id)-order, 
+    starting right after 'after' = (time_point, data_id) - i.e. an index range scan on (to_hub, from_channel, time_point).
+    Reads from replica ('read_db') if one is configured.
+    """
+    quote = read_db.provider.quote_name
+    params = {'hub_id': hub_id, 'ch_id': ch_id, 'limit': limit}
+    sql = f"""SELECT {quote('time_point')}, {quote('data_id')}, {quote('data_point')} FROM {quote(table_name)}
+              WHERE {quote('to_hub')} = $hub_id AND {quote('from_channel')} = $ch_id"""
+    if start is not None:
+        params['start'] = start
+        sql += f" AND {quote('time_point')} >= $start"
+    if end is not None:
+        params['end'] = end
+        sql += f" AND {quote('time_point')} <= $end"
+    if after is not None:
+        params['after_time'], params['after_id'] = after
+        sql += f""" AND {quote('time_point')} >= $after_time
+                    AND ({quote('time_point')} > $after_time OR {quote('data_id')} > $after_id)"""
+    sql += f" ORDER BY {quote('time_point')}, {quote('data_id')} LIMIT $limit"
+    return read_db.select(sql, params)
+
+
+def entity_defaults(entity) -> dict:
+    """ Column --> default value of each attribute of 'entity' that has one (as declared in 'models.py') - callable defaults are called """
+    return {attr.column: attr.default() if callable(attr.default) else attr.default
+            for attr in entity._attrs_ if attr.default is not None and not attr.is_collection}
+
+
+def insert_or_ignore(entity, values: dict) -> bool:
+    """ 
+    INSERT a row into table of 'entity' in ONE statement - unless it would violate a unique constraint (primary key, unique name etc.).
+    Returns True if row was created, False if a conflicting row already exists. Requires SQLite >= 3.24 or PostgreSQL >= 9.5.
+    """
+    db.flush()
+    quote = db.provider.quote_name
+    columns = ", ".join(quote(col) for col in values)
+    placeholders = ", ".join([sql_placeholder(db)] * len(values))
+    cursor = db.get_connection().cursor()
+    cursor.execute(f"INSERT INTO {quote(entity._table_)} ({columns}) VALUES ({placeholders}) ON CONFLICT DO NOTHING", tuple(values.values()))
+    return cursor.rowcount == 1
 
 
 # ****************************** DB-helper function(s) (must have '@db_session' decorator) ******************************************
@@ -14,17 +180,15 @@ from models import db, Channel, ChannelData, SensorHub
 @db_session
 def get_channel_by_name(ch_name: str = None, verbose: bool = False) -> Channel:
     try:
-        ch_query = Channel.select(lambda ch: ch.name == ch_name)
+        channel = Channel.get(name=ch_name)     # Name is unique --> at most one
         #
         if verbose:
-            if 1 < ch_query.count():
-                print(f"WARNING: duplicate entities of 'Channel' object found!")
-            elif 1 == ch_query.count():
+            if channel is not None:
                 print(f"INFO: found one entity of 'Channel' object, named '{ch_name}'")
             else:
                 print(f"INFO: found NO entity of 'Channel' object, named '{ch_name}'")
         #
-        return ch_query.first()
+        return channel
     except Exception as ex:
         # NOTE: returning 'None' is probably correct here!
         print(f"Database operation exploded! Reason: {ex}")
@@ -55,17 +219,15 @@ def get_hub_by_name(hub_name: str = None) -> Channel:
 
 @db_session
 def hub_exists(ser_no: int = None, name: str = None) -> bool:
-    """ Use this function to ensure BOTH hub serial no AND name are both unique """
-    found = None 
+    """ Use this function to ensure BOTH hub serial no AND name are both unique - checked in ONE query """
     try:
-        # First check - on primary key:
+        if ser_no is not None and name is not None:
+            return SensorHub.exists(lambda sh: sh.ser_no == ser_no or sh.name == name)
         if ser_no is not None:
-            found = get_hub_by_serno(ser_no=ser_no)
-        # Second check - on required field:
+            return SensorHub.exists(ser_no=ser_no)
         if name is not None:
-            found = get_hub_by_name(hub_name=name)
-        #
-        return found is not None
+            return SensorHub.exists(name=name)
+        return False
     except Exception as ex:
         # NOTE: just an example - NOT proper handling! (should re-throw and let upper layer handle it ...)
         print(f"Database operation exploded! Reason: {ex}")
@@ -83,15 +245,36 @@ def channel_exists(name: str = None) -> bool:
         return False
 
 
+@db_session
+def get_versions(ser_no: int = None, ch_name: str = None) -> tuple:
+    """ 
+    Get (hub version, channel version) - w/o touching sample tables. Version is None if hub/channel does not exist,
+    and channel version is None if 'ch_name' is not given
+    """
+    hub_version = select(sh.version for sh in read_db.SensorHub if sh.ser_no == ser_no).first()
+    ch_version = select(ch.version for ch in read_db.Channel if ch.name == ch_name).first() if ch_name is not None else None
+    return hub_version, ch_version
+
+
+@db_session
+def upsert_channel(name: str = None, description: str = "", si_unit: str = "<unitless>") -> bool:
+    """ Create 'Channel'-instance in DB unless one already exist by same name - in ONE statement. Returns True if created """
+    return insert_or_ignore(Channel, {**entity_defaults(Channel), 'name': name, 'description': description, 'si_unit': si_unit})
+
+
+@db_session
+def upsert_hub(hub_name: str = None, ser_no: int = None) -> bool:
+    """ Create 'SensorHub'-instance in DB unless one already exist by same serial no OR name - in ONE statement. Returns True if created """
+    return insert_or_ignore(SensorHub, {**entity_defaults(SensorHub), 'ser_no': ser_no, 'name': hub_name})
+
+
 @db_session
 def add_channel(name: str = None, description: str = "", si_unit: str = "<unitless>") -> None:
     """ Create 'Channel'-instance in DB if not one already exist by same name """
     try:
-        if channel_exists(name=name):
+        if not upsert_channel(name=name, description=description, si_unit=si_unit):
             print(f"Channel named '{name}' already exist - cannot create!")
         else:
-            # Create channel:
-            Channel(name=name, description=description, si_unit=si_unit)
             # Write to DB:
             db.commit()
     except Exception as ex:
@@ -105,11 +288,9 @@ def add_hub(hub_name: str = None, ser_no: int = None, channel_names: list = None
         print("ERROR: both serial number and hub-name MUST be specified!!")
         return
     try:
-        if hub_exists(ser_no=ser_no, name=hub_name):
-            print(f"SensorHub named '{hub_name}' already exist - cannot create!")
+        if not upsert_hub(hub_name=hub_name, ser_no=ser_no):
+            print(f"SensorHub named '{hub_name}' (or w. serial no = {ser_no}) already exist - cannot create!")
         else:
-            # Create channel:
-            SensorHub(ser_no=ser_no, name=hub_name)
             # Write to DB:
             db.commit()
     except Exception as ex:
@@ -117,53 +298,177 @@ def add_hub(hub_name: str = None, ser_no: int = None, channel_names: list = None
 
 
 @db_session
-def add_sensor_data(ser_no: int = None, channel_name: str = None, sensor_data: list = None) -> None:
-    """ Create 'ChannelData'-instance(s) in DB """
+def add_sensor_data(ser_no: int = None, channel_name: str = None, sensor_data: list = None) -> int:
+    """ Create 'ChannelData'-instance(s) in DB - 'sensor_data' is any iterable of (time, value)-pairs. Returns no. of samples added, or None on failure """
     hub = None 
     channel = None
     try:
         # Hub must exist:
-        if not hub_exists(ser_no=ser_no):
+        hub = SensorHub.get(ser_no=ser_no)
+        if hub is None:
             print(f"SensorHub with serial no = {ser_no} does NOT exist - cannot map data!")
             return  # Function makes no change in DB ...
-        else:
-            hub = SensorHub[ser_no]
         # Specified channel must exist:
-        if not channel_exists(name=channel_name):
+        channel = Channel.get(name=channel_name)
+        if channel is None:
             print(f"Channel named '{channel_name}' does NOT exist - cannot map data!")
             return  # Function makes no change in DB ...
+        # Create data - as plain rows, NOT entities (and aggregate them for rollups on the way):
+        accumulator = RollupAccumulator()
+        rows = accumulator.track((float(tval), float(dval), channel.ch_id, hub.ser_no) for tval, dval in sensor_data)
+        if USE_PARTITIONS:
+            num_rows = insert_partitioned_rows(rows)
         else:
-            channel = get_channel_by_name(ch_name=channel_name)
-        # Create data:
-        for sdata in sensor_data:
-            tval, dval = sdata
-            # Create ChannelData entity:
-            ChannelData(time_point=tval, data_point=dval, from_channel=channel, to_hub=hub)
+            num_rows = insert_channel_data_rows(rows)
+        upsert_rollups(ser_no=hub.ser_no, ch_id=channel.ch_id, accumulator=accumulator)
+        bump_versions(ser_nos=[hub.ser_no], ch_ids=[channel.ch_id])
         # Write to DB:
         db.commit()
+        return num_rows
     except Exception as ex:
         print(f"Database operation exploded! Reason: {ex}")
+        return None
+
+
+def iter_hub_rows(hub_id: int = None, channel_names: list = None, start: float = None, end: float = None, 
+                  batch_size: int = FETCH_BATCH_SIZE):
+    """ 
+    Generator of row-batches (lists of (channel name, time_point, data_point)-tuples) from ONE joined query, ordered by channel and time.
+    Optionally only for channels in 'channel_names', and/or time_point in range [start, end]. Must be called inside 'db_session'.
+    On PostgreSQL, rows are read thru a server-side (named) cursor - i.e. client never holds more than 'batch_size' rows at a time.
+    Reads from replica ('read_db') if one is configured.
+    """
+    quote = read_db.provider.quote_name
+    params = {'hub_id': hub_id}
+    sql = f"""SELECT ch.{quote('name')}, cd.{quote('time_point')}, cd.{quote('data_point')}
+              FROM {channel_data_source(start=start, end=end)} cd JOIN {quote(read_db.Channel._table_)} ch ON ch.{quote('ch_id')} = cd.{quote('from_channel')}
+              WHERE cd.{quote('to_hub')} = $hub_id"""
+    if channel_names:
+        for idx, ch_name in enumerate(channel_names):
+            params[f'ch_{idx}'] = ch_name
+        sql += f" AND ch.{quote('name')} IN ({', '.join(f'$ch_{idx}' for idx in range(len(channel_names)))})"
+    if start is not None:
+        params['start'] = start
+        sql += f" AND cd.{quote('time_point')} >= $start"
+    if end is not None:
+        params['end'] = end
+        sql += f" AND cd.{quote('time_point')} <= $end"
+    sql += f" ORDER BY ch.{quote('name')}, cd.{quote('time_point')}"
+    #
+    if read_db.provider_name == 'postgres':
+        cursor = read_db.get_connection().cursor(name="iter_hub_rows")
+        cursor.itersize = batch_size
+        cursor.execute(re.sub(r"\$(\w+)", r"%(\1)s", sql), params)
+    else:
+        cursor = read_db.execute(sql, params)    # SQLite steps thru result as it is fetched
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
 
 
 @db_session
-def get_hub_data(hub_id: int = None, verbose: bool = False) -> dict:
+def create_sample_index() -> None:
+    """ 
+    Index for range reads and keyset pagination of one hub channel - created w. raw SQL, as Pony does not allow float attributes
+    (i.e. 'time_point') in 'composite_index'. On SQLite, 'data_id' is the rowid, so index is implicitly on (..., time_point, data_id)
+    """
+    quote = db.provider.quote_name
+    table = ChannelData._table_
+    db.execute(f"""CREATE INDEX IF NOT EXISTS {quote(f'idx_{table.lower()}__hub_channel_time')}
+                   ON {quote(table)} ({quote('to_hub')}, {quote('from_channel')}, {quote('time_point')})""")
+
+
+@db_session
+def get_samples_page(hub_id: int = None, channel_name: str = None, start: float = None, end: float = None, cursor: str = None,
+                     page_size: int = DEFAULT_PAGE_SIZE) -> tuple:
+    """ 
+    One page of samples from hub channel, in (time_point, data_id)-order - optionally only w. time_point in range [start, end].
+    Keyset pagination: 'cursor' is the token returned w. previous page (None --> first page), and each page is an index range scan
+    starting right after it - so time per page does NOT grow w. depth (unlike OFFSET).
+    Returns (list of (time_point, data_point)-tuples, cursor of next page - None on last page). Raises ValueError on invalid cursor.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    after = decode_cursor(cursor) if cursor else None
+    channel = read_db.Channel.get(name=channel_name)
+    if channel is None:
+        return list(), None
+    # One row more than page - to know if there is a next page:
+    rows = select_sample_rows(read_db.ChannelData._table_, hub_id, channel.ch_id, start=start, end=end, after=after, limit=page_size + 1)
+    if USE_PARTITIONS and read_db.provider_name != 'postgres':
+        # Per-period tables (see 'partitions.py') are disjoint and visited in time-order, so stop when enough rows are found:
+        num_partition_rows = 0
+        first_time = start if after is None or (start is not None and start > after[0]) else after[0]
+        for table_name in partitions_in_range(start=first_time, end=end):
+            partition_rows = select_sample_rows(table_name, hub_id, channel.ch_id, start=start, end=end, after=after, limit=page_size + 1)
+            rows.extend(partition_rows)
+            num_partition_rows += len(partition_rows)
+            if num_partition_rows > page_size:
+                break
+        rows.sort()
+    #
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1][0], rows[-1][1])
+    return [(time_point, data_point) for time_point, _, data_point in rows], next_cursor
+
+
+@db_session
+def get_hub_data(hub_id: int = None, channel_names: list = None, start: float = None, end: float = None, verbose: bool = False) -> dict:
+    """ 
+    Get data from hub - as dict of channel name --> (time_points, data_points), both as 'array'-objects of doubles.
+    Optionally only for channels in 'channel_names', and/or time_point in range [start, end].
+    """
     data_dict = dict()
-    channel_datas = ChannelData.select(lambda cd: cd.to_hub.ser_no == hub_id)
-    if channel_datas:
-        for ch_data in channel_datas:
-            ch_name = ch_data.from_channel.name
-            #
-            tv = ch_data.time_point
-            dv = ch_data.data_point
-            #
-            if ch_name in data_dict.keys():
-                data_dict[ch_name].append( (tv, dv))
-            else:
-                data = [ (tv, dv) ]
-                data_dict[ch_name] = data
+    for rows in iter_hub_rows(hub_id=hub_id, channel_names=channel_names, start=start, end=end):
+        for ch_name, tv, dv in rows:
+            if ch_name not in data_dict:
+                data_dict[ch_name] = (array('d'), array('d'))
+            time_points, data_points = data_dict[ch_name]
+            time_points.append(tv)
+            data_points.append(dv)
             if verbose:
-                print(f"Data {ch_data.data_id}: time={tv}, value={dv}, from channel: '{ch_data.from_channel.name}'")
-            
+                print(f"Data: time={tv}, value={dv}, from channel: '{ch_name}'")
     #
     return data_dict
 
+
+# ****************************** Async wrappers - for use in async (FastAPI) handlers, run on dedicated DB-executors ******************************************
+
+async def get_channel_by_name_async(ch_name: str = None) -> Channel:
+    return await read_executor.run(get_channel_by_name, ch_name=ch_name)
+
+
+async def hub_exists_async(ser_no: int = None, name: str = None) -> bool:
+    return await read_executor.run(hub_exists, ser_no=ser_no, name=name)
+
+
+async def get_samples_page_async(hub_id: int = None, channel_name: str = None, start: float = None, end: float = None, cursor: str = None,
+                                 page_size: int = DEFAULT_PAGE_SIZE) -> tuple:
+    return await read_executor.run(get_samples_page, hub_id=hub_id, channel_name=channel_name, start=start, end=end, cursor=cursor, page_size=page_size)
+
+
+async def get_versions_async(ser_no: int = None, ch_name: str = None) -> tuple:
+    return await read_executor.run(get_versions, ser_no=ser_no, ch_name=ch_name)
+
+
+async def get_aggregates_async(hub_id: int = None, channel_name: str = None, bucket_width: float = 60, start: float = None, end: float = None) -> list:
+    return await read_executor.run(get_aggregates, hub_id=hub_id, channel_name=channel_name, bucket_width=bucket_width, start=start, end=end)
+
+
+async def get_hub_data_async(hub_id: int = None, channel_names: list = None, start: float = None, end: float = None) -> dict:
+    return await read_executor.run(get_hub_data, hub_id=hub_id, channel_names=channel_names, start=start, end=end)
+
+
+async def add_channel_async(name: str = None, description: str = "", si_unit: str = "<unitless>") -> None:
+    await write_executor.run(add_channel, name=name, description=description, si_unit=si_unit)
+
+
+async def add_hub_async(hub_name: str = None, ser_no: int = None) -> None:
+    await write_executor.run(add_hub, hub_name=hub_name, ser_no=ser_no)
+
+
+async def add_sensor_data_async(ser_no: int = None, channel_name: str = None, sensor_data: list = None) -> int:
+    return await write_executor.run(add_sensor_data, ser_no=ser_no, channel_name=channel_name, sensor_data=sensor_data)
@@ -0,0 +1,126 @@
+"""
+@file db_config.py
+
+@brief DB binding and SQLite tuning - a named PRAGMA-profile is applied on EVERY connection Pony opens,
+and a periodic maintenance task keeps query-planner stats and the WAL-file in shape.
+
+Profile is selected w. env. variable 'SQLITE_PROFILE' (default: "default", i.e. SQLite's own settings). For file-backed
+DBs on edge gateways, use "performance": WAL-journal, 'synchronous=NORMAL' (durable across app crashes, may lose last
+transaction(s) on power loss), large page cache, memory-mapped I/O and in-memory temp tables.
+NOTE: in-memory DBs (e.g. ':sharedmemory:') ignore WAL - journal stays in 'memory'-mode.
+
+On PostgreSQL ('DATABASE_URL'), reads may go to a replica - env. variable 'DATABASE_READ_URL' (e.g. a load-balancer/pgbouncer in front
+of several hot standbys). Pony holds ONE connection per thread and DB, so pool sizes are set by the DB-executors (see 'db_executor.py'):
+the primary gets the write workers (+ CRUD write threads), the replica gets the read workers.
+Sync (CRUD-)handlers run in Starlette's thread pool instead - bound it to DB_CRUD_THREADS w. 'limit_crud_threads()' at startup.
+Also used by the CRUD-only app in parent folder ('../sensorhub_api.py', as 'pony_crud.db_config') - so NO imports of sibling modules here.
+"""
+
+import asyncio
+import os
+
+from anyio import to_thread
+
+
+# Name --> list of (PRAGMA, value) - applied in order on each new connection:
+SQLITE_PROFILES = {
+    "default": [],
+    "performance": [
+        ("journal_mode", "WAL"),
+        ("synchronous", "NORMAL"),
+        ("mmap_size", 256 * 1024 * 1024),      # Bytes
+        ("cache_size", -64 * 1024),             # Negative --> KiB, i.e. 64MB page cache
+        ("temp_store", "MEMORY"),
+        ("busy_timeout", 5000),                 # ms to wait for a lock before 'database is locked' error
+        ("foreign_keys", "ON"),
+    ],
+}
+
+DATABASE_URL = os.environ.get('DATABASE_URL')
+DATABASE_READ_URL = os.environ.get('DATABASE_READ_URL')     # Read replica (PostgreSQL only) - if NOT set, reads go to primary
+
+DB_CRUD_THREADS = int(os.environ.get('DB_CRUD_THREADS', 4))     # Max. no. of sync (CRUD-)handlers - i.e. threads w. Pony DB-connections - at once
+
+SQLITE_PROFILE = os.environ.get('SQLITE_PROFILE', "default")
+MAINTENANCE_INTERVAL = float(os.environ.get('SQLITE_MAINTENANCE_INTERVAL', 3600.0))    # Seconds between runs of 'optimize_sqlite()'
+
+
+def apply_sqlite_profile(db, profile: str = SQLITE_PROFILE) -> None:
+    """ Register PRAGMA-profile on 'db' - MUST be called before 'db.bind()', to also cover the connection opened when binding """
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown SQLite profile '{profile}' - valid profiles are: {', '.join(SQLITE_PROFILES)}")
+    pragmas = SQLITE_PROFILES[profile]
+    #
+    @db.on_connect(provider='sqlite')
+    def set_sqlite_pragmas(db, connection):
+        cursor = connection.cursor()
+        for name, value in pragmas:
+            cursor.execute(f"PRAGMA {name} = {value}")
+
+
+def bind_database(db, sqlite_file: str = "sensorhub_db.sqlite", profile: str = SQLITE_PROFILE) -> None:
+    """ Bind 'db' to PostgreSQL if env. variable 'DATABASE_URL' is set - else to SQLite file, tuned by 'profile' """
+    if DATABASE_URL:
+        db.bind(provider='postgres', dsn=DATABASE_URL)
+    else:
+        apply_sqlite_profile(db, profile=profile)
+        db.bind(provider='sqlite', filename=sqlite_file, create_db=True)
+
+
+def bind_read_database(read_db, db) -> None:
+    """ 
+    Bind 'read_db' to read replica in env. variable 'DATABASE_READ_URL' - no-op if no replica is configured (i.e. 'read_db' IS 'db').
+    Sessions on replica are read-only, so a write routed there by mistake fails loudly instead of being lost
+    """
+    if read_db is db:
+        return
+    if not DATABASE_URL:
+        raise ValueError("'DATABASE_READ_URL' requires a PostgreSQL primary - i.e. 'DATABASE_URL' must be set too!")
+    #
+    @read_db.on_connect(provider='postgres')
+    def set_read_only(db, connection):
+        cursor = connection.cursor()
+        cursor.execute("SET SESSION CHARACTERISTICS AS TRANSACTION READ ONLY")
+    #
+    read_db.bind(provider='postgres', dsn=DATABASE_READ_URL)
+
+
+def limit_crud_threads() -> None:
+    """ Bound Starlette's thread pool (sync handlers) - must be called in event loop, e.g. in a 'startup'-handler """
+    to_thread.current_default_thread_limiter().total_tokens = DB_CRUD_THREADS
+
+
+def crud_thread_stats() -> dict:
+    limiter = to_thread.current_default_thread_limiter()
+    return {'max_workers': limiter.total_tokens, 'active': limiter.borrowed_tokens, 'queued': limiter.statistics().tasks_waiting}
+
+
+def sql_placeholder(db) -> str:
+    """ Query-parameter placeholder of DB-API driver of 'db's provider - for statements run on a raw cursor """
+    return "%s" if db.provider.paramstyle in ("format", "pyformat") else "?"
+
+
+def optimize_sqlite(db) -> None:
+    """ 
+    Refresh query-planner stats, and move WAL-contents into DB-file (and truncate WAL) - no-op for other providers.
+    NOTE: must NOT be called inside a 'db_session' - a checkpoint cannot run within a transaction, so thread's pooled (autocommit) connection is used directly.
+    """
+    if db.provider_name != 'sqlite':
+        return
+    connection, is_new_connection = db.provider.connect()
+    if is_new_connection:
+        db.call_on_connect(connection)
+    connection.execute("PRAGMA optimize")
+    if connection.execute("PRAGMA journal_mode").fetchone()[0] == 'wal':
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+async def run_sqlite_maintenance(db, interval: float = MAINTENANCE_INTERVAL) -> None:
+    """ Run 'optimize_sqlite()' every 'interval' seconds (in executor, i.e. not blocking event loop) - until cancelled """
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await loop.run_in_executor(None, optimize_sqlite, db)
+        except Exception as ex:
+            print(f"SQLite maintenance exploded! Reason: {ex}")
@@ -0,0 +1,108 @@
+"""
+@file db_executor.py
+
+@brief Dedicated, bounded thread pools for blocking (Pony 'db_session') DB-work - so async FastAPI handlers never block the event loop,
+and DB-calls do not compete w. other work in Starlette's default thread pool.
+
+Pony keeps ONE DB-connection per thread, so the no. of worker threads IS the size of the connection pool (env. variable 'DB_POOL_SIZE').
+Work is split on two executors, so slow range queries cannot starve ingest:
+- 'write_executor' - DB_WRITE_WORKERS threads (default: 1, as SQLite serializes writers anyway)
+- 'read_executor'  - the remaining DB_POOL_SIZE - DB_WRITE_WORKERS threads
+Health checks should NOT go thru these at all - use 'stats()' to report queue depths instead.
+Sync (CRUD-)handlers still run in Starlette's thread pool - bound it to DB_CRUD_THREADS w. 'limit_crud_threads()' at startup (see 'db_config.py').
+With a read replica (see 'db_config.py'), read workers connect ONLY to replica, so the primary holds at most
+DB_WRITE_WORKERS + DB_CRUD_THREADS connections, and the replica DB_POOL_SIZE - DB_WRITE_WORKERS + DB_CRUD_THREADS.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import functools
+import os
+import threading
+import time
+
+from db_config import crud_thread_stats
+
+
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 4))
+DB_WRITE_WORKERS = int(os.environ.get('DB_WRITE_WORKERS', 1))
+
+if not 0 < DB_WRITE_WORKERS < DB_POOL_SIZE:
+    raise ValueError(f"DB_WRITE_WORKERS must be in range [1, DB_POOL_SIZE - 1] - got {DB_WRITE_WORKERS} (DB_POOL_SIZE = {DB_POOL_SIZE})!")
+
+
+class DBExecutor():
+    def __init__(self, name: str, max_workers: int) -> None:
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"db-{name}")
+        self.lock = threading.Lock()
+        # Stats:
+        self.num_queued = 0         # Submitted, but not yet picked up by a worker thread
+        self.num_active = 0         # Currently running in a worker thread
+        self.num_completed = 0
+        self.num_failed = 0
+        self.max_queued = 0
+        self.total_wait_time = 0.0  # Summed time spent queued (seconds)
+
+    def call(self, fn, submit_time: float, *args, **kwargs):
+        """ Runs in worker thread - keeps queue-depth counters """
+        with self.lock:
+            self.num_queued -= 1
+            self.num_active += 1
+            self.total_wait_time += time.monotonic() - submit_time
+        try:
+            result = fn(*args, **kwargs)
+        except Exception:
+            with self.lock:
+                self.num_failed += 1
+            raise
+        finally:
+            with self.lock:
+                self.num_active -= 1
+                self.num_completed += 1
+        return result
+
+    async def run(self, fn, *args, **kwargs):
+        """ Run blocking 'fn(*args, **kwargs)' in one of executor's threads, and await result """
+        with self.lock:
+            self.num_queued += 1
+            self.max_queued = max(self.max_queued, self.num_queued)
+        call = functools.partial(self.call, fn, time.monotonic(), *args, **kwargs)
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self.executor, call)
+        except RuntimeError:
+            # Executor is shut down - never queued:
+            with self.lock:
+                self.num_queued -= 1
+            raise
+        return await future
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                'max_workers': self.max_workers,
+                'queued': self.num_queued,
+                'active': self.num_active,
+                'completed': self.num_completed,
+                'failed': self.num_failed,
+                'max_queued': self.max_queued,
+                'avg_wait_ms': 1000.0 * self.total_wait_time / self.num_completed if self.num_completed else 0.0,
+            }
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=True)
+
+
+read_executor = DBExecutor("read", max_workers=DB_POOL_SIZE - DB_WRITE_WORKERS)
+write_executor = DBExecutor("write", max_workers=DB_WRITE_WORKERS)
+
+
+def stats() -> dict:
+    return {'pool_size': DB_POOL_SIZE, 'read': read_executor.stats(), 'write': write_executor.stats(), 'crud': crud_thread_stats()}
+
+
+def shutdown() -> None:
+    """ Wait for ALL queued DB-work to finish, then stop worker threads - e.g. on app shutdown """
+    read_executor.shutdown()
+    write_executor.shutdown()
@@ -0,0 +1,37 @@
+"""
+@file etags.py
+
+@brief Conditional GET - ETags derived from hub/channel version counters (bumped on each write, see 'versions.py').
+
+Usage in endpoint:
+    etag = make_etag("hub", ser_no, hub_version)        # Version MUST be read BEFORE the data - else a client may miss an update
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    ...
+    return FastJSONResponse(content, headers=etag_headers(etag))
+"""
+
+from fastapi import Request, Response
+
+
+def make_etag(*parts) -> str:
+    """ Weak ETag - e.g. make_etag("hub", 123, 7) --> 'W/"hub-123-7"' """
+    return 'W/"' + "-".join(str(part) for part in parts) + '"'
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """ True if 'If-None-Match' request-header holds 'etag' (or '*') - compared weakly, i.e. w/o 'W/'-prefix """
+    if_none_match = request.headers.get('if-none-match')
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in tags]
+
+
+def etag_headers(etag: str) -> dict:
+    # 'no-cache' --> clients/proxies may store response, but must revalidate (i.e. send 'If-None-Match') before each reuse
+    return {'ETag': etag, 'Cache-Control': "no-cache"}
+
+
+def not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers=etag_headers(etag))
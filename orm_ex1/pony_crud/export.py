@@ -0,0 +1,214 @@
+"""
+@file export.py
+
+@brief Streaming export of hub data - as CSV, Arrow IPC (stream format) or Parquet.
+
+Rows are fetched in batches (see 'db_actions.iter_hub_rows()' - server-side cursor on PostgreSQL), and each batch is written and
+yielded as encoded bytes before next batch is fetched - so memory use stays constant, regardless of export size.
+Arrow and Parquet require 'pyarrow' (optional dependency) - CSV works without it.
+
+CLI:
+    python export.py --hub 123 [--channels bma280_temp sht721_hygro] [--start <Epoch-time>] [--end <Epoch-time>] --format parquet --output hub123.parquet
+"""
+
+import asyncio
+import csv
+import io
+import threading
+
+from pony.orm import db_session
+
+from db_actions import iter_hub_rows
+from db_executor import read_executor
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+
+EXPORT_BATCH_SIZE = 65536       # Rows per fetch - i.e. per CSV-block, Arrow record batch or Parquet row group
+EXPORT_QUEUE_SIZE = 4           # Max. no. of encoded batches buffered between DB-thread and HTTP-response (see 'iter_export_async()')
+
+EXPORT_COLUMNS = ("hub", "channel", "time_point", "data_point")
+EXPORT_FORMATS = {
+    # Format --> (media type, file extension)
+    'csv': ("text/csv", "csv"),
+    'arrow': ("application/vnd.apache.arrow.stream", "arrows"),
+    'parquet': ("application/vnd.apache.parquet", "parquet"),
+}
+
+
+class ChunkSink():
+    """ Write-only, file-like object collecting written bytes - drained by export generators after each batch """
+    def __init__(self) -> None:
+        self.chunks = list()
+        self.position = 0
+        self.closed = False
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks = list()
+        return data
+
+
+def arrow_schema():
+    return pa.schema([("hub", pa.int64()), ("channel", pa.string()), ("time_point", pa.float64()), ("data_point", pa.float64())])
+
+
+def arrow_batch(hub_id: int, rows: list):
+    ch_names, time_points, data_points = zip(*rows)
+    return pa.record_batch([pa.array([hub_id] * len(rows), type=pa.int64()), pa.array(ch_names, type=pa.string()),
+                            pa.array(time_points, type=pa.float64()), pa.array(data_points, type=pa.float64())], schema=arrow_schema())
+
+
+def iter_csv(hub_id: int, row_batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in row_batches:
+        writer.writerows((hub_id, ch_name, repr(tv), repr(dv)) for ch_name, tv, dv in rows)
+        yield buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')     # Header only - i.e. no rows
+
+
+def iter_arrow(hub_id: int, row_batches):
+    sink = ChunkSink()
+    with pa.ipc.new_stream(sink, arrow_schema()) as writer:
+        for rows in row_batches:
+            writer.write_batch(arrow_batch(hub_id, rows))
+            yield sink.drain()
+    yield sink.drain()      # End-of-stream marker
+
+
+def iter_parquet(hub_id: int, row_batches):
+    sink = ChunkSink()
+    with pq.ParquetWriter(sink, arrow_schema()) as writer:
+        for rows in row_batches:
+            writer.write_batch(arrow_batch(hub_id, rows))     # One row group per batch
+            yield sink.drain()
+    yield sink.drain()      # Footer (metadata)
+
+
+def check_format(fmt: str) -> None:
+    """ Raise ValueError if export format is unknown, or not available (i.e. 'pyarrow' not installed) """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}' - valid formats are: {', '.join(EXPORT_FORMATS)}")
+    if fmt != 'csv' and pa is None:
+        raise ValueError(f"Export format '{fmt}' requires 'pyarrow' - install it w. 'pip install pyarrow'")
+
+
+def iter_export(fmt: str = 'csv', hub_id: int = None, channel_names: list = None, start: float = None, end: float = None,
+                batch_size: int = EXPORT_BATCH_SIZE):
+    """ Generator of encoded export bytes - must be called inside 'db_session', and consumed in SAME thread """
+    check_format(fmt)
+    encoders = {'csv': iter_csv, 'arrow': iter_arrow, 'parquet': iter_parquet}
+    row_batches = iter_hub_rows(hub_id=hub_id, channel_names=channel_names, start=start, end=end, batch_size=batch_size)
+    for chunk in encoders[fmt](hub_id, row_batches):
+        if chunk:
+            yield chunk
+
+
+@db_session
+def export_to_file(path: str, fmt: str = 'csv', hub_id: int = None, channel_names: list = None, start: float = None, end: float = None) -> int:
+    """ Export hub data to file - returns no. of bytes written """
+    num_bytes = 0
+    with open(path, 'wb') as out_file:
+        for chunk in iter_export(fmt=fmt, hub_id=hub_id, channel_names=channel_names, start=start, end=end):
+            out_file.write(chunk)
+            num_bytes += len(chunk)
+    return num_bytes
+
+
+async def iter_export_async(fmt: str = 'csv', hub_id: int = None, channel_names: list = None, start: float = None, end: float = None):
+    """
+    Async generator of encoded export bytes - e.g. for 'StreamingResponse'. Export runs in ONE thread of the DB read-executor
+    (a 'db_session' cannot hop between threads), and hands over chunks thru a bounded queue - so a slow client throttles the export,
+    instead of data piling up in memory.
+    """
+    check_format(fmt)
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=EXPORT_QUEUE_SIZE)
+    cancelled = threading.Event()
+
+    @db_session
+    def produce() -> None:
+        try:
+            for chunk in iter_export(fmt=fmt, hub_id=hub_id, channel_names=channel_names, start=start, end=end):
+                if cancelled.is_set():
+                    break
+                asyncio.run_coroutine_threadsafe(queue.put(chunk), loop).result()
+        finally:
+            asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()     # End marker
+
+    def on_producer_done(_) -> None:
+        # End marker - in case producer failed before it could put one (extra markers are never read):
+        try:
+            queue.put_nowait(None)
+        except asyncio.QueueFull:
+            pass
+
+    producer = asyncio.ensure_future(read_executor.run(produce))
+    producer.add_done_callback(on_producer_done)
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                break
+            yield chunk
+        await producer      # Re-raises any exception from export
+    finally:
+        if not producer.done():
+            # Client went away - stop producer, and unblock it if it waits for room in queue:
+            cancelled.set()
+            while not producer.done():
+                while not queue.empty():
+                    queue.get_nowait()
+                await asyncio.sleep(0.01)
+
+
+# ****************************** CLI ********************************
+
+if __name__ == "__main__":
+    import argparse
+
+    from models import db, read_db
+    from db_config import bind_database, bind_read_database
+
+    parser = argparse.ArgumentParser(description="Export hub data as CSV, Arrow IPC or Parquet")
+    parser.add_argument("--hub", type=int, required=True, help="Serial no. of hub")
+    parser.add_argument("--channels", nargs="*", help="Channel names (default: all)")
+    parser.add_argument("--start", type=float, help="Start of time-range (Epoch-time)")
+    parser.add_argument("--end", type=float, help="End of time-range (Epoch-time)")
+    parser.add_argument("--format", choices=list(EXPORT_FORMATS), default='csv')
+    parser.add_argument("--output", required=True, help="Output file")
+    parser.add_argument("--db", default="sensorhub_db.sqlite", help="SQLite file (ignored if env. variable 'DATABASE_URL' is set)")
+    args = parser.parse_args()
+
+    bind_database(db, sqlite_file=args.db)
+    bind_read_database(read_db, db)
+    db.generate_mapping(create_tables=False)
+    if read_db is not db:
+        read_db.generate_mapping(create_tables=False)
+    num_bytes = export_to_file(args.output, fmt=args.format, hub_id=args.hub, channel_names=args.channels, start=args.start, end=args.end)
+    print(f"Exported {num_bytes} bytes to '{args.output}'")
@@ -0,0 +1,130 @@
+"""
+@file json_benchmark.py
+
+@brief Benchmark of JSON responses w. large 'time_points'/'data_points'-payloads (as from '/hubs/{ser_no}/data') - latency of
+- 'default':   FastAPI's default path, i.e. 'jsonable_encoder' + 'JSONResponse' (stdlib 'json') - arrays as lists of floats
+- 'fast_list': 'FastJSONResponse' (see 'fast_json.py') - arrays as lists of floats
+- 'fast_array': 'FastJSONResponse' - arrays as 'array'-objects of doubles (as returned by 'db_actions.get_hub_data()')
+- 'fast_numpy': 'FastJSONResponse' - arrays as NumPy arrays
+both as serialization only, and end-to-end thru an app (w. 'TestClient', i.e. in-process - no network).
+
+CLI:
+    python json_benchmark.py [--samples 10000 50000 200000] [--channels 3] [--repeat 10]
+"""
+
+from array import array
+import random
+import statistics
+import time
+
+from fastapi import FastAPI
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from fast_json import FastJSONResponse, np, orjson
+
+
+def make_payload(num_samples: int, num_channels: int = 3) -> dict:
+    """ Channel name --> (time_points, data_points) - both as 'array'-objects of doubles """
+    start = time.time()
+    return {f"ch_{idx}": (array('d', (start + i * 0.01 for i in range(num_samples))), array('d', (random.uniform(-100.0, 100.0) for _ in range(num_samples))))
+            for idx in range(num_channels)}
+
+
+def as_content(payload: dict, kind: str) -> dict:
+    convert = {'list': array.tolist, 'array': lambda a: a, 'numpy': lambda a: np.frombuffer(a, dtype=np.float64)}[kind]
+    return {ch_name: {'time_points': convert(tv), 'data_points': convert(dv)} for ch_name, (tv, dv) in payload.items()}
+
+
+def render_default(payload: dict) -> bytes:
+    return JSONResponse(jsonable_encoder(as_content(payload, 'list'))).body
+
+
+def render_fast(payload: dict, kind: str) -> bytes:
+    return FastJSONResponse(as_content(payload, kind)).body
+
+
+def variants() -> dict:
+    """ Name --> render function - NumPy-variant only if NumPy is installed """
+    funcs = {
+        'default': render_default,
+        'fast_list': lambda payload: render_fast(payload, 'list'),
+        'fast_array': lambda payload: render_fast(payload, 'array'),
+    }
+    if np is not None:
+        funcs['fast_numpy'] = lambda payload: render_fast(payload, 'numpy')
+    return funcs
+
+
+def time_ms(func, repeat: int) -> tuple:
+    """ (median, min) of 'repeat' calls - in ms """
+    timings = list()
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        timings.append(1000.0 * (time.perf_counter() - t0))
+    return statistics.median(timings), min(timings)
+
+
+def create_benchmark_app(payload: dict) -> FastAPI:
+    """ One endpoint per variant - each returns 'payload', like '/hubs/{ser_no}/data' does """
+    app = FastAPI(default_response_class=FastJSONResponse)
+
+    @app.get("/default", response_class=JSONResponse)
+    def get_default():
+        return as_content(payload, 'list')      # --> 'jsonable_encoder' + stdlib 'json'
+
+    @app.get("/fast_list")
+    def get_fast_list():
+        return FastJSONResponse(as_content(payload, 'list'))
+
+    @app.get("/fast_array")
+    def get_fast_array():
+        return FastJSONResponse(as_content(payload, 'array'))
+
+    if np is not None:
+        @app.get("/fast_numpy")
+        def get_fast_numpy():
+            return FastJSONResponse(as_content(payload, 'numpy'))
+
+    return app
+
+
+def run_benchmark(sample_counts: list, num_channels: int = 3, repeat: int = 10) -> list:
+    """ Returns list of (no. of samples, variant, response size in bytes, render median/min ms, request median/min ms) """
+    from fastapi.testclient import TestClient
+
+    results = list()
+    for num_samples in sample_counts:
+        payload = make_payload(num_samples, num_channels=num_channels)
+        reference = None
+        with TestClient(create_benchmark_app(payload)) as client:
+            for name, render in variants().items():
+                body = render(payload)
+                # Same data, whatever the path (float formatting may differ --> compare parsed):
+                parsed = as_content({ch: (array('d', d['time_points']), array('d', d['data_points'])) for ch, d in client.get(f"/{name}").json().items()}, 'list')
+                if reference is None:
+                    reference = parsed
+                elif parsed != reference:
+                    raise AssertionError(f"Variant '{name}' returned different data!")
+                render_ms = time_ms(lambda: render(payload), repeat)
+                request_ms = time_ms(lambda: client.get(f"/{name}"), repeat)
+                results.append((num_samples, name, len(body), *render_ms, *request_ms))
+    return results
+
+
+# ****************************** CLI ********************************
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark JSON responses w. large numeric payloads")
+    parser.add_argument("--samples", type=int, nargs="+", default=[10_000, 50_000, 200_000], help="Samples per channel")
+    parser.add_argument("--channels", type=int, default=3)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"orjson: {'yes' if orjson is not None else 'NO (stdlib json fallback)'}, NumPy: {'yes' if np is not None else 'no'}")
+    print(f"{'samples':>9} {'variant':<11} {'bytes':>11} {'render median/min [ms]':>24} {'request median/min [ms]':>25}")
+    for num_samples, name, num_bytes, render_med, render_min, request_med, request_min in run_benchmark(args.samples, args.channels, args.repeat):
+        print(f"{num_samples:>9} {name:<11} {num_bytes:>11} {render_med:>12.2f} / {render_min:<9.2f} {request_med:>12.2f} / {request_min:<9.2f}")
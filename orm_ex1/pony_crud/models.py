@@ -12,14 +12,17 @@ Included in 'Channel' model is
 - unit of measure (preferrably SI-unit) --> as UTF-8 string
 - other (extensible), mostly optional attributes --> e.g. no of bits (may be useful), sampling frequency (internal in sensor or actuator) etc.
 
+Entities are defined by 'define_entities()', so the SAME model can be mapped on more than one 'Database':
+- 'db'      - primary, i.e. ALL writes (and reads where a stale replica is not OK)
+- 'read_db' - read replica, if env. variable 'DATABASE_READ_URL' is set (see 'db_config.bind_read_database()') - else it IS 'db'
 """
 
-from pony.orm import Database, PrimaryKey, Required, Optional, Set, db_session, set_sql_debug, FloatArray
+from pony.orm import Database, PrimaryKey, Required, Optional, Set, db_session, set_sql_debug, FloatArray, composite_key
 from pydantic.dataclasses import dataclass
 from pydantic import ConstrainedList, validator
 
+from db_config import DATABASE_READ_URL
 
-db = Database()
 
 # Config
 
@@ -30,28 +33,57 @@ class Config:
 
 # Models:
 
-class Channel(db.Entity):
-    ch_id = PrimaryKey(int, auto=True)
-    name = Required(str)
-    is_output = Optional(bool, default=False)
-    description = Optional(str, default="<sensor IN-type>" if is_output else "<actuator OUT-type>")
-    si_unit = Optional(str, default="<unitless>")
-    scale_factor = Optional(float, default=1.0)
-    sample_freq = Optional(float, default=1.0)    # --> Hz
-    num_bits = Optional(int, default=16)          # --> TODO: relevant???
-    ch_data_sources = Set("ChannelData")
-
-class ChannelData(db.Entity):
-    data_id = PrimaryKey(int, auto=True)
-    time_point = Optional(float, default=0.0)
-    data_point = Optional(float, default=0.0)
-    from_channel = Required(Channel)
-    to_hub = Optional("SensorHub")
-
-class SensorHub(db.Entity):
-    ser_no = PrimaryKey(int)
-    name = Required(str)
-    channels = Set(ChannelData)
-    
+def define_entities(db) -> None:
+    """ Define ALL entities on 'db' - afterwards reachable as attributes, e.g. 'db.Channel' """
+
+    class Channel(db.Entity):
+        ch_id = PrimaryKey(int, auto=True)
+        name = Required(str, unique=True)
+        is_output = Optional(bool, default=False)
+        description = Optional(str, default="<sensor IN-type>" if is_output else "<actuator OUT-type>")
+        si_unit = Optional(str, default="<unitless>")
+        scale_factor = Optional(float, default=1.0)
+        sample_freq = Optional(float, default=1.0)    # --> Hz
+        num_bits = Optional(int, default=16)          # --> TODO: relevant???
+        version = Optional(int, default=0)            # Bumped on each write of its data (--> ETags, see 'versions.py')
+        ch_data_sources = Set("ChannelData")
+        rollups = Set("SampleRollup")
+
+    class ChannelData(db.Entity):
+        data_id = PrimaryKey(int, auto=True)
+        time_point = Optional(float, default=0.0)
+        data_point = Optional(float, default=0.0)
+        from_channel = Required(Channel)
+        to_hub = Optional("SensorHub")
+
+    class SensorHub(db.Entity):
+        ser_no = PrimaryKey(int)
+        name = Required(str, unique=True)
+        version = Optional(int, default=0)            # Bumped on each write of its data (--> ETags, see 'versions.py')
+        channels = Set(ChannelData)
+        rollups = Set("SampleRollup")
+
+    class SampleRollup(db.Entity):
+        """ Aggregate of ALL samples from one channel of one hub within one time-bucket - maintained on ingest (see 'rollups.py') """
+        hub = Required(SensorHub)
+        channel = Required(Channel)
+        resolution = Required(int)                    # Bucket width (seconds)
+        bucket = Required(int, size=64)               # Bucket START (Epoch-time, whole seconds)
+        num_samples = Required(int, size=64)
+        sum_values = Required(float)
+        min_value = Required(float)
+        max_value = Required(float)
+        sum_squares = Required(float)                 # --> variance/std.dev. w/o re-reading samples
+        composite_key(hub, channel, resolution, bucket)
+
+
+db = Database()
+define_entities(db)
+Channel, ChannelData, SensorHub, SampleRollup = db.Channel, db.ChannelData, db.SensorHub, db.SampleRollup
 
+if DATABASE_READ_URL:
+    read_db = Database()
+    define_entities(read_db)
+else:
+    read_db = db
 
@@ -0,0 +1,206 @@
+"""
+@file partitions.py
+
+@brief Time-partitioning of 'ChannelData' rows on 'time_point' - one partition per PARTITION_PERIOD (default: one day, UTC-aligned).
+
+- PostgreSQL: native declarative partitioning, i.e. 'ChannelData' is created as a table PARTITIONED BY RANGE (time_point)
+  (call 'create_partitioned_table()' BEFORE 'db.generate_mapping()', and 'check_partitioned_table()' after it), w. one
+  'channeldata_pYYYYMMDD' partition per period - Pony lower-cases table names on PostgreSQL, so parent table is 'channeldata'.
+  Inserts and ORM-access go thru parent table, and planner prunes partitions outside queried range by itself.
+- SQLite: one plain table 'ChannelData_pYYYYMMDD' per period, alongside Pony's 'ChannelData'-table (which keeps rows
+  created thru ORM/CRUD-API). Rows are routed to per-period tables on insert, and reads only visit tables overlapping queried range.
+Old partitions are removed in O(1) - i.e. DROP/DETACH of a whole table, instead of DELETE of rows.
+NOTE: the partitioned PostgreSQL-table gets its foreign keys to 'Channel'/'SensorHub' (and indexes) from 'db.generate_mapping()',
+as any other table - but its primary key is (data_id, time_point), as it must include the partition key. On SQLite, per-period tables
+have NO foreign keys, and 'data_id' is only unique per table.
+"""
+
+from datetime import datetime, timezone
+import os
+import re
+
+from pony.orm import db_session
+
+from models import db, ChannelData
+from versions import bump_versions
+
+
+USE_PARTITIONS = os.environ.get('USE_PARTITIONS', "0") == "1"
+PARTITION_PERIOD = int(os.environ.get('PARTITION_PERIOD', 24 * 3600))     # Seconds - must be whole no. of days, e.g. 604800 for weekly
+
+SECONDS_PER_DAY = 24 * 3600
+if PARTITION_PERIOD % SECONDS_PER_DAY:
+    raise ValueError(f"PARTITION_PERIOD must be a whole no. of days - got {PARTITION_PERIOD} seconds!")
+
+PARTITION_SUFFIX_PATTERN = re.compile(r"_p(\d{8})$")
+
+
+def parent_table() -> str:
+    """
+    Table name of 'ChannelData' - Pony only sets '_table_' in 'db.generate_mapping()', so before that, it is the name mapping WILL pick
+    (from DB provider - e.g. lower-cased on PostgreSQL). DB must be bound
+    """
+    return ChannelData._table_ or db.provider.get_default_entity_table_name(ChannelData)
+
+
+def partition_start(time_point: float) -> float:
+    """ START (Epoch-time) of period that 'time_point' belongs to """
+    return (time_point // PARTITION_PERIOD) * PARTITION_PERIOD
+
+
+def partition_name(start: float) -> str:
+    return f"{parent_table()}_p{datetime.fromtimestamp(start, tz=timezone.utc):%Y%m%d}"
+
+
+def partition_start_from_name(name: str) -> float:
+    """ Inverse of 'partition_name()' - returns None if 'name' is not a partition of 'ChannelData' """
+    match = PARTITION_SUFFIX_PATTERN.search(name)
+    if match is None or name[:match.start()] != parent_table():
+        return None
+    return datetime.strptime(match.group(1), "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+def group_by_partition(rows) -> dict:
+    """ Split (time_point, data_point, 'Channel' ID, 'SensorHub' serial no.)-rows into dict of partition START --> list of rows """
+    groups = dict()
+    for row in rows:
+        groups.setdefault(partition_start(row[0]), list()).append(row)
+    return groups
+
+
+def create_partitioned_table(db) -> None:
+    """ PostgreSQL only (no-op for other providers): create 'ChannelData' as partitioned table - MUST be called before 'db.generate_mapping()' """
+    if db.provider_name != 'postgres':
+        return
+    quote = db.provider.quote_name
+    table = parent_table()
+    connection, _ = db.provider.connect()
+    cursor = connection.cursor()
+    cursor.execute(f"""CREATE TABLE IF NOT EXISTS {quote(table)} (
+                           {quote('data_id')} SERIAL,
+                           {quote('time_point')} DOUBLE PRECISION DEFAULT 0,
+                           {quote('data_point')} DOUBLE PRECISION DEFAULT 0,
+                           {quote('from_channel')} INTEGER NOT NULL,
+                           {quote('to_hub')} INTEGER,
+                           PRIMARY KEY ({quote('data_id')}, {quote('time_point')})
+                       ) PARTITION BY RANGE ({quote('time_point')})""")
+    cursor.execute(f"""CREATE INDEX IF NOT EXISTS {quote(f'idx_{table.lower()}__hub_channel_time')}
+                       ON {quote(table)} ({quote('to_hub')}, {quote('from_channel')}, {quote('time_point')})""")
+    # Catch-all for rows outside any period-partition (e.g. inserted w/o 'ensure_partition()'):
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {quote(f'{table}_default')} PARTITION OF {quote(table)} DEFAULT")
+    connection.commit()
+
+
+def check_partitioned_table(db) -> None:
+    """
+    PostgreSQL only (no-op for other providers): call AFTER 'db.generate_mapping()' - raises if table that 'ChannelData' is mapped to
+    is NOT partitioned (e.g. it existed, unpartitioned, before 'create_partitioned_table()'), as rows would then bypass ALL partitions
+    """
+    if db.provider_name != 'postgres':
+        return
+    with db_session:
+        partitioned = db.select("""c.relname FROM pg_partitioned_table pt JOIN pg_class c ON c.oid = pt.partrelid
+                                   WHERE c.relname = $table""", {'table': ChannelData._table_})
+    if not partitioned:
+        raise RuntimeError(f"Table '{ChannelData._table_}' of 'ChannelData' is NOT partitioned! Move its rows to a partitioned table first")
+
+
+# ****************************** Partition management and routing (must be called inside a 'db_session') ******************************************
+
+def ensure_partition(start: float) -> str:
+    """ Create partition for period starting at 'start' - unless it already exists. Returns table name of partition """
+    quote = db.provider.quote_name
+    name = partition_name(start)
+    if db.provider_name == 'postgres':
+        db.execute(f"""CREATE TABLE IF NOT EXISTS {quote(name)} PARTITION OF {quote(parent_table())}
+                       FOR VALUES FROM ({float(start)!r}) TO ({float(start + PARTITION_PERIOD)!r})""")
+    else:
+        db.execute(f"""CREATE TABLE IF NOT EXISTS {quote(name)} (
+                           {quote('data_id')} INTEGER PRIMARY KEY AUTOINCREMENT,
+                           {quote('time_point')} REAL DEFAULT 0,
+                           {quote('data_point')} REAL DEFAULT 0,
+                           {quote('from_channel')} INTEGER NOT NULL,
+                           {quote('to_hub')} INTEGER,
+                           CHECK ({quote('time_point')} >= {float(start)!r} AND {quote('time_point')} < {float(start + PARTITION_PERIOD)!r})
+                       )""")
+        db.execute(f"""CREATE INDEX IF NOT EXISTS {quote(f'idx_{name.lower()}__hub_channel_time')}
+                       ON {quote(name)} ({quote('to_hub')}, {quote('from_channel')}, {quote('time_point')})""")
+    return name
+
+
+def list_partitions() -> list:
+    """ Get (attached) partitions of 'ChannelData' - as list of (START, table name), sorted by START """
+    if db.provider_name == 'postgres':
+        names = db.select("""c.relname FROM pg_inherits i
+                             JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent
+                             WHERE p.relname = $table""", {'table': parent_table()})
+    else:
+        names = db.select("name FROM sqlite_master WHERE type = 'table'")
+    partitions = [(partition_start_from_name(name), name) for name in names]
+    return sorted(part for part in partitions if part[0] is not None)
+
+
+def partitions_in_range(start: float = None, end: float = None) -> list:
+    """ Table names of partitions overlapping time-range [start, end] - i.e. partition pruning """
+    return [name for part_start, name in list_partitions()
+            if (start is None or part_start + PARTITION_PERIOD > start) and (end is None or part_start <= end)]
+
+
+def partition_sources(name: str) -> tuple:
+    """ (hub serial nos., channel IDs) w. rows in partition 'name' - i.e. whose versions change when it is removed """
+    quote = db.provider.quote_name
+    rows = db.select(f"SELECT DISTINCT {quote('to_hub')}, {quote('from_channel')} FROM {quote(name)}")
+    return {hub for hub, _ in rows if hub is not None}, {ch_id for _, ch_id in rows}
+
+
+def removed_partition(start: float, ser_nos, ch_ids) -> None:
+    """ After partition of period starting at 'start' was removed: rebuild rollups of its period, and bump versions of its hubs/channels """
+    from rollups import backfill_rollups         # Here - 'rollups' imports this module
+    backfill_rollups(start=int(start), end=int(start + PARTITION_PERIOD))
+    bump_versions(ser_nos, ch_ids)
+
+
+def detach_partition(start: float) -> str:
+    """
+    Take partition of period starting at 'start' out of 'ChannelData' (rows no longer visible in queries), but keep it as standalone table,
+    named '<parent table>_detached_pYYYYMMDD' - e.g. for archiving. Rollups and versions are updated (see 'removed_partition()').
+    Returns name of detached table
+    """
+    quote = db.provider.quote_name
+    name = partition_name(start)
+    detached_name = name.replace(f"{parent_table()}_p", f"{parent_table()}_detached_p", 1)
+    ser_nos, ch_ids = partition_sources(name)
+    if db.provider_name == 'postgres':
+        db.execute(f"ALTER TABLE {quote(parent_table())} DETACH PARTITION {quote(name)}")
+    db.execute(f"ALTER TABLE {quote(name)} RENAME TO {quote(detached_name)}")
+    removed_partition(partition_start(start), ser_nos, ch_ids)
+    return detached_name
+
+
+def drop_partitions(before: float) -> list:
+    """ 
+    Drop ALL partitions whose period ends at or before Epoch-time 'before' - returns table names of dropped partitions.
+    Rollups and versions are updated (see 'removed_partition()')
+    """
+    quote = db.provider.quote_name
+    dropped = list()
+    for part_start, name in list_partitions():
+        if part_start + PARTITION_PERIOD <= before:
+            ser_nos, ch_ids = partition_sources(name)
+            db.execute(f"DROP TABLE {quote(name)}")
+            removed_partition(part_start, ser_nos, ch_ids)
+            dropped.append(name)
+    return dropped
+
+
+def channel_data_source(start: float = None, end: float = None) -> str:
+    """ 
+    Table expression for reading 'ChannelData'-rows in time-range [start, end]. W. partitions on SQLite, it is a UNION ALL of
+    'ChannelData'-table and ONLY the per-period tables overlapping the range (PostgreSQL prunes partitions by itself)
+    """
+    quote = db.provider.quote_name
+    if not USE_PARTITIONS or db.provider_name == 'postgres':
+        return quote(parent_table())
+    columns = ", ".join(quote(col) for col in ("time_point", "data_point", "from_channel", "to_hub"))
+    tables = [parent_table()] + partitions_in_range(start=start, end=end)
+    return "(" + " UNION ALL ".join(f"SELECT {columns} FROM {quote(table)}" for table in tables) + ")"
@@ -0,0 +1,21 @@
+"""
+@file rollup_resolutions.py
+
+@brief Rollup (continuous aggregate) resolutions, and how a query picks one - shared by the rollups of the Pony API ('rollups.py')
+and of the array-backed store in parent folder ('../channels.py', as 'pony_crud.rollup_resolutions'). So NO imports of sibling modules here.
+"""
+
+
+ROLLUP_RESOLUTIONS = (1, 60, 3600)      # Seconds - each MUST be a multiple of the previous one
+
+
+def bucket_start(time_point: float, resolution: int) -> int:
+    return int(time_point // resolution) * resolution
+
+
+def pick_resolution(bucket_width: float, start: float = None, end: float = None) -> int:
+    """ Coarsest rollup resolution that bucket width AND time-range are whole multiples of - None if there is none (--> use raw samples) """
+    for resolution in reversed(ROLLUP_RESOLUTIONS):
+        if bucket_width % resolution == 0 and all(t is None or t % resolution == 0 for t in (start, end)):
+            return resolution
+    return None
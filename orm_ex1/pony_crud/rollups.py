@@ -0,0 +1,250 @@
+"""
+@file rollups.py
+
+@brief Continuous aggregates - per hub channel and time-bucket: count, sum, min, max and sum of squares of samples,
+kept as 'SampleRollup'-rows at 1s, 1m and 1h resolution.
+
+- Maintained incrementally on ingest: 'add_sensor_data()' passes its rows thru a 'RollupAccumulator', then calls 'upsert_rollups()'
+- Existing samples are (re-)aggregated w. 'backfill_rollups()' - also as CLI:  python rollups.py --backfill [--hub 123] [--channel bma280_temp]
+  (also called for the period of a dropped/detached partition, see 'partitions.py')
+- 'SampleRollup' is NOT exposed thru CRUD routes. CRUD writes of 'ChannelData' bypass the accumulator - so rollups of hours they touch
+  are rebuilt w. 'rebuild_rollups()' (scopes from 'sample_scopes()' before AND after the write, see 'sensorhub_api.track_sample_writes()')
+- 'get_aggregates()' reads rollups whenever bucket width and time-range are whole multiples of a rollup resolution - else raw samples
+"""
+
+import math
+
+from pony.orm import db_session
+
+from models import db, read_db, Channel, ChannelData, SampleRollup
+from db_config import sql_placeholder
+from partitions import channel_data_source
+from versions import bump_versions
+from rollup_resolutions import ROLLUP_RESOLUTIONS, bucket_start, pick_resolution
+
+
+class RollupAccumulator():
+    """ Aggregates samples per bucket of finest resolution, as they pass by (see 'track()') - coarser resolutions are derived from those """
+    def __init__(self) -> None:
+        self.buckets = dict()       # Bucket START --> [count, sum, min, max, sum of squares]
+
+    def add(self, time_point: float, data_point: float) -> None:
+        key = bucket_start(time_point, ROLLUP_RESOLUTIONS[0])
+        agg = self.buckets.get(key)
+        if agg is None:
+            self.buckets[key] = [1, data_point, data_point, data_point, data_point * data_point]
+        else:
+            agg[0] += 1
+            agg[1] += data_point
+            if data_point < agg[2]:
+                agg[2] = data_point
+            if data_point > agg[3]:
+                agg[3] = data_point
+            agg[4] += data_point * data_point
+
+    def track(self, rows):
+        """ Pass-thru generator of (time_point, data_point, ...)-rows - aggregating each row on the way """
+        for row in rows:
+            self.add(row[0], row[1])
+            yield row
+
+    def rollups(self):
+        """ 
+        Generator of (resolution, aggregates) - aggregates as bucket START --> [count, sum, min, max, sum of squares]. Each resolution is
+        derived from the previous (finer) one, so coarse resolutions cost little, however many samples were added
+        """
+        buckets = self.buckets
+        yield ROLLUP_RESOLUTIONS[0], buckets
+        for resolution in ROLLUP_RESOLUTIONS[1:]:
+            coarse = dict()
+            for key, (count, total, min_val, max_val, sum_sq) in buckets.items():
+                key = key // resolution * resolution
+                agg = coarse.get(key)
+                if agg is None:
+                    coarse[key] = [count, total, min_val, max_val, sum_sq]
+                    continue
+                agg[0] += count
+                agg[1] += total
+                if min_val < agg[2]:
+                    agg[2] = min_val
+                if max_val > agg[3]:
+                    agg[3] = max_val
+                agg[4] += sum_sq
+            buckets = coarse
+            yield resolution, buckets
+
+
+def floor_sql(expr: str) -> str:
+    """ SQL for floor(expr) as integer - SQLite has no 'FLOOR()' (w/o math-extension), and CAST truncates towards zero """
+    if db.provider_name == 'postgres':
+        return f"CAST(FLOOR({expr}) AS BIGINT)"
+    return f"(CAST({expr} AS INTEGER) - ({expr} < CAST({expr} AS INTEGER)))"
+
+
+# ****************************** DB-functions (must be called inside a 'db_session') ******************************************
+
+def upsert_rollups(ser_no: int, ch_id: int, accumulator: RollupAccumulator) -> None:
+    """ Merge aggregates of newly ingested samples into 'SampleRollup'-rows - ONE upsert-row per bucket and resolution, sent as ONE batch """
+    db.flush()      # Pending entity changes must hit DB first ...
+    quote = db.provider.quote_name
+    table = quote(SampleRollup._table_)
+    least, greatest = ("LEAST", "GREATEST") if db.provider_name == 'postgres' else ("MIN", "MAX")     # SQLite: multi-arg MIN()/MAX() are scalar
+    columns = ("hub", "channel", "resolution", "bucket", "num_samples", "sum_values", "min_value", "max_value", "sum_squares")
+    sql = f"""INSERT INTO {table} ({', '.join(quote(col) for col in columns)})
+              VALUES ({', '.join([sql_placeholder(db)] * len(columns))})
+              ON CONFLICT ({', '.join(quote(col) for col in columns[:4])}) DO UPDATE SET
+                  {quote('num_samples')} = {table}.{quote('num_samples')} + excluded.{quote('num_samples')},
+                  {quote('sum_values')} = {table}.{quote('sum_values')} + excluded.{quote('sum_values')},
+                  {quote('min_value')} = {least}({table}.{quote('min_value')}, excluded.{quote('min_value')}),
+                  {quote('max_value')} = {greatest}({table}.{quote('max_value')}, excluded.{quote('max_value')}),
+                  {quote('sum_squares')} = {table}.{quote('sum_squares')} + excluded.{quote('sum_squares')}"""
+    rows = [(ser_no, ch_id, resolution, bucket, *agg) for resolution, buckets in accumulator.rollups() for bucket, agg in buckets.items()]
+    if rows:
+        db.get_connection().cursor().executemany(sql, rows)
+
+
+@db_session
+def backfill_rollups(hub_id: int = None, channel_name: str = None, start: int = None, end: int = None) -> int:
+    """
+    (Re-)compute rollups from raw samples - for ALL hubs and channels, or only 'hub_id' and/or 'channel_name', and ALL time or only
+    time-range [start, end) - whose limits must be whole multiples of coarsest resolution (so no bucket is split).
+    Existing rollups in scope are replaced. Returns no. of 'SampleRollup'-rows written
+    """
+    if any(t is not None and t % ROLLUP_RESOLUTIONS[-1] != 0 for t in (start, end)):
+        raise ValueError(f"Time-range of rollup backfill must be whole multiples of {ROLLUP_RESOLUTIONS[-1]} seconds!")
+    quote = db.provider.quote_name
+    table = quote(SampleRollup._table_)
+    params = dict()
+    rollup_filter = ""
+    sample_filter = f"{quote('to_hub')} IS NOT NULL AND {quote('time_point')} IS NOT NULL"      # Both may be NULL after CRUD writes
+    if hub_id is not None:
+        params['hub_id'] = hub_id
+        rollup_filter += f" AND {quote('hub')} = $hub_id"
+        sample_filter += f" AND {quote('to_hub')} = $hub_id"
+    if channel_name is not None:
+        channel = Channel.get(name=channel_name)
+        if channel is None:
+            print(f"Channel named '{channel_name}' does NOT exist - cannot backfill rollups!")
+            return 0
+        params['ch_id'] = channel.ch_id
+        rollup_filter += f" AND {quote('channel')} = $ch_id"
+        sample_filter += f" AND {quote('from_channel')} = $ch_id"
+    if start is not None:
+        params['start'] = start
+        rollup_filter += f" AND {quote('bucket')} >= $start"
+        sample_filter += f" AND {quote('time_point')} >= $start"
+    if end is not None:
+        params['end'] = end
+        rollup_filter += f" AND {quote('bucket')} < $end"
+        sample_filter += f" AND {quote('time_point')} < $end"
+    #
+    db.execute(f"DELETE FROM {table} WHERE 1 = 1{rollup_filter}", params)
+    columns = ("hub", "channel", "resolution", "bucket", "num_samples", "sum_values", "min_value", "max_value", "sum_squares")
+    time_col = quote('time_point')
+    num_rows = 0
+    for resolution in ROLLUP_RESOLUTIONS:
+        bucket = f"{floor_sql(f'{time_col} / {resolution}.0')} * {resolution}"
+        cursor = db.execute(f"""INSERT INTO {table} ({', '.join(quote(col) for col in columns)})
+                                SELECT {quote('to_hub')}, {quote('from_channel')}, {resolution}, {bucket}, COUNT(*), SUM({quote('data_point')}),
+                                       MIN({quote('data_point')}), MAX({quote('data_point')}), SUM({quote('data_point')} * {quote('data_point')})
+                                FROM {channel_data_source(start=start, end=end)} cd
+                                WHERE {sample_filter}
+                                GROUP BY {quote('to_hub')}, {quote('from_channel')}, {bucket}""", params)
+        num_rows += cursor.rowcount
+    return num_rows
+
+
+@db_session
+def last_sample_id() -> int:
+    """ Highest 'ChannelData' ID - samples written later have higher ones """
+    quote = db.provider.quote_name
+    return db.select(f"SELECT MAX({quote('data_id')}) FROM {quote(ChannelData._table_)}")[0] or 0
+
+
+@db_session
+def sample_scopes(data_ids=(), after_id: int = None) -> set:
+    """ (hub, channel ID, hour START)-scopes of rollups that samples w. ID in 'data_ids' - and w. ID > 'after_id', if given - count in """
+    quote = db.provider.quote_name
+    params = {f'id_{idx}': data_id for idx, data_id in enumerate(data_ids)}
+    conditions = [f"{quote('data_id')} IN ({', '.join(f'${name}' for name in params)})"] if params else list()
+    if after_id is not None:
+        params['after_id'] = after_id
+        conditions.append(f"{quote('data_id')} > $after_id")
+    if not conditions:
+        return set()
+    rows = db.select(f"""SELECT {quote('to_hub')}, {quote('from_channel')}, {quote('time_point')} FROM {quote(ChannelData._table_)}
+                         WHERE ({' OR '.join(conditions)}) AND {quote('to_hub')} IS NOT NULL AND {quote('time_point')} IS NOT NULL""", params)
+    return {(hub, ch_id, bucket_start(time_point, ROLLUP_RESOLUTIONS[-1])) for hub, ch_id, time_point in rows}
+
+
+@db_session
+def rebuild_rollups(scopes) -> None:
+    """ Rebuild rollups of (hub, channel ID, hour START)-scopes from raw samples, and bump versions of their hubs/channels """
+    for hub, ch_id, start in sorted(set(scopes)):
+        backfill_rollups(hub_id=hub, channel_name=Channel[ch_id].name, start=start, end=start + ROLLUP_RESOLUTIONS[-1])
+    bump_versions({hub for hub, _, _ in scopes}, {ch_id for _, ch_id, _ in scopes})
+
+
+@db_session
+def get_aggregates(hub_id: int = None, channel_name: str = None, bucket_width: float = 60, start: float = None, end: float = None) -> list:
+    """
+    Aggregates of hub channel per 'bucket_width' seconds (buckets aligned to Epoch), in time-range [start, end) - as list of dicts w.
+    'bucket' (START), 'count', 'mean', 'min', 'max' and 'std' (population std.dev.). Read from rollups whenever resolution allows it -
+    and from replica ('read_db'), if one is configured
+    """
+    quote = read_db.provider.quote_name
+    channel = read_db.Channel.get(name=channel_name)
+    if channel is None:
+        return list()
+    resolution = pick_resolution(bucket_width, start=start, end=end)
+    params = {'hub_id': hub_id, 'ch_id': channel.ch_id}
+    if resolution is not None:
+        # From rollups - i.e. w/o touching sample tables:
+        time_col = quote('bucket')
+        bucket = f"{floor_sql(f'{time_col} / {float(bucket_width)!r}')} * {float(bucket_width)!r}"
+        params['resolution'] = resolution
+        sql = f"""SELECT {bucket}, SUM({quote('num_samples')}), SUM({quote('sum_values')}), MIN({quote('min_value')}),
+                         MAX({quote('max_value')}), SUM({quote('sum_squares')})
+                  FROM {quote(read_db.SampleRollup._table_)}
+                  WHERE {quote('hub')} = $hub_id AND {quote('channel')} = $ch_id AND {quote('resolution')} = $resolution"""
+    else:
+        time_col = quote('time_point')
+        bucket = f"{floor_sql(f'{time_col} / {float(bucket_width)!r}')} * {float(bucket_width)!r}"
+        value = quote('data_point')
+        sql = f"""SELECT {bucket}, COUNT(*), SUM({value}), MIN({value}), MAX({value}), SUM({value} * {value})
+                  FROM {channel_data_source(start=start, end=end)} cd
+                  WHERE {quote('to_hub')} = $hub_id AND {quote('from_channel')} = $ch_id"""
+    if start is not None:
+        params['start'] = start
+        sql += f" AND {time_col} >= $start"
+    if end is not None:
+        params['end'] = end
+        sql += f" AND {time_col} < $end"
+    sql += f" GROUP BY {bucket} ORDER BY {bucket}"
+    #
+    aggregates = list()
+    for bucket_time, count, total, min_val, max_val, sum_sq in read_db.select(sql, params):
+        mean = total / count
+        aggregates.append({'bucket': bucket_time, 'count': count, 'mean': mean, 'min': min_val, 'max': max_val,
+                           'std': math.sqrt(max(sum_sq / count - mean * mean, 0.0))})
+    return aggregates
+
+
+# ****************************** CLI ********************************
+
+if __name__ == "__main__":
+    import argparse
+
+    from db_config import bind_database
+
+    parser = argparse.ArgumentParser(description="Maintain rollups (continuous aggregates) of hub samples")
+    parser.add_argument("--backfill", action="store_true", required=True, help="(Re-)compute rollups from raw samples")
+    parser.add_argument("--hub", type=int, help="Serial no. of hub (default: all)")
+    parser.add_argument("--channel", help="Channel name (default: all)")
+    parser.add_argument("--db", default="sensorhub_db.sqlite", help="SQLite file (ignored if env. variable 'DATABASE_URL' is set)")
+    args = parser.parse_args()
+
+    bind_database(db, sqlite_file=args.db)
+    db.generate_mapping(create_tables=True)
+    num_rows = backfill_rollups(hub_id=args.hub, channel_name=args.channel)
+    print(f"Wrote {num_rows} rollup rows")
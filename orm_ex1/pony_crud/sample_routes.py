@@ -0,0 +1,213 @@
+"""
+@file sample_routes.py
+
+@brief Sample endpoints of one hub channel - '/hubs/{ser_no}/channels/{name}/samples':
+- POST: bulk ingest, i.e. ONE request per batch instead of one per sample
+- GET:  keyset-paginated listing - follow 'next_cursor' of each page (constant time per page, also deep into history).
+        Supports conditional GET - ETag changes only when hub or channel gets new data (see 'etags.py')
+Plus '/hubs/{ser_no}/channels/{name}/aggregates' - count/mean/min/max/std.dev. per time-bucket, from rollups when possible (see 'rollups.py')
+
+Body is parsed incrementally while it streams in, either as
+- a JSON array (Content-Type 'application/json'):  [[<time>, <value>], {"time_point": <time>, "data_point": <value>}, ...]
+- NDJSON (Content-Type 'application/x-ndjson'):     one [<time>, <value>]-pair or {"time_point": ..., "data_point": ...}-object per line
+Samples are validated in bulk BEFORE anything is written (i.e. all-or-nothing), then written thru the bulk insert path.
+Response of POST only holds counts.
+"""
+
+from array import array
+import codecs
+import json
+import math
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fast_pony_crud.security import get_api_key
+
+from db_actions import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, add_sensor_data_async, decode_cursor, get_aggregates_async, get_samples_page_async, get_versions_async
+from etags import etag_headers, etag_matches, make_etag, not_modified
+from fast_json import FastJSONResponse
+
+
+MAX_SAMPLES_PER_REQUEST = 1_000_000
+NDJSON_CONTENT_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+MAX_PENDING_CHARS = 64 * 1024       # Max. size of ONE (incompletely received) array element or NDJSON line - samples are much smaller
+
+# Parser states of 'iter_json_array_items()':
+BEFORE_ARRAY, FIRST_ELEMENT, NEXT_ELEMENT, AFTER_ELEMENT, AFTER_ARRAY = range(5)
+
+json_decoder = json.JSONDecoder()
+
+
+class SampleParseError(ValueError):
+    pass
+
+
+def split_sample(item, idx: int) -> tuple:
+    """ Get (time, value) from '[time, value]' or '{"time_point": time, "data_point": value}' """
+    if isinstance(item, dict):
+        item = (item.get('time_point'), item.get('data_point'))
+    if not isinstance(item, (list, tuple)) or len(item) != 2:
+        raise SampleParseError(f"Sample #{idx}: expected [time, value]-pair or object w. 'time_point' and 'data_point'")
+    return item
+
+
+def collect_samples(items, time_points: array, data_points: array) -> None:
+    """ Append (validated) samples to 'time_points' and 'data_points' - values must be finite numbers (NOT bool) """
+    for item in items:
+        idx = len(time_points)
+        time_point, data_point = split_sample(item, idx)
+        for val in (time_point, data_point):
+            if isinstance(val, bool) or not isinstance(val, (int, float)):
+                raise SampleParseError(f"Sample #{idx}: {val!r} is not a finite number")
+            try:
+                is_finite = math.isfinite(val)
+            except OverflowError:
+                # JSON integer too large for a float - a bad value, NOT a too large request:
+                raise SampleParseError(f"Sample #{idx}: integer value is out of float range")
+            if not is_finite:
+                raise SampleParseError(f"Sample #{idx}: {val!r} is not a finite number")
+        time_points.append(time_point)
+        data_points.append(data_point)
+        if len(time_points) > MAX_SAMPLES_PER_REQUEST:
+            raise OverflowError(f"More than {MAX_SAMPLES_PER_REQUEST} samples in one request")
+
+
+async def iter_ndjson_items(chunks):
+    """ Yield lists of parsed items - ALL complete lines of each received chunk are parsed in ONE 'json.loads()'-call """
+    pending = b""
+    async for chunk in chunks:
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        lines = [line for line in lines if line.strip()]
+        if lines:
+            yield parse_ndjson_lines(lines)
+        if len(pending) > MAX_PENDING_CHARS:
+            raise SampleParseError(f"NDJSON line larger than {MAX_PENDING_CHARS} bytes")
+    if pending.strip():
+        yield parse_ndjson_lines([pending])
+
+
+def parse_ndjson_lines(lines: list) -> list:
+    try:
+        return json.loads(b"[" + b",".join(lines) + b"]")
+    except ValueError as ex:
+        raise SampleParseError(f"Invalid NDJSON: {ex}")
+
+
+async def iter_json_array_items(chunks):
+    """ 
+    Yield lists of parsed elements of a top-level JSON array - each element is decoded as soon as it is completely received.
+    Structure is checked strictly (i.e. no missing, extra or trailing commas), and an element may not exceed MAX_PENDING_CHARS
+    """
+    decoder = codecs.getincrementaldecoder('utf-8')()     # A chunk may end inside a multi-byte character
+    text = ""
+    pos = 0
+    state = BEFORE_ARRAY
+    async for chunk in chunks:
+        try:
+            text = text[pos:] + decoder.decode(chunk)
+        except UnicodeDecodeError as ex:
+            raise SampleParseError(f"Body is not valid UTF-8: {ex}")
+        pos = 0
+        items = list()
+        while True:
+            while pos < len(text) and text[pos] in " \t\r\n":
+                pos += 1
+            if pos == len(text):
+                break
+            char = text[pos]
+            if state == AFTER_ARRAY:
+                raise SampleParseError("Unexpected data after end of JSON array")
+            if state == BEFORE_ARRAY:
+                if char != "[":
+                    raise SampleParseError("Body must be a JSON array")
+                state = FIRST_ELEMENT
+                pos += 1
+            elif state == AFTER_ELEMENT:
+                if char not in ",]":
+                    raise SampleParseError(f"Expected ',' or ']' after array element, got {char!r}")
+                state = NEXT_ELEMENT if char == "," else AFTER_ARRAY
+                pos += 1
+            elif char == "]" and state == FIRST_ELEMENT:
+                state = AFTER_ARRAY     # Empty array
+                pos += 1
+            elif char not in "[{":
+                raise SampleParseError("Array elements must be [time, value]-pairs or objects")
+            else:
+                try:
+                    item, pos = json_decoder.raw_decode(text, pos)
+                except ValueError:
+                    # Element not completely received yet (elements are arrays/objects, so never PARTIALLY decoded) - wait for more data,
+                    # unless so much is pending that it cannot be a sample (i.e. it is malformed):
+                    if len(text) - pos > MAX_PENDING_CHARS:
+                        raise SampleParseError(f"Invalid array element, or element larger than {MAX_PENDING_CHARS} characters")
+                    break
+                items.append(item)
+                state = AFTER_ELEMENT
+        if items:
+            yield items
+    if state != AFTER_ARRAY or text[pos:].strip():
+        raise SampleParseError("Truncated or invalid JSON array")
+
+
+def create_sample_routes(app, prefix: str = "") -> None:
+    """ Add bulk sample ingest route(s) to 'app' - protected by same API key as CRUD routes (header 'api_key') """
+    router = APIRouter()
+
+    async def check_hub_channel(ser_no: int, name: str) -> tuple:
+        """ Raise 404 if hub or channel does not exist - else return their (hub version, channel version) """
+        hub_version, ch_version = await get_versions_async(ser_no=ser_no, ch_name=name)
+        if hub_version is None:
+            raise HTTPException(status_code=404, detail=f"SensorHub with serial no = {ser_no} does NOT exist")
+        if ch_version is None:
+            raise HTTPException(status_code=404, detail=f"Channel named '{name}' does NOT exist")
+        return hub_version, ch_version
+
+    @router.post("/hubs/{ser_no}/channels/{name}/samples", summary="bulk ingest of samples from one hub channel")
+    async def post_samples(ser_no: int, name: str, request: Request, _api_key: str = Depends(get_api_key)) -> dict:
+        # Check hub and channel BEFORE reading (possibly large) body:
+        await check_hub_channel(ser_no, name)
+        #
+        content_type = request.headers.get('content-type', "").split(";")[0].strip().lower()
+        iter_items = iter_ndjson_items if content_type in NDJSON_CONTENT_TYPES else iter_json_array_items
+        time_points = array('d')
+        data_points = array('d')
+        try:
+            async for items in iter_items(request.stream()):
+                collect_samples(items, time_points, data_points)
+        except SampleParseError as ex:
+            raise HTTPException(status_code=400, detail=str(ex))
+        except OverflowError as ex:
+            raise HTTPException(status_code=413, detail=str(ex))
+        #
+        num_inserted = await add_sensor_data_async(ser_no=ser_no, channel_name=name, sensor_data=zip(time_points, data_points))
+        if num_inserted is None:
+            raise HTTPException(status_code=500, detail="Database operation failed")
+        return {'received': len(time_points), 'inserted': num_inserted}
+
+    @router.get("/hubs/{ser_no}/channels/{name}/samples", summary="page of samples from one hub channel, in time-order")
+    async def get_samples(ser_no: int, name: str, request: Request, start: float = None, end: float = None, cursor: str = None,
+                          limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE), _api_key: str = Depends(get_api_key)):
+        if cursor:
+            try:
+                decode_cursor(cursor)
+            except ValueError as ex:
+                raise HTTPException(status_code=400, detail=str(ex))
+        hub_version, ch_version = await check_hub_channel(ser_no, name)
+        etag = make_etag("samples", ser_no, hub_version, ch_version)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        samples, next_cursor = await get_samples_page_async(hub_id=ser_no, channel_name=name, start=start, end=end, cursor=cursor, page_size=limit)
+        return FastJSONResponse({'samples': samples, 'next_cursor': next_cursor}, headers=etag_headers(etag))
+
+    @router.get("/hubs/{ser_no}/channels/{name}/aggregates", summary="aggregates of one hub channel per time-bucket")
+    async def get_channel_aggregates(ser_no: int, name: str, request: Request, bucket_width: float = Query(60, gt=0), start: float = None,
+                                     end: float = None, _api_key: str = Depends(get_api_key)):
+        """ Buckets of 'bucket_width' seconds in time-range [start, end) - read from 1s/1m/1h-rollups if width and range are multiples of one """
+        hub_version, ch_version = await check_hub_channel(ser_no, name)
+        etag = make_etag("aggregates", ser_no, hub_version, ch_version)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        aggregates = await get_aggregates_async(hub_id=ser_no, channel_name=name, bucket_width=bucket_width, start=start, end=end)
+        return FastJSONResponse({'bucket_width': bucket_width, 'aggregates': aggregates}, headers=etag_headers(etag))
+
+    app.include_router(router, prefix=prefix, tags=['Samples'])
@@ -1,12 +1,25 @@
-from fast_pony_crud import create_crud_routes
 import uvicorn
-import os
+import asyncio
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from fast_pony_crud.security import get_api_key
 from pony.orm import db_session, set_sql_debug
 
-from models import db, Channel, ChannelData, SensorHub
+from models import db, read_db, Channel, ChannelData, SensorHub
 from db_actions import get_channel_by_name, get_hub_by_name, get_hub_by_serno, get_hub_data, channel_exists, add_channel, add_hub, add_sensor_data
+from db_actions import get_hub_data_async, get_versions_async, create_sample_index
+from export import EXPORT_FORMATS, check_format, iter_export_async
+from etags import etag_headers, etag_matches, make_etag, not_modified
+from fast_json import FastJSONResponse
+from compression import CompressionMiddleware
+from sample_routes import create_sample_routes
+import db_executor
+from db_config import bind_database, bind_read_database, limit_crud_threads, run_sqlite_maintenance
+from crud_routes import create_split_crud_routes
+from partitions import USE_PARTITIONS, create_partitioned_table, check_partitioned_table
+from versions import bump_all_versions
+from rollups import last_sample_id, rebuild_rollups, sample_scopes
 
 # For functional test:
 import time
@@ -28,18 +41,110 @@ else:
     API_TEST_KEY = None
 
 
-# FastAPI app object:
-app = FastAPI()
+# FastAPI app object - responses serialized w. 'orjson' (see 'fast_json.py'):
+app = FastAPI(default_response_class=FastJSONResponse)
 
-# DB connection:
-database_url = os.environ.get('DATABASE_URL')      # If NOT set (i.e. 'None' returned), use SQLite file as DB. Else, must be valid PostgresDB URL.
-if database_url:
-    db.bind(provider='postgres', dsn=database_url)
-else: 
-    db.bind(provider='sqlite', filename=SQLITE_FILE, create_db=True)
+# Compression negotiated from 'Accept-Encoding' (see 'compression.py') - gateways are on metered links, so bytes matter more than CPU.
+# Streamed exports get lower levels (compressed while streaming, so level limits throughput), health checks are not compressed:
+app.add_middleware(CompressionMiddleware, route_levels=[
+    ("/hubs/*/export", {'zstd': 3, 'br': 4, 'gzip': 5}),
+    ("/health", None),
+])
+
+# DB connection - if env. variable 'DATABASE_URL' is NOT set, use SQLite file as DB (tuned by profile in env. variable 'SQLITE_PROFILE'). Else, must be valid PostgresDB URL:
+bind_database(db, sqlite_file=SQLITE_FILE)
+# Read replica - if env. variable 'DATABASE_READ_URL' is set (PostgreSQL only). Reads of API-endpoints and CRUD GETs go there, writes to primary:
+bind_read_database(read_db, db)
+
+# Time-partitioned 'ChannelData' (env. variable 'USE_PARTITIONS=1') - on PostgreSQL, partitioned table must exist BEFORE mapping:
+if USE_PARTITIONS:
+    create_partitioned_table(db)
 
 # Map model-classes to tables, and - create tables in DB:
 db.generate_mapping(create_tables=True)
+if USE_PARTITIONS:
+    check_partitioned_table(db)
+create_sample_index()
+if read_db is not db:
+    read_db.generate_mapping(create_tables=False)      # Tables (and indexes) are replicated from primary
+
+
+# Periodic SQLite maintenance (PRAGMA optimize + WAL checkpoint) while API server runs:
+@app.on_event("startup")
+async def start_db_maintenance() -> None:
+    app.state.db_maintenance = asyncio.create_task(run_sqlite_maintenance(db))
+
+# CRUD-routes are sync handlers, run in Starlette's thread pool - bound it, so excess requests queue up instead of piling up connections:
+@app.on_event("startup")
+async def limit_db_threads() -> None:
+    limit_crud_threads()
+
+@app.on_event("shutdown")
+async def stop_db_maintenance() -> None:
+    app.state.db_maintenance.cancel()
+    db_executor.shutdown()
+
+
+# ******************************** API-endpoints (DB-work runs on dedicated executors - see 'db_executor.py') ***********************************
+
+@app.get("/health")
+async def health() -> dict:
+    """ Liveness - does NOT touch DB (so never waits behind slow queries), but reports DB-executor queue depths """
+    return {'status': "ok", 'db': db_executor.stats()}
+
+
+@app.get("/metrics/db", dependencies=[Depends(get_api_key)])
+async def db_metrics() -> dict:
+    return {**db_executor.stats(), 'read_replica': read_db is not db}
+
+
+@app.get("/hubs/{ser_no}/data", dependencies=[Depends(get_api_key)])
+async def read_hub_data(ser_no: int, request: Request, channels: list = Query(None), start: float = None, end: float = None):
+    """ Samples from hub - optionally only from some channels and/or time-range [start, end] (Epoch-time). Supports 'If-None-Match' (--> 304) """
+    hub_version, _ = await get_versions_async(ser_no=ser_no)
+    if hub_version is None:
+        raise HTTPException(status_code=404, detail=f"SensorHub with serial no = {ser_no} does NOT exist")
+    etag = make_etag("hub", ser_no, hub_version)
+    if etag_matches(request, etag):
+        return not_modified(etag)
+    data = await get_hub_data_async(hub_id=ser_no, channel_names=channels, start=start, end=end)
+    # Arrays go to response as-is - serialized natively, w/o 'jsonable_encoder':
+    return FastJSONResponse({ch_name: {'time_points': time_points, 'data_points': data_points} for ch_name, (time_points, data_points) in data.items()},
+                            headers=etag_headers(etag))
+
+
+@app.get("/hubs/{ser_no}/export", dependencies=[Depends(get_api_key)])
+async def export_hub_data(ser_no: int, format: str = 'csv', channels: list = Query(None), start: float = None, end: float = None):
+    """ Streaming export of hub data as CSV, Arrow IPC stream or Parquet - memory use is constant, regardless of size (see 'export.py') """
+    try:
+        check_format(format)
+    except ValueError as ex:
+        raise HTTPException(status_code=400, detail=str(ex))
+    hub_version, _ = await get_versions_async(ser_no=ser_no)
+    if hub_version is None:
+        raise HTTPException(status_code=404, detail=f"SensorHub with serial no = {ser_no} does NOT exist")
+    media_type, extension = EXPORT_FORMATS[format]
+    return StreamingResponse(iter_export_async(fmt=format, hub_id=ser_no, channel_names=channels, start=start, end=end), media_type=media_type,
+                             headers={'Content-Disposition': f'attachment; filename="hub_{ser_no}.{extension}"'})
+
+
+# Bulk sample ingest - 'POST /hubs/{ser_no}/channels/{name}/samples' (see 'sample_routes.py'):
+create_sample_routes(app)
+
+
+def track_sample_writes(request: Request):
+    """
+    Write-hook of CRUD routes of 'ChannelData' (see 'crud_routes.py') - they bypass rollups of ingest, so rollups of hours where samples
+    were (updated/deleted sample, before write) and are (new/updated samples, after write) get rebuilt. Also bumps versions of their hubs/channels
+    """
+    try:
+        data_ids = [int(request.path_params['data_id'])] if 'data_id' in request.path_params else list()
+    except ValueError:
+        data_ids = list()           # Route rejects it (422)
+    after_id = last_sample_id()
+    scopes = sample_scopes(data_ids=data_ids)
+    yield
+    rebuild_rollups(scopes | sample_scopes(data_ids=data_ids, after_id=after_id))
 
 
 
@@ -95,7 +200,7 @@ def show_data(hub_id: int = None, verbose: bool = True) -> None:
         print(f"\nData from hub {hub_id}:")
         print("==========================")
         if verbose:
-            print(f"Values from channel {k}:\n{v}\n")
+            print(f"Values from channel {k}:\n{list(zip(*v))}\n")
         plot_data(ch_name=k, data=v)
 
 
@@ -107,7 +212,8 @@ if __name__ == "__main__":
     # Then, check channel-data for some hub(s):
     show_data(hub_id=123)
     # Let 'FastPonyCRUD' library AUTOMAGICALLY create GET/PUT/POST/DELETE-endpoints for each entity-model!
-    create_crud_routes(db, app, prefix="/test_api", api_key="test123")
+    create_split_crud_routes(db, read_db, app, prefix="/test_api", api_key="test123", on_write=bump_all_versions,
+                             exclude_tables=("SampleRollup",), write_hooks={'ChannelData': track_sample_writes})     # Rollups: derived from samples
     #
     # Run API server - 'uvicorn' will automatically refresh API whenever code changes in folder!
     uvicorn.run(app, port=8889)
@@ -0,0 +1,40 @@
+"""
+@file versions.py
+
+@brief Version counters of hubs and channels - ETags are derived from them (see 'etags.py'), so EVERY path that changes
+samples, hubs or channels must bump them:
+- bulk ingest ('db_actions.add_sensor_data()') - hub and channel written to
+- partition detach/drop ('partitions.py') - hubs and channels w. rows in removed partition(s)
+- CRUD write routes ('crud_routes.py') - ALL hubs and channels (a CRUD write may touch any of them)
+- rollup rebuilds after CRUD writes of samples ('rollups.rebuild_rollups()') - hubs and channels of rebuilt rollups
+Counters are incremented in DB (i.e. no lost updates between concurrent writers). Must be called inside a 'db_session'.
+"""
+
+from pony.orm import db_session
+
+from models import db, Channel, SensorHub
+
+
+def bump_table_versions(entity, key: str, ids=None) -> None:
+    """ Increment version of rows of 'entity' w. 'key' in 'ids' - ALL rows if 'ids' is None """
+    quote = db.provider.quote_name
+    sql = f"UPDATE {quote(entity._table_)} SET {quote('version')} = COALESCE({quote('version')}, 0) + 1"
+    if ids is None:
+        db.execute(sql)
+        return
+    params = {f'id_{idx}': id_ for idx, id_ in enumerate(sorted(set(ids)))}
+    if params:
+        db.execute(f"{sql} WHERE {quote(key)} IN ({', '.join(f'${name}' for name in params)})", params)
+
+
+def bump_versions(ser_nos, ch_ids) -> None:
+    """ Increment version counters of hubs w. serial no. in 'ser_nos', and of channels w. ID in 'ch_ids' """
+    bump_table_versions(SensorHub, 'ser_no', ser_nos)
+    bump_table_versions(Channel, 'ch_id', ch_ids)
+
+
+@db_session
+def bump_all_versions() -> None:
+    """ Increment version counters of ALL hubs and channels - e.g. after a write whose scope is not known """
+    bump_table_versions(SensorHub, 'ser_no')
+    bump_table_versions(Channel, 'ch_id')
@@ -0,0 +1,50 @@
+"""
+@file rollup_buckets.py
+
+@brief Vectorized per-bucket aggregates of time-series - count, sum, min, max and sum of squares - for continuous aggregates (rollups).
+
+Buckets are aligned to Epoch, i.e. bucket START = floor(time / width) * width. Aggregates are returned as a tuple of arrays
+(bucket starts, counts, sums, mins, maxs, sums of squares) - sorted on bucket START, one entry per NON-empty bucket.
+Aggregates of a fine resolution can be combined into a coarser one (see 'combine_buckets()'), as all of them are mergeable.
+"""
+
+import math
+
+import numpy as np
+
+
+def empty_buckets() -> tuple:
+    return tuple(np.empty(0, dtype=np.int64 if idx == 1 else np.float64) for idx in range(6))
+
+
+def combine_buckets(bucket_width: float, starts, counts, sums, mins, maxs, sum_sqs) -> tuple:
+    """ Merge aggregates (e.g. of a finer resolution) into buckets of 'bucket_width' """
+    starts = np.asarray(starts, dtype=np.float64)
+    if starts.size == 0:
+        return empty_buckets()
+    keys = np.floor(starts / bucket_width) * bucket_width
+    order = np.argsort(keys, kind='stable')
+    keys = keys[order]
+    first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])      # Index of first entry of each bucket
+    return (keys[first],
+            np.add.reduceat(np.asarray(counts, dtype=np.int64)[order], first),
+            np.add.reduceat(np.asarray(sums, dtype=np.float64)[order], first),
+            np.minimum.reduceat(np.asarray(mins, dtype=np.float64)[order], first),
+            np.maximum.reduceat(np.asarray(maxs, dtype=np.float64)[order], first),
+            np.add.reduceat(np.asarray(sum_sqs, dtype=np.float64)[order], first))
+
+
+def aggregate_buckets(time_points, values, bucket_width: float) -> tuple:
+    """ Aggregates of raw samples per bucket of 'bucket_width' - time-points as Epoch-time, need NOT be sorted """
+    values = np.asarray(values, dtype=np.float64)
+    return combine_buckets(bucket_width, time_points, np.ones(values.size, dtype=np.int64), values, values, values, values * values)
+
+
+def to_records(aggregates: tuple) -> list:
+    """ List of dicts w. 'bucket' (START), 'count', 'mean', 'min', 'max' and 'std' (population std.dev.) - one per bucket """
+    records = list()
+    for bucket, count, total, min_val, max_val, sum_sq in zip(*(column.tolist() for column in aggregates)):
+        mean = total / count
+        records.append({'bucket': bucket, 'count': count, 'mean': mean, 'min': min_val, 'max': max_val,
+                        'std': math.sqrt(max(sum_sq / count - mean * mean, 0.0))})
+    return records
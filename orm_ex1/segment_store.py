@@ -0,0 +1,71 @@
+"""
+@file segment_store.py
+
+@brief Append-only binary segment files, one series of files per channel - read back thru 'mmap'.
+
+Each sample is stored as a (time, value)-pair of little-endian float64 (16 bytes). A channel's samples go into segment files
+named 'ch<ch_id>_<seg_no>.seg' in the store directory; a new segment file is started when current one exceeds SEGMENT_MAX_BYTES.
+The file store knows nothing about time-ranges - the DB keeps (seg_no, byte-offset, no. of samples, time-range) per appended block.
+"""
+
+import mmap
+import os
+import re
+
+import numpy as np
+
+
+SAMPLE_DTYPE = np.dtype([('time', '<f8'), ('value', '<f8')])
+SEGMENT_MAX_BYTES = 64 * 1024 * 1024        # Roll over to new segment file at 64MB (~4M samples)
+
+SEGMENT_NAME_PATTERN = re.compile(r"ch(\d+)_(\d+)\.seg$")
+
+
+class SegmentStore():
+    def __init__(self, base_dir: str = "segments", max_segment_bytes: int = SEGMENT_MAX_BYTES) -> None:
+        self.base_dir = base_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.current_segments = dict()      # Channel ID --> no. of segment file currently appended to
+        self.mappings = dict()              # Segment path --> (mapped size, mmap-object)
+        os.makedirs(base_dir, exist_ok=True)
+
+    def segment_path(self, ch_id: int, seg_no: int) -> str:
+        return os.path.join(self.base_dir, f"ch{ch_id:06d}_{seg_no:06d}.seg")
+
+    def current_segment(self, ch_id: int) -> int:
+        if ch_id not in self.current_segments:
+            # Find last segment of channel on disk (if any):
+            seg_nos = [int(match.group(2)) for match in map(SEGMENT_NAME_PATTERN.match, os.listdir(self.base_dir))
+                       if match and int(match.group(1)) == ch_id]
+            self.current_segments[ch_id] = max(seg_nos, default=0)
+        return self.current_segments[ch_id]
+
+    def append(self, ch_id: int, time_offsets, values) -> tuple:
+        """ Append block of samples to channel's current segment file - returns (seg_no, byte-offset) of block """
+        block = np.empty(len(time_offsets), dtype=SAMPLE_DTYPE)
+        block['time'] = time_offsets
+        block['value'] = values
+        seg_no = self.current_segment(ch_id)
+        path = self.segment_path(ch_id, seg_no)
+        if os.path.exists(path) and os.path.getsize(path) >= self.max_segment_bytes:
+            seg_no += 1
+            self.current_segments[ch_id] = seg_no
+            path = self.segment_path(ch_id, seg_no)
+        # NOTE: if the DB-transaction recording this block is rolled back, the bytes stay in file unreferenced - harmless for an append-only file.
+        with open(path, 'ab') as seg_file:
+            byte_offset = seg_file.tell()
+            seg_file.write(block.tobytes())
+        return seg_no, byte_offset
+
+    def read(self, ch_id: int, seg_no: int, byte_offset: int, num_samples: int) -> np.ndarray:
+        """ Get block of samples as structured array ('time', 'value') - a view directly on mapped file, i.e. no copy """
+        path = self.segment_path(ch_id, seg_no)
+        mapped_size, mapping = self.mappings.get(path, (0, None))
+        end_offset = byte_offset + num_samples * SAMPLE_DTYPE.itemsize
+        if end_offset > mapped_size:
+            # File has grown since it was mapped (or never mapped) - (re-)map it:
+            with open(path, 'rb') as seg_file:
+                mapping = mmap.mmap(seg_file.fileno(), 0, access=mmap.ACCESS_READ)
+            mapped_size = len(mapping)
+            self.mappings[path] = (mapped_size, mapping)
+        return np.frombuffer(mapping, dtype=SAMPLE_DTYPE, count=num_samples, offset=byte_offset)
@@ -0,0 +1,94 @@
+"""
+@file sensor_arrays.py
+
+@brief Array-backed variant of 'SensorData' - samples held as two float64-arrays (16 bytes/sample), instead of a list of
+(time, value)-tuples. Arrays are kept as given if already float64 - incl. strided views (e.g. columns of segment-file records),
+so no samples are copied.
+"""
+
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import numpy as np
+
+from stream_export import iter_sample_blocks, write_blocks
+
+
+def empty_array() -> np.ndarray:
+    return np.empty(0, dtype=np.float64)
+
+
+@dataclass
+class SensorArrayData():
+    """ Dataclass for passing sensor-data around outside DB - columnar, w. NumPy-arrays """
+    hub_name: str = str()
+    hub_id: int = 0
+    ch_name: str = str()
+    ch_desc: str = str()
+    ch_id: int = int()
+    unit: str = str()
+    start_datetime: float = 0.0
+    time_values: np.ndarray = field(default_factory=empty_array)      # Time-offsets from START-time
+    sensor_values: np.ndarray = field(default_factory=empty_array)    # Sample values
+
+    def __post_init__(self):
+        # No copy if already float64-arrays (contiguous OR strided views):
+        self.time_values = np.asarray(self.time_values, dtype=np.float64)
+        self.sensor_values = np.asarray(self.sensor_values, dtype=np.float64)
+        if self.time_values.shape != self.sensor_values.shape:
+            raise ValueError(f"Got {self.time_values.size} time values but {self.sensor_values.size} data values!")
+
+    def __len__(self) -> int:
+        return self.time_values.size
+
+    @property
+    def sensor_data(self) -> tuple:
+        """ Columnar views - i.e. no copy """
+        return self.time_values, self.sensor_values
+
+    @property
+    def data(self) -> list:
+        """ Samples as list of (time, value)-tuples, like 'SensorData.data' - NOTE: makes a copy! """
+        return list(zip(self.time_values.tolist(), self.sensor_values.tolist()))
+
+    def memoryviews(self) -> tuple:
+        """ 
+        Contiguous, buffer-protocol views of time- and sample-values - e.g. for writing to file/socket.
+        Zero-copy for contiguous arrays - strided views (segment files) ARE copied, as writers need contiguous buffers
+        """
+        return memoryview(np.ascontiguousarray(self.time_values)), memoryview(np.ascontiguousarray(self.sensor_values))
+
+    def info(self, sink=None):
+        print("================================================================", file=sink)
+        print("Sensor-data INFO", file=sink)
+        print("================================================================", file=sink)
+        print(f"Hub name: {self.hub_name}", file=sink)
+        print(f"Hub ID: {self.hub_id}", file=sink)
+        print(f"Channel name: {self.ch_name}", file=sink)
+        print(f"Description: {self.ch_desc}", file=sink)
+        print(f"Channel ID: {self.ch_id}", file=sink)
+        print(f"START-time (first sample): {datetime.fromtimestamp(self.start_datetime)}", file=sink)
+
+    def show(self, sink=None):
+        """ Show info and ALL samples - written in large, formatted blocks to 'sink' (default: stdout) """
+        self.info(sink=sink)
+        #
+        print("----------------------------------------------------------------", file=sink)
+        print("Data:", file=sink)
+        # Get Epoch-time (i.e. 'absolute' time) from START-time + delta-time:
+        write_blocks(iter_sample_blocks(self.time_values, self.sensor_values, start_datetime=self.start_datetime, unit=self.unit), sink=sink)
+        print("----------------------------------------------------------------\n", file=sink)
+
+    def get(self) -> dict:
+        """ Like 'SensorData.get()', but w/o deep-copy thru 'asdict()' - arrays are passed by reference """
+        return {
+            'hub_name': self.hub_name,
+            'hub_id': self.hub_id,
+            'ch_name': self.ch_name,
+            'ch_desc': self.ch_desc,
+            'ch_id': self.ch_id,
+            'unit': self.unit,
+            'start_datetime': self.start_datetime,
+            'time_values': self.time_values,
+            'sensor_values': self.sensor_values,
+        }
@@ -1,23 +1,48 @@
+"""
+@file sensorhub_api.py
+
+@brief CRUD-only API (FastPonyCRUD) on models in 'models.py'. DB binding (incl. read replica) and thread-pool sizing are
+shared w. the full API in 'pony_crud/' - see 'pony_crud/db_config.py'.
+"""
+
+import os
+
 from fastapi import FastAPI
-from models import db
-from fast_pony_crud import create_crud_routes
 import uvicorn
-import os
+
+from models import db, read_db
+from pony_crud.db_config import bind_database, bind_read_database, crud_thread_stats, limit_crud_threads
+from pony_crud.crud_routes import create_split_crud_routes
 
 
 app = FastAPI()
 
-database_url = os.environ.get('DATABASE_URL')      # If NOT set (i.e. 'None' returned), use SQLite file as DB.
-if database_url:
-    db.bind(provider='postgres', dsn=database_url)
-else: 
-    db.bind(provider='sqlite', filename='database.sqlite', create_db=True)
+# PostgreSQL if env. variable 'DATABASE_URL' is set, else SQLite file next to this script (absolute path - Pony resolves relative
+# SQLite paths against the CALLER's folder, i.e. 'pony_crud/'):
+bind_database(db, sqlite_file=os.path.join(os.path.dirname(os.path.abspath(__file__)), "database.sqlite"))
 db.generate_mapping(create_tables=True)
 
-create_crud_routes(db, app, prefix="/db", api_key="test123")
+# Read replica (env. variable 'DATABASE_READ_URL', PostgreSQL only) - CRUD GETs go there, writes to primary:
+bind_read_database(read_db, db)
+if read_db is not db:
+    read_db.generate_mapping(create_tables=False)      # Tables are replicated from primary
+
+create_split_crud_routes(db, read_db, app, prefix="/db", api_key="test123")
+
+
+# CRUD-routes are sync (Pony 'db_session') handlers, run in Starlette's thread pool - bound it (env. variable 'DB_CRUD_THREADS'),
+# so excess requests queue up instead of piling up threads and connections:
+@app.on_event("startup")
+async def limit_db_threads() -> None:
+    limit_crud_threads()
+
+
+@app.get("/health")
+async def health() -> dict:
+    """ Liveness - async and w/o DB-access, so it never waits for a thread behind slow queries """
+    return {'status': "ok", 'db_threads': crud_thread_stats()}
 
 
 # ****************************** Run API server ********************************
 if __name__ == "__main__":
     uvicorn.run(app, port=8889)
-
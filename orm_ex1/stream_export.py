@@ -0,0 +1,54 @@
+"""
+@file stream_export.py
+
+@brief Streaming, buffered text output of time-series samples.
+
+Samples are formatted in blocks (vectorized w. NumPy - incl. timestamps), and each block is yielded as ONE string.
+The generator can be fed directly to e.g. FastAPI's 'StreamingResponse', or written to any file-like sink w. 'write_blocks()'.
+"""
+
+import sys
+import time
+
+import numpy as np
+
+
+BLOCK_SIZE = 4096       # No. of samples (i.e. lines) per yielded block
+
+
+def format_datetimes(epoch_times: np.ndarray) -> np.ndarray:
+    """ Format Epoch-times as local date-time strings, e.g. '2022-10-31 12:00:00.000000' - local UTC-offset taken from first value """
+    utc_offset = time.localtime(float(epoch_times[0])).tm_gmtoff if epoch_times.size else 0
+    local_us = np.rint((epoch_times + utc_offset) * 1e6).astype(np.int64).astype('datetime64[us]')
+    return np.char.replace(np.datetime_as_string(local_us, unit='us'), 'T', ' ')
+
+
+def iter_sample_blocks(time_values, sensor_values, start_datetime: float = 0.0, unit: str = "", absolute_time: bool = True,
+                       block_size: int = BLOCK_SIZE):
+    """
+    Generator of formatted text blocks, one line per sample:
+    - absolute_time=True  --> 'DateTime: <local date-time>\\t\\tValue = <value> <unit>' (time = START-time + time-offset)
+    - absolute_time=False --> 'Sample <idx>: time = <time-offset>, value = <value> <unit>'
+    """
+    time_values = np.asarray(time_values, dtype=np.float64)
+    sensor_values = np.asarray(sensor_values, dtype=np.float64)
+    for pos in range(0, time_values.size, block_size):
+        block_t = time_values[pos:pos + block_size]
+        values = np.char.mod('%.3f', sensor_values[pos:pos + block_size])
+        if absolute_time:
+            lines = np.char.add(np.char.add(np.char.add("DateTime: ", format_datetimes(start_datetime + block_t)), "\t\tValue = "), values)
+        else:
+            indices = np.char.mod('Sample %d: time = ', np.arange(pos, pos + block_t.size))
+            lines = np.char.add(np.char.add(np.char.add(indices, np.char.mod('%.3f', block_t)), ", value = "), values)
+        yield f" {unit}\n".join(lines.tolist()) + f" {unit}\n"
+
+
+def write_blocks(blocks, sink=None) -> int:
+    """ Write text blocks to file-like sink (default: stdout) - ONE write per block. Returns no. of characters written """
+    sink = sys.stdout if sink is None else sink
+    num_chars = 0
+    for block in blocks:
+        sink.write(block)
+        num_chars += len(block)
+    sink.flush()
+    return num_chars
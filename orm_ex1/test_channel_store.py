@@ -0,0 +1,252 @@
+"""
+@file test_channel_store.py
+
+@brief Tests of the array-backed channel store in 'channels.py' (in-memory SQLite DB, see 'conftest.py') - no API server needed:
+- chunk codec round-trip, incl. NaN, +/-Inf and -0.0 (bit-exact)
+- bulk ingest: samples round-trip thru sealed chunks AND head-chunk
+- time-range reads (start/end/limit), and rejection of batches NOT in time-order
+- rollups vs. aggregates computed from raw samples (also after backfill)
+- downsampling defaults of 'get_sensor_data()'
+- segment files: 'USE_SEGMENT_FILES' read when a channel is created, round-trip and range reads, no copies of mapped samples
+
+Run:  python -m pytest test_channel_store.py
+"""
+
+import math
+
+import numpy as np
+import pytest
+
+import channels
+from channels import create_sensor_hub, add_data_to_hub, add_array_data_to_hub, get_sensor_data, get_aggregates, backfill_rollups
+from chunk_codec import TIME_RESOLUTION, encode_chunk, decode_chunk
+
+
+START_TIME = 1_700_000_000.0
+NUM_SAMPLES = 5000
+
+
+def same_bits(a, b) -> bool:
+    """ Float-arrays equal bit for bit - i.e. NaN == NaN, and -0.0 != 0.0 """
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    return a.shape == b.shape and np.array_equal(a.view(np.int64), b.view(np.int64))
+
+
+@pytest.fixture(scope="module")
+def samples():
+    """ (time-points, values) - sorted, irregular time-points, incl. -0.0, smallest subnormal and a huge value """
+    rng = np.random.default_rng(42)
+    t_values = START_TIME + np.sort(rng.uniform(0, 8000, NUM_SAMPLES))
+    y_values = rng.normal(size=NUM_SAMPLES)
+    y_values[[10, 20, 30]] = [-0.0, 5e-324, 1e150]
+    return t_values, y_values
+
+
+def raw_aggregates(t_values, y_values, bucket_width: float, start: float = None, end: float = None) -> dict:
+    """ Bucket START --> (count, mean, min, max, std) - straight from samples """
+    mask = np.ones(t_values.size, dtype=bool)
+    if start is not None:
+        mask &= t_values >= start
+    if end is not None:
+        mask &= t_values < end
+    keys = np.floor(t_values[mask] / bucket_width) * bucket_width
+    values = y_values[mask]
+    return {float(key): (int((keys == key).sum()), values[keys == key].mean(), values[keys == key].min(), values[keys == key].max(),
+                         values[keys == key].std()) for key in np.unique(keys)}
+
+
+def ingest(ser_no: int, t_values, y_values, num_parts: int = 7) -> None:
+    """ New hub w. channel 'BMA380_temp', filled in several ingests - i.e. sealed chunks AND a head-chunk """
+    create_sensor_hub(hub_name=f"Hub{ser_no}", ser_no=ser_no, ch_names=['BMA380_temp'])
+    for part in np.array_split(np.arange(len(t_values)), num_parts):
+        add_array_data_to_hub(id=ser_no, ch_name='BMA380_temp', time_points=t_values[part], data_points=y_values[part])
+
+
+# ****************************************** Chunk codec *********************************************
+
+def test_codec_special_values_bit_exact():
+    special = [0.0, -0.0, math.nan, math.inf, -math.inf, 1.5, -0.0, math.nan, 5e-324, -1.7976931348623157e308]
+    t_offsets = np.arange(len(special)) * 0.01
+    t_out, y_out = decode_chunk(encode_chunk(t_offsets, special))
+    assert same_bits(y_out, special)
+    assert np.allclose(t_out, t_offsets, rtol=0.0, atol=TIME_RESOLUTION)
+
+
+def test_codec_random_walk():
+    rng = np.random.default_rng(42)
+    t_offsets = np.cumsum(rng.exponential(0.5, NUM_SAMPLES))
+    values = np.cumsum(rng.normal(size=NUM_SAMPLES))
+    t_out, y_out = decode_chunk(encode_chunk(t_offsets, values))
+    assert same_bits(y_out, values)
+    assert np.allclose(t_out, t_offsets, rtol=0.0, atol=TIME_RESOLUTION)
+
+
+def test_codec_all_dod_buckets():
+    """ Time-steps that need every delta-of-delta bucket - incl. 64-bit fallback - and repeated time-points """
+    steps = np.array([0.0, 0.0, 1e-6, 5e-5, 1e-4, 3e-3, 1.0, 1e4, 1e7, 0.0, 1e-6])
+    t_offsets = np.cumsum(steps)
+    values = np.arange(steps.size, dtype=np.float64)
+    t_out, y_out = decode_chunk(encode_chunk(t_offsets, values))
+    assert same_bits(y_out, values)
+    assert np.allclose(t_out, t_offsets, rtol=0.0, atol=TIME_RESOLUTION)
+
+
+def test_codec_empty_chunk():
+    assert decode_chunk(encode_chunk([], [])) == ([], [])
+
+
+# ****************************************** Bulk ingest *********************************************
+
+def test_array_ingest_round_trip(channel_db, samples):
+    t_values, y_values = samples
+    ingest(777, t_values, y_values)
+    data = get_sensor_data(hub_id=777, ch_name='BMA380_temp', as_arrays=True)
+    assert same_bits(data.sensor_values, y_values)
+    assert np.allclose(data.start_datetime + data.time_values, t_values, rtol=0.0, atol=1e-5)
+
+
+def test_tuple_ingest_round_trip(channel_db):
+    create_sensor_hub(hub_name="TupleHub", ser_no=780, ch_names=['BMA380_temp'])
+    tsd = [(START_TIME + idx * 0.5, float(idx)) for idx in range(1500)]
+    add_data_to_hub(id=780, ch_name='BMA380_temp', tsd=tsd)
+    data = get_sensor_data(hub_id=780, ch_name='BMA380_temp')
+    assert [value for _, value in data.data] == [value for _, value in tsd]
+    assert np.allclose([data.start_datetime + t for t, _ in data.data], [t for t, _ in tsd], rtol=0.0, atol=1e-5)
+
+
+# ****************************************** Time-range reads *********************************************
+
+@pytest.mark.parametrize("start_idx, end_idx, limit", [(None, None, 100), (500, 1500, None), (500, 4200, 333), (1023, 1024, None),
+                                                       (None, 10, None), (4990, None, 50)])
+def test_range_read(channel_db, samples, start_idx, end_idx, limit):
+    """
+    'limit' keeps the LAST samples in range - same as slicing the raw samples.
+    Range boundaries are midway between samples, as time-offsets in sealed chunks are quantized to TIME_RESOLUTION
+    """
+    t_values, y_values = samples
+    if get_sensor_data(hub_id=781, ch_name='BMA380_temp') is None:
+        ingest(781, t_values, y_values)
+    start = None if start_idx is None else float(t_values[start_idx - 1] + t_values[start_idx]) / 2
+    end = None if end_idx is None else float(t_values[end_idx] + t_values[end_idx + 1]) / 2
+    data = get_sensor_data(hub_id=781, ch_name='BMA380_temp', start=start, end=end, limit=limit, as_arrays=True)
+    in_range = np.ones(NUM_SAMPLES, dtype=bool)
+    if start is not None:
+        in_range &= t_values >= start
+    if end is not None:
+        in_range &= t_values <= end
+    expected = y_values[in_range][-limit if limit else 0:]
+    assert same_bits(data.sensor_values, expected)
+
+
+def test_batch_not_in_time_order_rejected(channel_db):
+    create_sensor_hub(hub_name="OrderHub", ser_no=782, ch_names=['BMA380_temp'])
+    time_points = START_TIME + np.arange(2000, dtype=np.float64)
+    last = float(time_points[1499])
+    add_array_data_to_hub(id=782, ch_name='BMA380_temp', time_points=time_points[:1500], data_points=np.arange(1500.0))
+    # Unsorted batch - and batch older than samples already stored (i.e. in sealed chunks AND head-chunk):
+    add_array_data_to_hub(id=782, ch_name='BMA380_temp', time_points=time_points[1600:1500:-1], data_points=np.ones(100))
+    add_array_data_to_hub(id=782, ch_name='BMA380_temp', time_points=time_points[1400:1600], data_points=np.ones(200))
+    add_array_data_to_hub(id=782, ch_name='BMA380_temp', time_points=time_points[:10], data_points=np.ones(10))
+    data = get_sensor_data(hub_id=782, ch_name='BMA380_temp', as_arrays=True)
+    assert same_bits(data.sensor_values, np.arange(1500.0))
+    # Time-point equal to LAST stored one is still in time-order:
+    add_array_data_to_hub(id=782, ch_name='BMA380_temp', time_points=time_points[1499:], data_points=np.arange(1499.0, 2000.0))
+    data = get_sensor_data(hub_id=782, ch_name='BMA380_temp', start=last, end=last, as_arrays=True)
+    assert data.sensor_values.tolist() == [1499.0, 1499.0]
+
+
+# ****************************************** Rollups *********************************************
+
+@pytest.fixture(scope="module")
+def rollup_samples(channel_db, samples):
+    """ Samples of hub 778 - w/o huge value, so means can be compared """
+    t_values, y_values = samples
+    y_values = y_values.copy()
+    y_values[30] = 0.0
+    ingest(778, t_values, y_values)
+    return t_values, y_values
+
+
+def rollup_rows(ser_no: int) -> list:
+    with channels.db_session:
+        return sorted((r.resolution, r.bucket, r.num_samples, round(r.sum_values, 9))
+                      for r in channels.SampleRollup.select(lambda r: r.channel.to_hub.ser_no == ser_no))
+
+
+@pytest.mark.parametrize("bucket_width, start, end", [(60, None, None), (3600, START_TIME - 800, START_TIME + 3600), (7.5, None, None),
+                                                      (120, START_TIME + 40, START_TIME + 4000)])
+def test_rollups_match_raw_aggregates(rollup_samples, bucket_width, start, end):
+    t_values, y_values = rollup_samples
+    aggregates = get_aggregates(hub_id=778, ch_name='BMA380_temp', bucket_width=bucket_width, start=start, end=end)
+    expected = raw_aggregates(t_values, y_values, bucket_width, start=start, end=end)
+    assert len(aggregates) == len(expected)
+    for agg in aggregates:
+        count, mean, min_val, max_val, std = expected[float(agg['bucket'])]
+        assert (agg['count'], agg['min'], agg['max']) == (count, min_val, max_val)
+        assert math.isclose(agg['mean'], mean, abs_tol=1e-9) and math.isclose(agg['std'], std, abs_tol=1e-6)
+
+
+def test_backfill_matches_incremental_rollups(rollup_samples):
+    before = rollup_rows(778)
+    backfill_rollups(hub_id=778)
+    assert rollup_rows(778) == before and before
+
+
+# ****************************************** Downsampling *********************************************
+
+def test_downsampling_defaults(channel_db, samples):
+    t_values, y_values = samples
+    ingest(783, t_values, y_values)
+    # 'bucket_width' alone --> 'mean' per bucket (buckets start at first sample):
+    data = get_sensor_data(hub_id=783, ch_name='BMA380_temp', bucket_width=600, as_arrays=True)
+    offsets = t_values - data.start_datetime
+    buckets = np.floor(offsets / 600)
+    assert np.allclose(data.sensor_values, [y_values[buckets == bucket].mean() for bucket in np.unique(buckets)], rtol=1e-12, atol=1e-12)
+    # 'max_points' alone --> 'lttb', which keeps first and last sample:
+    data = get_sensor_data(hub_id=783, ch_name='BMA380_temp', max_points=100, as_arrays=True)
+    assert len(data) == 100
+    assert data.sensor_values[0] == y_values[0] and data.sensor_values[-1] == y_values[-1]
+    # 'lttb' needs 'max_points', and method must be known:
+    assert get_sensor_data(hub_id=783, ch_name='BMA380_temp', bucket_width=600, method='lttb') is None
+    assert get_sensor_data(hub_id=783, ch_name='BMA380_temp', max_points=100, method='median') is None
+
+
+# ****************************************** Segment files *********************************************
+
+@pytest.fixture
+def segment_dir(tmp_path, monkeypatch):
+    """ Segment files in a temp. dir - w. a new 'SegmentStore', as it is created on first use """
+    monkeypatch.setattr(channels, 'SEGMENT_DIR', str(tmp_path))
+    monkeypatch.setattr(channels, 'segment_store', None)
+    return tmp_path
+
+
+def test_use_segments_read_at_creation(channel_db, segment_dir, monkeypatch):
+    monkeypatch.setattr(channels, 'USE_SEGMENT_FILES', True)
+    create_sensor_hub(hub_name="SegmentHub", ser_no=784, ch_names=['BMA380_temp'])
+    monkeypatch.setattr(channels, 'USE_SEGMENT_FILES', False)
+    create_sensor_hub(hub_name="ChunkHub", ser_no=785, ch_names=['BMA380_temp'])
+    with channels.db_session:
+        flags = {ch.to_hub.ser_no: ch.use_segments for ch in channels.ChannelData.select(lambda ch: ch.to_hub.ser_no in (784, 785))}
+    assert flags == {784: True, 785: False}
+
+
+def test_segment_round_trip(channel_db, segment_dir, samples, monkeypatch):
+    t_values, y_values = samples
+    monkeypatch.setattr(channels, 'USE_SEGMENT_FILES', True)
+    ingest(786, t_values, y_values, num_parts=1)
+    data = get_sensor_data(hub_id=786, ch_name='BMA380_temp', as_arrays=True)
+    assert same_bits(data.sensor_values, y_values)
+    assert list(segment_dir.glob("*.seg"))
+    # ONE block --> columns are strided views on mapped segment file, made contiguous only by 'memoryviews()':
+    assert not data.sensor_values.flags['C_CONTIGUOUS']
+    _, values = data.memoryviews()
+    assert values.c_contiguous and same_bits(np.frombuffer(values, dtype=np.float64), y_values)
+    # Range read, from several blocks:
+    add_array_data_to_hub(id=786, ch_name='BMA380_temp', time_points=t_values[-1] + np.arange(1.0, 101.0), data_points=np.arange(100.0))
+    start, end = float(t_values[-11] + t_values[-10]) / 2, float(t_values[-1]) + 40.5
+    data = get_sensor_data(hub_id=786, ch_name='BMA380_temp', start=start, end=end, as_arrays=True)
+    assert same_bits(data.sensor_values, np.concatenate((y_values[-10:], np.arange(40.0))))
+    data = get_sensor_data(hub_id=786, ch_name='BMA380_temp', start=start, limit=5, as_arrays=True)
+    assert same_bits(data.sensor_values, np.arange(95.0, 100.0))
@@ -0,0 +1,97 @@
+"""
+@file test_ingest_queue.py
+
+@brief Tests of the coalescing ingest queue in 'ingest_queue.py':
+- batches are merged per (hub, channel) and written by 'channels.add_batches_to_hubs()' - from the executor thread, into the shared DB
+- only samples actually written are counted
+- a failed flush keeps its batches pending (in time-order), and they are written by the next flush
+
+Run:  python -m pytest test_ingest_queue.py
+"""
+
+import asyncio
+
+import numpy as np
+
+from channels import add_batches_to_hubs, get_sensor_data
+from ingest_queue import IngestQueue
+
+
+START_TIME = 1_700_000_000.0
+
+
+class FlakyWriter():
+    """ 'flush_fn' that fails its first 'num_failures' calls - and records batches of the calls that succeed """
+    def __init__(self, num_failures: int) -> None:
+        self.num_failures = num_failures
+        self.written = list()
+
+    def __call__(self, batches: dict) -> int:
+        if self.num_failures > 0:
+            self.num_failures -= 1
+            raise RuntimeError("DB is down")
+        self.written.append(batches)
+        return sum(time_points.size for time_points, _ in batches.values())
+
+
+def test_flush_to_channel_store(channel_db):
+    async def ingest():
+        queue = IngestQueue(flush_fn=add_batches_to_hubs, max_batch_samples=120)
+        await queue.start()
+        for idx in range(5):
+            time_points = START_TIME + np.arange(idx * 50, (idx + 1) * 50, dtype=np.float64)
+            await queue.put(223, 'ADXL255_accel', time_points, time_points - START_TIME)
+            await queue.put(223, 'BMA380_temp', time_points, -time_points)
+        await queue.put(223, 'no_such_channel', [START_TIME], [1.0])               # Skipped - i.e. NOT counted
+        await queue.put(323, 'BMA380_temp', [START_TIME + 1, START_TIME], [1.0, 2.0])  # NOT in time-order - skipped
+        await queue.stop()
+        return queue
+
+    queue = asyncio.run(ingest())
+    assert queue.num_flushes >= 2 and queue.num_failed_flushes == 0
+    assert queue.num_samples_flushed == 500
+    data = get_sensor_data(hub_id=223, ch_name='ADXL255_accel', as_arrays=True)
+    assert np.array_equal(data.sensor_values, np.arange(250.0))
+    assert len(get_sensor_data(hub_id=223, ch_name='BMA380_temp', as_arrays=True)) == 250
+    assert len(get_sensor_data(hub_id=323, ch_name='BMA380_temp', as_arrays=True)) == 0
+
+
+def test_failed_flush_keeps_batches():
+    writer = FlakyWriter(num_failures=1)
+
+    async def ingest():
+        queue = IngestQueue(flush_fn=writer, max_batch_samples=10, max_latency=0.05)
+        await queue.start()
+        await queue.put(1, 'ch', [1.0, 2.0, 3.0, 4.0, 5.0, 6.0, 7.0, 8.0, 9.0, 10.0], np.arange(10.0))     # --> flush fails
+        await queue.put(1, 'ch', [11.0, 12.0], [10.0, 11.0])
+        await asyncio.sleep(0.2)            # --> retried after 'max_latency'
+        stats = (queue.num_failed_flushes, queue.num_flushes, queue.num_samples_flushed)
+        await queue.stop()
+        return stats
+
+    assert asyncio.run(ingest()) == (1, 1, 12)
+    assert len(writer.written) == 1
+    time_points, data_points = writer.written[0][(1, 'ch')]
+    assert time_points.tolist() == list(range(1, 13)) and data_points.tolist() == list(range(12))
+
+
+def test_stop_raises_if_final_flush_fails():
+    writer = FlakyWriter(num_failures=1)
+
+    async def ingest():
+        queue = IngestQueue(flush_fn=writer)
+        await queue.start()
+        await queue.put(1, 'ch', [1.0, 2.0], [3.0, 4.0])
+        try:
+            await queue.stop()
+        except RuntimeError:
+            pass
+        else:
+            raise AssertionError("'stop()' did NOT raise")
+        assert queue.num_pending == 2 and queue.num_samples_flushed == 0
+        await queue.flush()                 # Retry by caller
+        return queue
+
+    queue = asyncio.run(ingest())
+    assert queue.num_pending == 0 and queue.num_samples_flushed == 2
+    assert writer.written[0][(1, 'ch')][0].tolist() == [1.0, 2.0]
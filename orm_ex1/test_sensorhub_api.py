@@ -0,0 +1,284 @@
+"""
+@file test_sensorhub_api.py
+
+@brief Tests of the Pony API in 'pony_crud/' (in-process, w. FastAPI's 'TestClient' and in-memory SQLite DB) - no API server needed:
+- partitions: PostgreSQL parent table gets the name Pony maps 'ChannelData' to
+- bulk ingest: JSON array and NDJSON bodies; malformed bodies and NaN/Inf/out-of-range values are rejected (400), unparsed input is bounded
+- cursor paging: every sample visited once, in time-order - also w. duplicate time-points and a time-range
+- ETags: 304 while unchanged, new ETag after ingest AND after CRUD writes
+- CRUD routes: none for 'SampleRollup'; CRUD writes of 'ChannelData' keep rollups up to date
+- aggregates: from rollups (whole minutes/hours) and from raw samples, same as computed from the samples
+
+Run:  python -m pytest test_sensorhub_api.py
+"""
+
+import asyncio
+import json
+import math
+import os
+import random
+import sys
+
+from fastapi.testclient import TestClient
+import pytest
+
+# Pony API modules import each other w. flat imports - i.e. run from their own folder:
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pony_crud"))
+
+import sensorhub_api as api
+import partitions
+from db_actions import add_channel, add_hub
+from models import ChannelData
+from versions import bump_all_versions
+from sample_routes import MAX_PENDING_CHARS, SampleParseError, iter_json_array_items
+
+
+API_KEY = "test123"
+HEADERS = {'api_key': API_KEY}
+HUB, INGEST_HUB, CRUD_HUB, CHANNEL = 4711, 4712, 4713, "test_temp"
+START_TIME = 1_700_000_000.0
+NUM_SAMPLES = 2500
+PAGE_SIZE = 300
+
+
+def generate_samples(num_samples: int, start: float = START_TIME) -> list:
+    """ (time, value)-pairs - irregular time-steps, some duplicate time-points (paging must still visit each sample once) """
+    samples = list()
+    time_point = start
+    for idx in range(num_samples):
+        if idx % 10:
+            time_point += random.uniform(0.1, 5.0)
+        samples.append([time_point, random.uniform(-100.0, 100.0)])
+    return samples
+
+
+def samples_url(ser_no: int = HUB) -> str:
+    return f"/hubs/{ser_no}/channels/{CHANNEL}/samples"
+
+
+def read_all_pages(client: TestClient, url: str, page_size: int = PAGE_SIZE, **params) -> tuple:
+    """ Follow 'next_cursor' until last page - returns (ALL samples, no. of pages) """
+    samples, num_pages, cursor = list(), 0, None
+    while True:
+        query = {**params, 'limit': page_size, **({'cursor': cursor} if cursor else {})}
+        response = client.get(url, params=query, headers=HEADERS)
+        assert response.status_code == 200, response.text[:100]
+        page = response.json()
+        samples.extend(page['samples'])
+        num_pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            return samples, num_pages
+
+
+def raw_aggregates(samples: list, bucket_width: float) -> dict:
+    """ Bucket START --> (count, sum, min, max, sum of squares) - straight from samples """
+    buckets = dict()
+    for time_point, value in samples:
+        agg = buckets.setdefault(math.floor(time_point / bucket_width) * bucket_width, [0, 0.0, math.inf, -math.inf, 0.0])
+        agg[0] += 1
+        agg[1] += value
+        agg[2] = min(agg[2], value)
+        agg[3] = max(agg[3], value)
+        agg[4] += value * value
+    return buckets
+
+
+def assert_aggregates_match(aggregates: list, expected: dict) -> None:
+    assert len(aggregates) == len(expected)
+    for agg in aggregates:
+        count, total, min_val, max_val, sum_sq = expected[agg['bucket']]
+        assert (agg['count'], agg['min'], agg['max']) == (count, min_val, max_val)
+        mean = total / count
+        assert math.isclose(agg['mean'], mean, abs_tol=1e-9)
+        assert math.isclose(agg['std'], math.sqrt(max(sum_sq / count - mean * mean, 0.0)), abs_tol=1e-6)
+
+
+def get_aggregates(client: TestClient, ser_no: int, bucket_width: float) -> list:
+    response = client.get(f"/hubs/{ser_no}/channels/{CHANNEL}/aggregates", params={'bucket_width': bucket_width}, headers=HEADERS)
+    assert response.status_code == 200, response.text[:100]
+    return response.json()['aggregates']
+
+
+@pytest.fixture(scope="module")
+def client():
+    """
+    API client - w. CRUD routes as in 'sensorhub_api.py' (which also set the API key), a channel, and hubs for tests that need
+    stored samples ('HUB'), for ingest tests ('INGEST_HUB') and for CRUD writes of samples ('CRUD_HUB')
+    """
+    random.seed(42)
+    add_channel(name=CHANNEL, description="Test temp reading", si_unit="Celcius")
+    add_hub(hub_name="TestHub", ser_no=HUB)
+    add_hub(hub_name="IngestHub", ser_no=INGEST_HUB)
+    add_hub(hub_name="CrudHub", ser_no=CRUD_HUB)
+    api.create_split_crud_routes(api.db, api.read_db, api.app, prefix="/test_api", api_key=API_KEY, on_write=bump_all_versions,
+                                 exclude_tables=("SampleRollup",), write_hooks={'ChannelData': api.track_sample_writes})
+    with TestClient(api.app) as client:
+        yield client
+
+
+@pytest.fixture(scope="module")
+def stored(client):
+    """ Samples ingested into 'HUB' (JSON array AND NDJSON), incl. a -0.0 - sorted by time (stable, i.e. duplicates in insert-order) """
+    samples = generate_samples(NUM_SAMPLES)
+    samples[7][1] = -0.0
+    assert client.post(samples_url(), json=samples[:2000], headers=HEADERS).status_code == 200
+    ndjson = "\n".join(json.dumps(sample) for sample in samples[2000:]) + "\n"
+    assert client.post(samples_url(), content=ndjson, headers={**HEADERS, 'Content-Type': "application/x-ndjson"}).status_code == 200
+    return sorted(samples, key=lambda sample: sample[0])
+
+
+# ****************************************** Partitions *********************************************
+
+def test_partitioned_parent_is_mapped_table(monkeypatch):
+    """
+    On PostgreSQL, parent table is created BEFORE 'db.generate_mapping()' - so it MUST get the name mapping then picks for 'ChannelData'
+    (lower-cased by Pony's PostgreSQL provider), else Pony creates a 2nd, unpartitioned table
+    """
+    mapped = ChannelData._table_
+    monkeypatch.setattr(ChannelData, '_table_', None)           # As before mapping
+    assert partitions.parent_table() == mapped
+    monkeypatch.setattr(type(api.db.provider), 'normalize_name', lambda provider, name: name[:provider.max_name_len].lower())   # As PostgreSQL
+    assert partitions.parent_table() == "channeldata"
+    assert partitions.partition_name(0.0) == "channeldata_p19700101"
+    assert partitions.partition_start_from_name("channeldata_p19700102") == 86400.0
+
+
+# ****************************************** Bulk ingest *********************************************
+
+def test_json_array_and_ndjson_ingest(client):
+    samples = generate_samples(1500)
+    response = client.post(samples_url(INGEST_HUB), json=samples[:1000], headers=HEADERS)
+    assert response.status_code == 200 and response.json() == {'received': 1000, 'inserted': 1000}
+    ndjson = "\n".join(json.dumps(sample) for sample in samples[1000:])       # No newline after last line
+    response = client.post(samples_url(INGEST_HUB), content=ndjson, headers={**HEADERS, 'Content-Type': "application/x-ndjson"})
+    assert response.status_code == 200 and response.json() == {'received': 500, 'inserted': 500}
+    objects = [{'time_point': time_point, 'data_point': data_point} for time_point, data_point in generate_samples(3, start=samples[-1][0])]
+    response = client.post(samples_url(INGEST_HUB), json=objects, headers=HEADERS)
+    assert response.status_code == 200 and response.json()['inserted'] == 3
+
+
+@pytest.mark.parametrize("body", ['[[1,2],,[3,4]]', '[,[1,2]]', '[[1,2][3,4]]', '[[1,2]]]', '[[1,2],]', '[[1,2]', '{}', '[1, 2]',
+                                  '[[1, 2, 3]]', '[[1, "2"]]', '[[1, true]]', '[[1, NaN]]', '[[1, Infinity]]', '[[1, 1e999]]',
+                                  '[[1, 1' + '0' * 400 + ']]'])
+def test_malformed_body_rejected(client, body):
+    response = client.post(samples_url(INGEST_HUB), content=body, headers={**HEADERS, 'Content-Type': "application/json"})
+    assert response.status_code == 400, response.text[:100]
+
+
+def test_out_of_range_integer_is_bad_value(client):
+    """ An integer too large for a float is a bad value (400) - NOT a too large request (413) """
+    body = '[[1, 1' + '0' * 400 + ']]'
+    response = client.post(samples_url(INGEST_HUB), content=body, headers={**HEADERS, 'Content-Type': "application/json"})
+    assert response.status_code == 400 and "out of float range" in response.json()['detail']
+    response = client.post(samples_url(INGEST_HUB), content=body, headers={**HEADERS, 'Content-Type': "application/x-ndjson"})
+    assert response.status_code == 400
+
+
+def test_pending_input_is_bounded():
+    """ An element that never completes is rejected once MAX_PENDING_CHARS are pending - i.e. long before whole body is buffered """
+    num_sent = 0
+
+    async def endless_element():
+        nonlocal num_sent
+        yield b"[[1, 2"
+        while num_sent < 100 * MAX_PENDING_CHARS:
+            num_sent += 1024
+            yield b" " * 1024
+
+    async def parse():
+        async for _ in iter_json_array_items(endless_element()):
+            pass
+
+    with pytest.raises(SampleParseError):
+        asyncio.run(parse())
+    assert num_sent <= 2 * MAX_PENDING_CHARS
+
+
+# ****************************************** Cursor paging *********************************************
+
+def test_paging_visits_every_sample_once(client, stored):
+    paged, num_pages = read_all_pages(client, samples_url())
+    assert paged == stored
+    assert num_pages == math.ceil(NUM_SAMPLES / PAGE_SIZE)
+
+
+def test_paging_keeps_negative_zero(client, stored):
+    """ SQLite stores -0.0 as 0.0 - PostgreSQL keeps the sign """
+    zero_time = next(time_point for time_point, value in stored if value == 0.0)
+    paged, _ = read_all_pages(client, samples_url(), start=zero_time, end=zero_time)
+    zero = next(value for _, value in paged if value == 0.0)
+    assert api.db.provider_name != 'postgres' or math.copysign(1.0, zero) < 0
+
+
+def test_paging_time_range(client, stored):
+    start, end = stored[500][0], stored[1500][0]
+    paged, _ = read_all_pages(client, samples_url(), page_size=77, start=start, end=end)
+    assert paged == [sample for sample in stored if start <= sample[0] <= end]
+
+
+def test_invalid_cursor_rejected(client):
+    response = client.get(samples_url(), params={'cursor': "not-a-cursor"}, headers=HEADERS)
+    assert response.status_code == 400
+
+
+# ****************************************** ETags *********************************************
+
+@pytest.mark.parametrize("url", [samples_url(), f"/hubs/{HUB}/data"])
+def test_etag_changes_on_writes(client, stored, url):
+    etag = client.get(url, headers=HEADERS).headers['etag']
+    assert client.get(url, headers={**HEADERS, 'If-None-Match': etag}).status_code == 304
+    # Ingest:
+    assert client.post(samples_url(), json=[[START_TIME - 1.0, 1.0]], headers=HEADERS).status_code == 200
+    response = client.get(url, headers={**HEADERS, 'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['etag'] != etag
+    etag = response.headers['etag']
+    response = client.put(f"/test_api/SensorHub/{HUB}", json={'name': f"TestHub_{etag}"}, headers=HEADERS)
+    assert response.status_code == 200, response.text[:100]
+    response = client.get(url, headers={**HEADERS, 'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['etag'] != etag
+
+
+# ****************************************** CRUD routes *********************************************
+
+def test_no_crud_routes_for_rollups(client):
+    paths = client.get("/openapi.json").json()['paths']
+    assert not any("SampleRollup" in path for path in paths)
+    assert "/test_api/ChannelData" in paths
+
+
+def test_crud_sample_writes_update_rollups(client):
+    """ POST, PUT (moved to another hour) and DELETE of samples thru CRUD - rollups (1h-buckets) follow, and so does the ETag """
+    ch_id = client.get("/test_api/Channel", params={'name': CHANNEL}, headers=HEADERS).json()[0]['ch_id']
+    url = f"/hubs/{CRUD_HUB}/channels/{CHANNEL}/aggregates"
+    etag = client.get(url, params={'bucket_width': 3600}, headers=HEADERS).headers['etag']
+    samples = [[START_TIME + 10.0, 2.0], [START_TIME + 20.0, 4.0]]
+    for time_point, data_point in samples:
+        response = client.post("/test_api/ChannelData", json={'time_point': time_point, 'data_point': data_point, 'from_channel': ch_id,
+                                                              'to_hub': CRUD_HUB}, headers=HEADERS)
+        assert response.status_code == 200, response.text[:100]
+    assert_aggregates_match(get_aggregates(client, CRUD_HUB, 3600), raw_aggregates(samples, 3600))
+    response = client.get(url, params={'bucket_width': 3600}, headers={**HEADERS, 'If-None-Match': etag})
+    assert response.status_code == 200 and response.headers['etag'] != etag
+    #
+    data_ids = [row['data_id'] for row in client.get("/test_api/ChannelData", params={'to_hub': CRUD_HUB}, headers=HEADERS).json()]
+    data_ids.sort()
+    samples[0] = [START_TIME + 7200.0, -1.0]
+    response = client.put(f"/test_api/ChannelData/{data_ids[0]}", json={'time_point': samples[0][0], 'data_point': samples[0][1],
+                                                                        'from_channel': ch_id, 'to_hub': CRUD_HUB}, headers=HEADERS)
+    assert response.status_code == 200, response.text[:100]
+    assert_aggregates_match(get_aggregates(client, CRUD_HUB, 3600), raw_aggregates(samples, 3600))
+    #
+    assert client.delete(f"/test_api/ChannelData/{data_ids[1]}", headers=HEADERS).status_code == 200
+    assert_aggregates_match(get_aggregates(client, CRUD_HUB, 3600), raw_aggregates(samples[:1], 3600))
+    assert_aggregates_match(get_aggregates(client, CRUD_HUB, 1), raw_aggregates(samples[:1], 1))
+
+
+# ****************************************** Aggregates *********************************************
+
+@pytest.mark.parametrize("bucket_width", [60, 3600, 7.5])
+def test_aggregates_match_samples(client, stored, bucket_width):
+    """ Whole minutes/hours from rollups, 7.5s from raw samples - compared to ALL samples of hub (i.e. also those of other tests) """
+    samples, _ = read_all_pages(client, samples_url(), page_size=1000)
+    assert len(samples) >= NUM_SAMPLES
+    assert_aggregates_match(get_aggregates(client, HUB, bucket_width), raw_aggregates(samples, bucket_width))
@@ -12,6 +12,9 @@ from dataclasses import dataclass, asdict, field
 # If plotting data is required:
 import matplotlib.pyplot as plt
 
+from downsample import downsample
+from stream_export import iter_sample_blocks, write_blocks
+
 from requests.auth import HTTPBasicAuth
 import requests
 
@@ -47,29 +50,27 @@ class SensorData():
             sensor_values.append(v)
         return time_values, sensor_values
     
-    def info(self):
-        print("================================================================")
-        print("Sensor-data INFO")
-        print("================================================================")
-        print(f"Hub name: {self.hub_name}")
-        print(f"Hub ID: {self.hub_id}")
-        print(f"Channel name: {self.ch_name}")
-        print(f"Description: {self.ch_desc}")
-        print(f"Channel ID: {self.ch_id}")
-        print(f"START-time (first sample): {datetime.fromtimestamp(self.start_datetime)}")
-
-    def show(self):
-        self.info()
+    def info(self, sink=None):
+        print("================================================================", file=sink)
+        print("Sensor-data INFO", file=sink)
+        print("================================================================", file=sink)
+        print(f"Hub name: {self.hub_name}", file=sink)
+        print(f"Hub ID: {self.hub_id}", file=sink)
+        print(f"Channel name: {self.ch_name}", file=sink)
+        print(f"Description: {self.ch_desc}", file=sink)
+        print(f"Channel ID: {self.ch_id}", file=sink)
+        print(f"START-time (first sample): {datetime.fromtimestamp(self.start_datetime)}", file=sink)
+
+    def show(self, sink=None):
+        """ Show info and ALL samples - written in large, formatted blocks to 'sink' (default: stdout) """
+        self.info(sink=sink)
         #
-        print("----------------------------------------------------------------")
-        print("Data:")
-        for time_val, sample_val in self.data:
-            #time_val, sample_val = tv_pair
-            # Get Epoch-time (i.e. 'absolute' time) from START-time + delta-time:
-            absolute_date_time = self.start_datetime + time_val
-            #
-            print(f"DateTime: {datetime.fromtimestamp(absolute_date_time)}\t\tValue = {sample_val:.3f} {self.unit}")
-        print("----------------------------------------------------------------\n")
+        print("----------------------------------------------------------------", file=sink)
+        print("Data:", file=sink)
+        # Get Epoch-time (i.e. 'absolute' time) from START-time + delta-time:
+        time_values, sensor_values = self.sensor_data
+        write_blocks(iter_sample_blocks(time_values, sensor_values, start_datetime=self.start_datetime, unit=self.unit), sink=sink)
+        print("----------------------------------------------------------------\n", file=sink)
 
     def get(self):
         return asdict(self)
@@ -78,7 +79,11 @@ class SensorData():
 # Helper functions:
 
 def plot_time_series(t_values, y_values, title: str = "Time-series Plot", xlabel: str = 'DeltaTime', ylabel: str = 'Value', 
-                    color: str = 'tab:red', x_relative_size: int = 16, y_relative_size: int = 5, resolution_dpi: int = 100):
+                    color: str = 'tab:red', x_relative_size: int = 16, y_relative_size: int = 5, resolution_dpi: int = 100,
+                    max_points: int = None, method: str = "lttb"):
+    # No point in plotting (many) more points than there are pixels ...
+    if max_points is not None and len(t_values) > max_points:
+        t_values, y_values = downsample(t_values, y_values, method=method, num_points=max_points)
     plt.figure(figsize=(x_relative_size, y_relative_size), dpi=resolution_dpi)
     plt.plot(t_values, y_values, color=color)
     plt.ylim(0, 100)
@@ -357,6 +362,6 @@ if __name__ == "__main__":
     #
     tv, dv = UUT.sensor_data
     #
-    plot_time_series(t_values=tv, y_values=dv, title=plot_title, ylabel=plot_legend)
+    plot_time_series(t_values=tv, y_values=dv, title=plot_title, ylabel=plot_legend, max_points=2000)
 
 